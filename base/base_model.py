@@ -1,26 +1,62 @@
 import tensorflow as tf
+from base.checkpoint_manager import CheckpointManager
 from utils.logger import Logger
+from utils import random_inputs
 
 
 class BaseModel:
-    def __init__(self, config):
+    def __init__(self, config, data=None):
         self.config = config
+        # DataGenerator whose iterators feed the image input, None for a placeholder input
+        self.data = data
         log_object = Logger(self.config)
         self.logger = log_object.get_logger(__name__)
+        self.checkpoints = CheckpointManager(self.config, self.logger)
+        # Every random input of the graph gets its own op seed derived from the config
+        self.next_seed = self.config.data_loader.random_seed or 0
+        # Switch of the instance noise inputs, created with the first of them
+        self.instance_noise = None
+        # Number of in-graph replicas sharing every train batch, see build_replicas
+        self.replicas = self.config.trainer.replicas or 1
         # init the global step
         self.init_global_step()
         # init the epoch counter
         self.init_cur_epoch()
 
-    # save function that saves the checkpoint in the path defined in the config file
-    def save(self, sess):
-        self.logger.info("Saving model...")
-        self.saver.save(sess, self.config.log.checkpoint_dir, self.global_step_tensor)
-        self.logger.info("Model saved")
+    def save(self, sess, phase=None, force=False):
+        """
+        Saves a checkpoint in the path defined in the config file when the policy of the
+        config asks for one, see CheckpointManager. The checkpoint is written in the
+        background, wait_saves blocks until it is on disk.
+        Args:
+            sess: session of the model
+            phase: tag of the phase of the trainer, e.g. "gan", None for a single phase
+            force: save whatever the policy, e.g. at the end of a phase
+        """
+        self.checkpoints.save(sess, self.global_step_tensor, phase, force)
 
-    # load latest checkpoint from the experiment path defined in the config file
-    def load(self, sess):
-        latest_checkpoint = tf.train.latest_checkpoint(self.config.log.checkpoint_dir)
+    def save_best(self, sess, metric, phase=None):
+        """
+        Saves a checkpoint tagged phase_best, or best, when metric is the lowest so far
+        Args:
+            sess: session of the model
+            metric: validation metric, lower is better
+            phase: tag of the phase of the trainer
+        """
+        self.checkpoints.save_best(sess, self.global_step_tensor, metric, phase)
+
+    def wait_saves(self):
+        self.checkpoints.wait()
+
+    def load(self, sess, phase=None):
+        """
+        Loads the latest checkpoint from the experiment path defined in the config file
+        Args:
+            sess: session of the model
+            phase: tag of the checkpoint, e.g. "gan", "enc_rec" or "gan_best", None for the
+                last checkpoint of any phase
+        """
+        latest_checkpoint = self.checkpoints.latest(phase)
         if latest_checkpoint:
             self.logger.info("Loading model checkpoint {} ...\n".format(latest_checkpoint))
             self.saver.restore(sess, latest_checkpoint)
@@ -42,6 +78,364 @@ class BaseModel:
         with tf.variable_scope("global_step"):
             self.global_step_tensor = tf.Variable(0, trainable=False, name="global_step")
 
+    def init_image_input(self, shape, name="x"):
+        """
+        Image input of the model. When the model is built with a DataGenerator the input
+        defaults to the next batch of its iterators, so that a step is a single sess.run
+        without any image in the feed_dict. The batch comes from the training iterator, or
+        from the test iterator when input_from_test is fed with True, in which case
+        input_label holds the labels of the test batch and input_valid masks out the padding
+        of its last batch. The last training batch is kept in the graph: feeding reuse_batch
+        with True runs the step on it again instead of taking a new one, e.g. for the
+        critic iterations sharing a batch. Feeding the returned tensor overrides the
+        iterators, which keeps ad-hoc inference working.
+        Args:
+            shape: shape of the input, batch dimension included
+            name: name of the input tensor
+        Returns:
+            the image input tensor
+        """
+        if self.data is None:
+            self.input_from_test = None
+            self.input_label = None
+            self.input_valid = None
+            self.reuse_batch = None
+            return tf.placeholder(tf.float32, shape=shape, name=name)
+        data = self.data
+        self.reuse_batch = tf.placeholder_with_default(False, [], name="reuse_batch")
+        # Local variable, it is never saved in the checkpoints
+        last_batch = tf.Variable(
+            tf.zeros([0] + shape[1:], tf.float32),
+            trainable=False,
+            collections=[tf.GraphKeys.LOCAL_VARIABLES],
+            validate_shape=False,
+            name="last_batch",
+        )
+
+        def next_batch():
+            return tf.cond(
+                self.reuse_batch,
+                lambda: tf.identity(last_batch),
+                lambda: tf.identity(tf.assign(last_batch, data.next_batch(), validate_shape=False)),
+            )
+
+        if not hasattr(data, "test_iterator"):
+            # Modes without test set, the input only comes from the training iterator
+            self.input_from_test = None
+            self.input_label = None
+            self.input_valid = None
+            return tf.placeholder_with_default(next_batch(), shape, name=name)
+        label_dtype = data.test_label.dtype
+
+        # The iterators are only advanced by the branch that is taken
+        def train_batch():
+            image = next_batch()
+            rows = tf.shape(image)[:1]
+            return image, tf.zeros(rows, dtype=label_dtype), tf.ones(rows, dtype=tf.bool)
+
+        def test_batch():
+            # The validity mask is the last element of the test batches
+            batch = data.next_test_batch()
+            return batch[0], batch[1], batch[-1]
+
+        self.input_from_test = tf.placeholder_with_default(False, [], name="input_from_test")
+        image, self.input_label, self.input_valid = tf.cond(
+            self.input_from_test, test_batch, train_batch
+        )
+        return tf.placeholder_with_default(image, shape, name=name)
+
+    def op_seed(self, count=1):
+        seed = self.next_seed
+        self.next_seed += count
+        return seed
+
+    def draw_noise(self, batch_size):
+        """
+        Latent noise drawn inside the graph, with its own op seed
+        """
+        return random_inputs.latent_noise(
+            batch_size, self.config.trainer.noise_dim, seed=self.op_seed()
+        )
+
+    def init_noise_input(self, batch_size, name="noise"):
+        """
+        Latent noise drawn inside the graph at every run, feeding the returned tensor
+        overrides it.
+        Args:
+            batch_size: scalar tensor, usually the batch size of the image input
+            name: name of the input tensor
+        """
+        noise = self.draw_noise(batch_size)
+        return tf.placeholder_with_default(noise, [None, self.config.trainer.noise_dim], name=name)
+
+    def draw_labels(self, batch_size, noise_probability=None):
+        """
+        Targets of the discriminator drawn inside the graph, see init_label_inputs
+        """
+        if noise_probability is None:
+            noise_probability = self.config.trainer.noise_probability or 0.0
+        return random_inputs.discriminator_labels(
+            batch_size,
+            soft_labels=self.config.trainer.soft_labels,
+            flip_labels=self.config.trainer.flip_labels,
+            noise_probability=noise_probability,
+            seed=self.op_seed(4),
+        )
+
+    def init_label_inputs(self, batch_size, noise_probability=None):
+        """
+        Targets of the discriminator drawn inside the graph with the soft_labels,
+        flip_labels and noise_probability of the trainer config.
+        Args:
+            batch_size: scalar tensor, usually the batch size of the image input
+            noise_probability: overrides the fraction of flipped soft labels of the config
+        Returns:
+            true_labels, generated_labels inputs
+        """
+        true_labels, generated_labels = self.draw_labels(batch_size, noise_probability)
+        return (
+            tf.placeholder_with_default(true_labels, [None, 1], name="true_labels"),
+            tf.placeholder_with_default(generated_labels, [None, 1], name="gen_labels"),
+        )
+
+    def draw_instance_noise(
+        self, batch_size, include_noise=None, sigma_start=0.75, sigma_min=0.05
+    ):
+        """
+        Instance noise drawn inside the graph, see init_instance_noise
+        """
+        if include_noise is None:
+            include_noise = self.config.trainer.include_noise
+        noise = random_inputs.instance_noise(
+            tf.stack([batch_size] + self.config.trainer.image_dims),
+            self.cur_epoch_tensor,
+            include_noise=include_noise,
+            sigma_start=sigma_start,
+            sigma_min=sigma_min,
+            seed=self.op_seed(),
+        )
+        if self.instance_noise is None:
+            self.instance_noise = tf.placeholder_with_default(True, [], name="instance_noise")
+        return noise * tf.cast(self.instance_noise, tf.float32)
+
+    def init_instance_noise(
+        self, batch_size, name, include_noise=None, sigma_start=0.75, sigma_min=0.05
+    ):
+        """
+        Instance noise annealed with the epoch counter, zeros unless include_noise is set
+        in the trainer config. Feeding instance_noise with False turns every instance noise
+        input of the model off, e.g. for the reconstruction checks.
+        Args:
+            batch_size: scalar tensor, number of images the noise is added to
+            name: name of the input tensor
+            include_noise: overrides include_noise of the config
+            sigma_start, sigma_min: annealing of the standard deviation, see instance_noise
+        """
+        noise = self.draw_instance_noise(batch_size, include_noise, sigma_start, sigma_min)
+        shape = [None] + self.config.trainer.image_dims
+        return tf.placeholder_with_default(noise, shape, name=name)
+
+    def init_fused_train_op(self, step, names, num_steps=None, name="fused_train"):
+        """
+        Op running num_steps full training steps in a single sess.run. The steps are chained
+        by a tf.while_loop whose body is built by step: the forward passes of the step are
+        rebuilt inside the loop on batches taken from the iterators in the graph, and its
+        updates are ordered with control dependencies, see loop_update.
+        Args:
+            step: function building one step, it returns the scalar losses of the step
+            names: names of the losses returned by step
+            num_steps: steps per run, fused_steps of the trainer config by default
+            name: name scope of the loop
+        Returns:
+            dict name -> mean of the loss over the steps of the run
+        """
+        if self.replicas > 1:
+            # The fused loop is not replicated, it would train on the batches scaled for them
+            raise ValueError("trainer.fused_steps is not supported with trainer.replicas above 1")
+        if num_steps is None:
+            num_steps = self.config.trainer.fused_steps or 1
+
+        def body(i, totals):
+            losses = step()
+            totals = [t + tf.cast(loss, tf.float32) for t, loss in zip(totals, losses)]
+            with tf.control_dependencies(totals):
+                return i + 1, totals
+
+        with tf.name_scope(name):
+            _, totals = tf.while_loop(
+                lambda i, _: i < num_steps,
+                body,
+                [tf.constant(0), [tf.constant(0.0) for _ in names]],
+                parallel_iterations=1,
+                back_prop=False,
+            )
+        return {n: total / num_steps for n, total in zip(names, totals)}
+
+    @staticmethod
+    def update_ops_mark():
+        """
+        Position in the UPDATE_OPS collection, the batch norm updates of a forward pass
+        built afterwards are found with loop_update_ops
+        """
+        return len(tf.get_collection(tf.GraphKeys.UPDATE_OPS))
+
+    @staticmethod
+    def loop_update_ops(mark, scope):
+        """
+        Batch norm updates added after mark that are inside a scope named scope, e.g.
+        "Discriminator_Model". The names of the ops built inside the fused loop are prefixed
+        with the loop and their scopes get suffixes, scope=... of get_collection does not
+        match them.
+        """
+        return [
+            op
+            for op in tf.get_collection(tf.GraphKeys.UPDATE_OPS)[mark:]
+            if scope in op.name.split("/")
+        ]
+
+    def loop_update(
+        self, optimizer, loss, var_list, update_ops=(), ema=None, global_step=False, after=None
+    ):
+        """
+        Update of var_list inside the fused train loop, the counterpart of a train op built
+        with minimize and ExponentialMovingAverage.apply. The optimizer slots and the moving
+        averages of the train op are shared, the averages are updated by hand since apply
+        can only be called once per variable.
+        Args:
+            optimizer: optimizer of the train op
+            loss: loss of the update
+            var_list: variables updated
+            update_ops: batch norm updates of the forward pass of loss
+            ema: ExponentialMovingAverage of var_list, updated after the step
+            global_step: increment the global step like the train op
+            after: function building ops run after the step and before the averages,
+                e.g. the weight clipping of WGAN
+        Returns:
+            loss, its value is available once the update is done
+        """
+        with tf.control_dependencies(update_ops):
+            op = optimizer.minimize(
+                loss,
+                var_list=var_list,
+                global_step=self.global_step_tensor if global_step else None,
+            )
+        if after is not None:
+            with tf.control_dependencies([op]):
+                op = after()
+        if ema is not None:
+            decay = self.config.trainer.ema_decay
+            with tf.control_dependencies([op]):
+                op = tf.group(
+                    *[
+                        tf.assign_sub(ema.average(v), (ema.average(v) - v) * (1 - decay))
+                        for v in var_list
+                    ]
+                )
+        with tf.control_dependencies([op]):
+            return tf.identity(loss)
+
+    def build_replicas(self, forward, inputs):
+        """
+        Data parallel training inside one graph. Every train batch is split in
+        trainer.replicas shards of nearly equal sizes and forward is built on each of them
+        under its own name scope. The replicas share the variables and have no dependency
+        on each other, so the session runs them concurrently on the cores of the machine.
+        The batch must hold at least one example per replica. Like the towers of multi-GPU
+        training, the batch norm layers of a replica normalize with the statistics of its
+        shard, and the moving statistics are updated from the shard of the first replica
+        only, see replicated_update.
+        Args:
+            forward: function of one shard of every input, it returns a dict of tensors
+                with the losses of the shard
+            inputs: tensors whose first dimension is the batch, e.g. the image input and
+                the noise drawn for it
+        Returns:
+            list with a dict per replica: the outputs of forward, the weight of the replica,
+            i.e. its fraction of the batch, and the batch norm updates of its forward pass
+        """
+        batch_size = tf.shape(inputs[0])[0]
+        k = self.replicas
+        sizes = [(batch_size + k - 1 - i) // k for i in range(k)]
+        shards = [tf.split(x, tf.stack(sizes), num=k) for x in inputs]
+        replicas = []
+        for i in range(k):
+            with tf.name_scope("replica_{}".format(i)):
+                mark = self.update_ops_mark()
+                outputs = forward(*[shard[i] for shard in shards])
+                replicas.append(
+                    {
+                        "outputs": outputs,
+                        "weight": tf.cast(sizes[i], tf.float32) / tf.cast(batch_size, tf.float32),
+                        "update_ops": tf.get_collection(tf.GraphKeys.UPDATE_OPS)[mark:],
+                    }
+                )
+        return replicas
+
+    @staticmethod
+    def replica_mean(replicas, name):
+        """
+        Mean over the whole batch of the output name of the replicas, e.g. a loss
+        """
+        return tf.add_n([r["weight"] * r["outputs"][name] for r in replicas])
+
+    def merge_replicas(self, replicas):
+        """
+        Outputs of forward for the whole batch: the scalars, i.e. the losses, are averaged
+        with replica_mean and the other outputs are concatenated along the batch
+        Returns:
+            dict with the keys of the outputs of forward
+        """
+        merged = {}
+        with tf.name_scope("merge_replicas"):
+            for name, output in replicas[0]["outputs"].items():
+                if output.shape.ndims == 0:
+                    merged[name] = self.replica_mean(replicas, name)
+                else:
+                    merged[name] = tf.concat([r["outputs"][name] for r in replicas], axis=0)
+        return merged
+
+    def replicated_update(self, optimizer, replicas, loss, var_list, scope, global_step=False):
+        """
+        Data parallel counterpart of optimizer.minimize, the moving averages of var_list are
+        applied after it like after minimize. Every replica computes the gradients of the loss of
+        its shard, they are averaged with the weights of the replicas, which gives the
+        gradients of the loss of the whole batch, and applied once. Only the batch norm
+        updates of the first replica are run: the moving statistics follow its shard, a
+        fraction of the batch, instead of the whole batch.
+        Args:
+            optimizer: optimizer of the train op, its slots are shared
+            replicas: replicas returned by build_replicas
+            loss: name of the loss in the outputs of the replicas
+            var_list: variables updated
+            scope: scope of the batch norm updates, e.g. "SENCEBGAN/Discriminator_Model", it
+                is matched as a prefix of the names without the replica scope, like scope=...
+                of get_collection without replicas
+            global_step: increment the global step like the train op
+        Returns:
+            update op
+        """
+        replica_grads = []
+        for i, replica in enumerate(replicas):
+            with tf.name_scope("replica_{}".format(i)):
+                replica_grads.append(
+                    tf.gradients(replica["weight"] * replica["outputs"][loss], var_list)
+                )
+        with tf.name_scope("average_gradients"):
+            grads_and_vars = [
+                (tf.add_n(list(grads)), v)
+                for grads, v in zip(zip(*replica_grads), var_list)
+                if None not in grads
+            ]
+        update_ops = [
+            op
+            for op in replicas[0]["update_ops"]
+            if op.name.replace("replica_0/", "", 1).startswith(scope)
+        ]
+        with tf.control_dependencies(update_ops):
+            return optimizer.apply_gradients(
+                grads_and_vars, global_step=self.global_step_tensor if global_step else None
+            )
+
     def init_saver(self):
         # just copy the following line in your child class
         # self.saver = tf.train.Saver(max_to_keep=self.config.max_to_keep)
@@ -1,15 +1,15 @@
 import tensorflow as tf
-from tqdm import tqdm
 import numpy as np
 import matplotlib
 
 matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 
+from base.step_loop import StepLoop, TrainSteps
 from utils.logger import Logger
 
 
-class BaseTrain:
+class BaseTrain(TrainSteps):
     def __init__(self, sess, model, data, config, summarizer):
         self.model = model
         self.summarizer = summarizer
@@ -21,6 +21,7 @@ class BaseTrain:
         self.init = tf.group(tf.global_variables_initializer(), tf.local_variables_initializer())
         self.sess.run(self.init)
         self.rows = int(np.sqrt(self.config.log.num_example_imgs_to_generate))
+        self.step_loop = StepLoop(self.config.trainer.progress_interval or 10.0)
         self.patience_lost = False
 
     def train(self):
@@ -32,6 +33,8 @@ class BaseTrain:
             self.sess.run(self.model.increment_cur_epoch_tensor)
             if self.patience_lost:
                 break
+        self.model.save(self.sess, force=True)
+        self.model.wait_saves()
 
     def test(self):
         self.logger.info("Testing is started")
@@ -43,12 +46,13 @@ class BaseTrain:
     def train_epoch(self):
         """
         implement the logic of epoch:
-        -loop over the number of iterations in the config and call the train step
+        -loop over the number of iterations in the config with run_steps and a step callback
+         calling the train step
         -add any summaries you want using the summary
         """
         raise NotImplementedError
 
-    def train_step(self, image, cur_epoch):
+    def train_step(self, cur_epoch):
         """
         implement the logic of the train step
         - run the tensorflow session
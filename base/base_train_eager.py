@@ -1,5 +1,4 @@
 import tensorflow as tf
-from tqdm import tqdm
 import matplotlib.pyplot as plt
 import numpy as np
 from utils.logger import Logger
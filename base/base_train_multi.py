@@ -1,15 +1,15 @@
 import tensorflow as tf
-from tqdm import tqdm
 import numpy as np
 import matplotlib
 
 matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 
+from base.step_loop import StepLoop, TrainSteps
 from utils.logger import Logger
 
 
-class BaseTrainMulti:
+class BaseTrainMulti(TrainSteps):
     def __init__(self, sess, model, data, config, summarizer):
         self.model = model
         self.summarizer = summarizer
@@ -21,6 +21,7 @@ class BaseTrainMulti:
         self.init = tf.group(tf.global_variables_initializer(), tf.local_variables_initializer())
         self.sess.run(self.init)
         self.rows = int(np.sqrt(self.config.log.num_example_imgs_to_generate))
+        self.step_loop = StepLoop(self.config.trainer.progress_interval or 10.0)
 
     def train(self):
         self.logger.info("Training of WGAN is started")
@@ -31,7 +32,8 @@ class BaseTrainMulti:
         ):
             self.train_epoch_gan()
             self.sess.run(self.model.increment_cur_epoch_tensor)
-            
+        self.model.save(self.sess, "gan", force=True)
+
         if self.config.trainer.reset_first_counter:
             self.sess.run(self.model.reset_cur_epoch_tensor)
 
@@ -43,6 +45,8 @@ class BaseTrainMulti:
         ):
             self.train_epoch_enc()
             self.sess.run(self.model.increment_cur_epoch_tensor)
+        self.model.save(self.sess, "enc", force=True)
+        self.model.wait_saves()
 
     def train_epoch_gan(self):
         """
@@ -60,7 +64,7 @@ class BaseTrainMulti:
         """
         raise NotImplementedError
 
-    def train_step_gan(self, image, cur_epoch):
+    def train_step_gan(self, cur_epoch):
         """
         implement the logic of the train step
         - run the tensorflow session
@@ -68,7 +72,7 @@ class BaseTrainMulti:
         """
         raise NotImplementedError
 
-    def train_step_enc(self, image, cur_epoch):
+    def train_step_enc(self, cur_epoch):
         """
         implement the logic of the train step
         - run the tensorflow session
@@ -1,15 +1,15 @@
 import tensorflow as tf
-from tqdm import tqdm
 import numpy as np
 import matplotlib
 
 matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 
+from base.step_loop import StepLoop, TrainSteps
 from utils.logger import Logger
 
 
-class BaseTrainSequential:
+class BaseTrainSequential(TrainSteps):
     def __init__(self, sess, model, data, config, summarizer):
         self.model = model
         self.summarizer = summarizer
@@ -21,6 +21,7 @@ class BaseTrainSequential:
         self.init = tf.group(tf.global_variables_initializer(), tf.local_variables_initializer())
         self.sess.run(self.init)
         self.rows = int(np.sqrt(self.config.log.num_example_imgs_to_generate))
+        self.step_loop = StepLoop(self.config.trainer.progress_interval or 10.0)
 
     def train(self):
         self.logger.info("Training of WGAN is started")
@@ -31,6 +32,7 @@ class BaseTrainSequential:
         ):
             self.train_epoch_gan()
             self.sess.run(self.model.increment_cur_epoch_tensor)
+        self.model.save(self.sess, "gan", force=True)
         if self.config.trainer.reset_first_counter:
             self.sess.run(self.model.reset_cur_epoch_tensor)
 
@@ -42,6 +44,7 @@ class BaseTrainSequential:
         ):
             self.train_epoch_enc_gen()
             self.sess.run(self.model.increment_cur_epoch_tensor)
+        self.model.save(self.sess, "enc_gen", force=True)
 
         self.sess.run(self.model.reset_cur_epoch_tensor)
 
@@ -53,6 +56,8 @@ class BaseTrainSequential:
         ):
             self.train_epoch_enc_rec()
             self.sess.run(self.model.increment_cur_epoch_tensor)
+        self.model.save(self.sess, "enc_rec", force=True)
+        self.model.wait_saves()
 
     def train_epoch_gan(self):
         """
@@ -78,7 +83,7 @@ class BaseTrainSequential:
         """
         raise NotImplementedError
 
-    def train_step_gan(self, image, cur_epoch):
+    def train_step_gan(self, cur_epoch):
         """
         implement the logic of the train step
         - run the tensorflow session
@@ -86,7 +91,7 @@ class BaseTrainSequential:
         """
         raise NotImplementedError
 
-    def train_step_enc_gen(self, image, cur_epoch):
+    def train_step_enc_gen(self, cur_epoch):
         """
         implement the logic of the train step
         - run the tensorflow session
@@ -94,7 +99,7 @@ class BaseTrainSequential:
         """
         raise NotImplementedError
 
-    def train_step_enc_rec(self, image, cur_epoch):
+    def train_step_enc_rec(self, cur_epoch):
         """
         implement the logic of the train step
         - run the tensorflow session
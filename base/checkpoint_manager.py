@@ -0,0 +1,165 @@
+import os
+import threading
+from time import time
+
+import tensorflow as tf
+
+
+class CheckpointManager:
+    def __init__(self, config, logger):
+        """
+        Writes the checkpoints of a model on a background thread. A save copies the variables
+        to shadow variables in a single run, the training goes on while the shadows are
+        written to disk. Every phase of a trainer gets its own tag, i.e. its own checkpoint
+        files and state file, and the best checkpoints of a tag are kept under tag_best.
+        Args:
+            config: config of the experiment, the policy is read from its log section:
+                save_epochs: a tag is written every save_epochs saves
+                save_minutes: a tag is also written when save_minutes went by since its last
+                    checkpoint, null to only count the epochs
+                max_to_keep: number of checkpoints kept per tag
+            logger: logger of the model
+        """
+        self.config = config
+        self.logger = logger
+        self.directory = self.config.log.checkpoint_dir
+        self.max_to_keep = self.config.log.max_to_keep
+        self.save_epochs = self.config.log.save_epochs or 1
+        self.save_minutes = self.config.log.save_minutes
+        self.snapshot_op = None
+        self.shadows = None
+        self.savers = {}
+        self.saves = {}
+        self.last_times = {}
+        self.last_steps = {}
+        self.best = {}
+        self.thread = None
+        self.error = None
+
+    @staticmethod
+    def latest_filename(tag):
+        """
+        Name of the state file of a tag, the untagged checkpoints use the default one
+        """
+        return "checkpoint_{}".format(tag) if tag else None
+
+    def prefix(self, tag):
+        return os.path.join(self.directory, tag) if tag else self.directory
+
+    def _build(self):
+        # The shadows belong to no collection, they are never initialized nor saved by the
+        # model saver and the snapshot assigns them before they are read
+        copies = []
+        self.shadows = {}
+        with tf.name_scope("checkpoint_snapshot"):
+            for var in tf.global_variables():
+                shadow = tf.Variable(
+                    tf.zeros(var.shape, var.dtype.base_dtype),
+                    trainable=False,
+                    collections=[],
+                    name=var.op.name,
+                )
+                copies.append(tf.assign(shadow, var))
+                self.shadows[var.op.name] = shadow
+            self.snapshot_op = tf.group(*copies)
+
+    def _saver(self, tag, max_to_keep):
+        if tag not in self.savers:
+            # The checkpoints keep the names of the model variables, the model saver restores
+            # them
+            self.savers[tag] = tf.train.Saver(self.shadows, max_to_keep=max_to_keep)
+        return self.savers[tag]
+
+    def due(self, tag):
+        """
+        Counts a save request of the tag and tells if the policy asks for a checkpoint
+        """
+        self.saves[tag] = self.saves.get(tag, 0) + 1
+        # The minutes of a tag are counted from its first save request
+        self.last_times.setdefault(tag, time())
+        if self.saves[tag] % self.save_epochs == 0:
+            return True
+        if self.save_minutes:
+            return time() - self.last_times[tag] >= 60 * self.save_minutes
+        return False
+
+    def save(self, sess, global_step_tensor, tag=None, force=False):
+        """
+        Args:
+            sess: session of the model
+            global_step_tensor: global step of the model, it numbers the checkpoints
+            tag: phase of the trainer, None for a single phase
+            force: write the checkpoint unless this step is already written for the tag
+        Returns:
+            True when a checkpoint is written
+        """
+        step = sess.run(global_step_tensor)
+        if force:
+            if self.last_steps.get(tag) == step:
+                return False
+        elif not self.due(tag):
+            return False
+        self.write(sess, step, tag, self.max_to_keep)
+        return True
+
+    def save_best(self, sess, global_step_tensor, metric, tag=None):
+        """
+        Writes a checkpoint under tag_best when metric is lower than every metric given
+        before for the tag, only the best checkpoint is kept
+        Returns:
+            True when the metric improved
+        """
+        best_tag = "{}_best".format(tag) if tag else "best"
+        if metric >= self.best.get(best_tag, float("inf")):
+            return False
+        self.best[best_tag] = metric
+        self.write(sess, sess.run(global_step_tensor), best_tag, 1)
+        return True
+
+    def write(self, sess, step, tag, max_to_keep):
+        if self.snapshot_op is None:
+            self._build()
+        saver = self._saver(tag, max_to_keep)
+        # The shadows of the previous checkpoint must be written before they are replaced
+        self.wait()
+        sess.run(self.snapshot_op)
+        self.last_steps[tag] = step
+        self.last_times[tag] = time()
+        self.thread = threading.Thread(
+            target=self._write, args=(sess, saver, step, tag), name="checkpoint_writer"
+        )
+        self.thread.start()
+
+    def _write(self, sess, saver, step, tag):
+        try:
+            path = saver.save(
+                sess,
+                self.prefix(tag),
+                global_step=step,
+                latest_filename=self.latest_filename(tag),
+                write_meta_graph=False,
+            )
+            if tag and not tag.endswith("best"):
+                # The default state file points to the last checkpoint of any phase
+                tf.train.update_checkpoint_state(self.directory, path)
+            self.logger.info("Model saved in {}".format(path))
+        except Exception as e:
+            self.error = e
+
+    def wait(self):
+        """
+        Blocks until the pending checkpoint is written, its error is raised here
+        """
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def latest(self, tag=None):
+        """
+        Returns:
+            path of the last checkpoint of the tag, None if there is none
+        """
+        return tf.train.latest_checkpoint(self.directory, self.latest_filename(tag))
@@ -0,0 +1,129 @@
+import itertools
+from time import time
+
+import numpy as np
+from tqdm import tqdm
+
+
+class RunningMean:
+    def __init__(self):
+        """
+        Mean of a stream of values kept in O(1) memory
+        """
+        self.count = 0
+        self.mean = 0.0
+
+    def update(self, value):
+        self.count += 1
+        self.mean += (float(np.mean(value)) - self.mean) / self.count
+
+
+class StepLoop:
+    def __init__(self, interval=10.0):
+        """
+        Runs the train steps of an epoch. The progress bar and the running means of the
+        losses are only redrawn every interval seconds and the loop never sleeps.
+        Args:
+            interval: seconds between two progress reports
+        """
+        self.interval = interval
+        # Steps per second of the last run
+        self.rate = None
+
+    def run(self, step, num_steps, description=""):
+        """
+        Args:
+            step: callback running one train step, it returns a dict name -> loss or metric,
+                None values are not aggregated
+            num_steps: number of calls of step
+            description: prefix of the progress bar
+        Returns:
+            dict name -> mean of the values returned by step
+        """
+        aggregates = {}
+        loop = tqdm(range(num_steps), desc=description, mininterval=self.interval)
+        begin = last_report = time()
+        for _ in loop:
+            for name, value in step().items():
+                if value is None:
+                    continue
+                if name not in aggregates:
+                    aggregates[name] = RunningMean()
+                aggregates[name].update(value)
+            if time() - last_report >= self.interval:
+                last_report = time()
+                loop.set_postfix(
+                    {name: "{:.4f}".format(agg.mean) for name, agg in aggregates.items()},
+                    refresh=False,
+                )
+        self.rate = num_steps / max(time() - begin, 1e-9)
+        return {name: agg.mean for name, agg in aggregates.items()}
+
+
+class TrainSteps:
+    """
+    Train and test loops shared by the base trainers, they use the config, the session,
+    the model, the data, the summarizer and the step_loop of the trainer
+    """
+
+    def run_steps(self, step, description="", num_steps=None):
+        """
+        Calls step num_steps times, num_iter_per_epoch by default, and averages the losses it
+        returns
+        Args:
+            step: callback without arguments returning a dict name -> loss of the step
+            description: prefix of the progress bar, e.g. the epoch
+            num_steps: number of steps of the loop
+        Returns:
+            dict name -> mean over the steps
+        """
+        if num_steps is None:
+            num_steps = self.config.data_loader.num_iter_per_epoch
+        return self.step_loop.run(step, num_steps, description)
+
+    def test_loop(self):
+        """
+        Progress bar of one pass over the test set. The test iterator is finite, it is
+        reinitialized here and the loop is left on its OutOfRangeError. The bar is closed
+        when the generator is, at the latest when the caller drops it.
+        """
+        self.sess.run(self.data.test_iterator.initializer)
+        bar = tqdm(itertools.count(), total=self.data.num_test_batches)
+        try:
+            for i in bar:
+                yield i
+        finally:
+            bar.close()
+
+    def run_test(self, fetches, feed_dict):
+        """
+        Runs fetches on the next test batch and drops the padded rows of the per example
+        results, the other results are returned as they are.
+        Args:
+            fetches: list or dict of tensors
+            feed_dict: feed_dict of the run, input_from_test fed with True
+        Returns:
+            the results, with the structure of fetches
+        Raises:
+            tf.errors.OutOfRangeError at the end of the test set
+        """
+        if isinstance(fetches, dict):
+            results = self.sess.run(dict(fetches, valid=self.model.input_valid), feed_dict)
+            valid = results.pop("valid")
+            return {k: self._valid_rows(v, valid) for k, v in results.items()}
+        results = self.sess.run(list(fetches) + [self.model.input_valid], feed_dict)
+        valid = results.pop()
+        return [self._valid_rows(v, valid) for v in results]
+
+    @staticmethod
+    def _valid_rows(value, valid):
+        if np.ndim(value) > 0 and len(value) == len(valid):
+            return value[valid]
+        return value
+
+    def summary_fetch(self, summary_op):
+        """
+        Fetch of summary_op for a train run, it is only evaluated every summary_steps global
+        steps, see Summarizer.scheduled. Its result is written with summarizer.write.
+        """
+        return self.summarizer.scheduled(summary_op, self.model.global_step_tensor)
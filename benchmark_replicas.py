@@ -0,0 +1,75 @@
+"""
+Measures the speedup of the data parallel training of a config. The first training phase of
+its trainer runs two epochs of trainer.benchmark_steps steps, once with trainer.replicas
+in-graph replicas and once on a single replica with the same batch, and the throughputs of
+the train steps of the second epochs are compared. The runs train real models in their own
+experiment folders, <experiment>_replicas_<K>.
+"""
+import tensorflow as tf
+from utils.utils import get_args
+from utils.config import process_config
+from utils.config import get_config_from_json
+from utils.factory import create
+from utils.dirs import create_dirs
+from utils.logger import Logger
+from utils.session import session_config
+
+
+def measure(args, replicas, batch_size):
+    """
+    Returns:
+        images per second of the train steps of the second epoch
+    """
+    config, _ = get_config_from_json(args.config)
+    config.exp.name = "{}_replicas_{}".format(args.experiment or "benchmark", replicas)
+    config.trainer.replicas = replicas
+    config.trainer.scale_batch = False
+    config.data_loader.batch_size = batch_size
+    config.data_loader.num_iter_per_epoch = config.trainer.benchmark_steps or 50
+    config = process_config(config)
+    create_dirs(
+        [
+            config.log.summary_dir,
+            config.log.checkpoint_dir,
+            config.log.step_generation_dir,
+            config.log.log_file_dir,
+        ]
+    )
+    tf.reset_default_graph()
+    tf.random.set_random_seed(config.data_loader.random_seed)
+    with tf.Session(config=session_config(config)) as sess:
+        data = create("data_loader." + config.data_loader.name)(config)
+        model = create("models.new." + config.model.name)(config, data)
+        summarizer = create("utils." + config.log.name)(sess, config)
+        trainer = create("trainers." + config.trainer.name)(sess, model, data, config, summarizer)
+        train_epoch = getattr(trainer, "train_epoch_gan", None) or trainer.train_epoch
+        # The first epoch warms up the graph and the input pipeline
+        for _ in range(2):
+            train_epoch()
+            sess.run(model.increment_cur_epoch_tensor)
+        model.wait_saves()
+    return trainer.step_loop.rate * batch_size
+
+
+def benchmark():
+    args = get_args()
+    config, _ = get_config_from_json(args.config)
+    config.exp.name = "{}_replicas".format(args.experiment or "benchmark")
+    config = process_config(config)
+    create_dirs([config.log.log_file_dir])
+    logger = Logger(config).get_logger(__name__)
+    replicas = config.trainer.replicas or 1
+    if replicas < 2:
+        raise ValueError("trainer.replicas is not above 1 in {}".format(args.config))
+    # Both runs share the batch of the data parallel run, scaled or not
+    batch_size = config.data_loader.batch_size
+    single = measure(args, 1, batch_size)
+    parallel = measure(args, replicas, batch_size)
+    logger.info(
+        "Batch of {} | 1 replica: {:.1f} images/s | {} replicas: {:.1f} images/s | "
+        "speedup {:.2f}".format(batch_size, single, replicas, parallel, parallel / single)
+    )
+
+
+if __name__ == "__main__":
+    benchmark()
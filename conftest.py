@@ -0,0 +1 @@
+# Makes the packages of the repository importable from the tests
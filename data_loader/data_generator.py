@@ -1,7 +1,10 @@
+import itertools
+import os
 import numpy as np
 from utils.DataLoader import DataLoader
 import tensorflow as tf
 from utils.logger import Logger
+from utils.tfrecords import record_features
 
 
 class DataGenerator:
@@ -17,108 +20,797 @@ class DataGenerator:
         # load data here
         d = DataLoader(self.config)
         self.logger.info("Data is loading...")
-        # Get the filenames and labels
-        self.filenames_train = d.get_train_dataset()
-        # assert len(self.filenames) == len(self.labels)
-        # Create the Dataset using Tensorflow Data API
-        self.dataset = tf.data.Dataset.from_tensor_slices(self.filenames_train)
-        # Apply parse function to get the numpy array of the images
-        self.dataset = self.dataset.map(
-            map_func=self._parse_function,
-            num_parallel_calls=self.config.data_loader.num_parallel_calls,
-        )
-        # Shuffle the dataset
-        if self.config.data_loader_validation:
-            buffer_size = int(
-                self.config.data_loader.buffer_size
-                * ((100 - self.config.data_loader.validation_percent) / 100)
+        # With the pipeline tuning the map parallelism is autotuned and the shuffle and
+        # prefetch buffers are capped in bytes
+        self.tuning = bool(self.config.data_loader.pipeline_tuning)
+        if self.tuning:
+            self.num_parallel_calls = tf.data.experimental.AUTOTUNE
+        else:
+            self.num_parallel_calls = self.config.data_loader.num_parallel_calls
+        # Patches are either single jpeg files, memory mapped shards of a patch store or
+        # TFRecord shards
+        self.use_store = self.config.data_loader.format == "store"
+        self.use_tfrecord = self.config.data_loader.format == "tfrecord"
+        # Random crops are sampled from the full normal images inside the graph
+        self.use_random_crop = self.config.data_loader.train_source == "random_crop"
+        # With the uint8 pipeline the patches stay uint8 through the cache, shuffle, batch and
+        # prefetch, they are cast and normalized when the batches leave the iterators
+        self.use_uint8 = bool(self.config.data_loader.uint8_pipeline)
+        # Records can hold already standardized patches
+        self.standardize_train = True
+        if self.use_random_crop:
+            self.dataset = self._random_crop_dataset(d.norm_img_array)
+        elif self.use_store:
+            self.store_train = d.get_store(d.train)
+            self.dataset = self._store_dataset(self.store_train, shuffle=True)
+            self.dataset = self.dataset.map(
+                map_func=self._parse_function_store,
+                num_parallel_calls=self.num_parallel_calls,
+            )
+        elif self.use_tfrecord:
+            self.records_train = d.get_records(d.train)
+            self.standardize_train = not self.records_train.standardized
+            self.dataset = self._record_dataset(self.records_train, shuffle=True)
+            self.dataset = self.dataset.map(
+                map_func=self._parse_function_store,
+                num_parallel_calls=self.num_parallel_calls,
             )
         else:
-            buffer_size = self.config.data_loader.buffer_size
-        self.dataset = self.dataset.shuffle(buffer_size)
-        # Repeat the dataset indefinitely
-        self.dataset = self.dataset.repeat()
-        # Apply batching
-        self.dataset = self.dataset.batch(self.config.data_loader.batch_size)
+            # Get the filenames and labels
+            self.filenames_train = d.get_train_dataset()
+            # assert len(self.filenames) == len(self.labels)
+            # Create the Dataset using Tensorflow Data API
+            self.dataset = tf.data.Dataset.from_tensor_slices(self.filenames_train)
+            # Shuffling the names before the decode only holds strings. A cached split is
+            # decoded once, the cache then keeps this shuffled order, see _shuffle
+            if self.tuning:
+                self.dataset = self.dataset.shuffle(
+                    int(self.filenames_train.shape[0]), seed=self.config.data_loader.random_seed
+                )
+            # Apply parse function to get the numpy array of the images
+            self.dataset = self.dataset.map(
+                map_func=self._parse_function,
+                num_parallel_calls=self.num_parallel_calls,
+            )
+        # Random crops come out already batched and endless
+        if not self.use_random_crop:
+            self.dataset = self._cache(self.dataset, d, d.train)
+            # Shuffle the dataset
+            if self.config.data_loader_validation:
+                buffer_size = int(
+                    self.config.data_loader.buffer_size
+                    * ((100 - self.config.data_loader.validation_percent) / 100)
+                )
+            else:
+                buffer_size = self.config.data_loader.buffer_size
+            self.dataset = self._shuffle(self.dataset, buffer_size, d.train)
+            # Repeat the dataset indefinitely
+            self.dataset = self.dataset.repeat()
+            # Apply batching
+            self.dataset = self.dataset.batch(self.config.data_loader.batch_size)
+        # Standardization and augmentation run on whole batches
+        self.dataset = self._augment_batches(self.dataset, self.standardize_train)
         # Applying prefetch to increase the performance
-        # Prefetch the next 10 batches
-        self.dataset = self.dataset.prefetch(buffer_size=10 * self.config.data_loader.batch_size)
+        self.dataset = self._prefetch(self.dataset, d.train)
         self.iterator = self.dataset.make_initializable_iterator()
-        self.image = self.iterator.get_next()
 
         # Validation Dataset
         if self.config.data_loader.validation:
-            self.filenames_valid = d.get_valid_dataset()
-            # Create the Dataset using Tensorflow Data API
-            self.valid_dataset = tf.data.Dataset.from_tensor_slices(self.filenames_valid)
-            # Apply parse function to get the numpy array of the images
-            self.valid_dataset = self.valid_dataset.map(
-                map_func=self._parse_function,
-                num_parallel_calls=self.config.data_loader.num_parallel_calls,
-            )
+            if self.use_store:
+                self.store_valid = d.get_store(d.valid)
+                self.valid_dataset = self._store_dataset(self.store_valid, shuffle=True)
+                self.valid_dataset = self.valid_dataset.map(
+                    map_func=self._parse_function_store,
+                    num_parallel_calls=self.num_parallel_calls,
+                )
+            elif self.use_tfrecord:
+                self.records_valid = d.get_records(d.valid)
+                self.valid_dataset = self._record_dataset(self.records_valid, shuffle=True)
+                self.valid_dataset = self.valid_dataset.map(
+                    map_func=self._parse_function_store,
+                    num_parallel_calls=self.num_parallel_calls,
+                )
+            else:
+                self.filenames_valid = d.get_valid_dataset()
+                # Create the Dataset using Tensorflow Data API
+                self.valid_dataset = tf.data.Dataset.from_tensor_slices(self.filenames_valid)
+                if self.tuning:
+                    self.valid_dataset = self.valid_dataset.shuffle(
+                        int(self.filenames_valid.shape[0]),
+                        seed=self.config.data_loader.random_seed,
+                    )
+                # Apply parse function to get the numpy array of the images
+                self.valid_dataset = self.valid_dataset.map(
+                    map_func=self._parse_function,
+                    num_parallel_calls=self.num_parallel_calls,
+                )
+            self.valid_dataset = self._cache(self.valid_dataset, d, d.valid)
             buffer_size = int(
                 (self.config.data_loader.buffer_size * self.config.data_loader.validation_percent)
                 / 100
             )
-            self.valid_dataset = self.valid_dataset.shuffle(buffer_size)
+            self.valid_dataset = self._shuffle(self.valid_dataset, buffer_size, d.valid)
             self.valid_dataset = self.valid_dataset.repeat()
             # Apply batching
             self.valid_dataset = self.valid_dataset.batch(buffer_size)
+            self.valid_dataset = self._augment_batches(self.valid_dataset, self.standardize_train)
             self.valid_iterator = self.valid_dataset.make_initializable_iterator()
-            self.valid_image = self.valid_iterator.get_next()
+            self.valid_image = self.next_valid_batch()
 
+        # Test windows can be cut from the full anomalous images inside the graph
+        self.use_dense_test = self.config.data_loader.test_source == "dense"
+        if self.use_dense_test:
+            with_ground = self.config.data_loader.mode != "anomaly"
+            self.test_dataset = self._dense_test_dataset(d, with_ground)
+            # Apply batching
+            self.test_dataset = self.test_dataset.batch(self.config.data_loader.test_batch)
+            if not with_ground:
+                self.test_dataset = self._standardize_test_batches(self.test_dataset)
+            self.test_dataset = self._pad_test_batches(self.test_dataset, self.test_size)
+            self.test_iterator = self.test_dataset.make_initializable_iterator()
+            if with_ground:
+                (
+                    self.test_image,
+                    self.test_label,
+                    self.ground_truth,
+                    self.test_coords,
+                    self.test_valid,
+                ) = self.next_test_batch()
+            else:
+                (
+                    self.test_image,
+                    self.test_label,
+                    self.test_coords,
+                    self.test_valid,
+                ) = self.next_test_batch()
         # If the mode is anomaly create the test dataset
-        if self.config.data_loader.mode == "anomaly":
-            self.test_filenames, self.test_labels = d.get_test_dataset()
-            self.test_dataset = tf.data.Dataset.from_tensor_slices(
-                (self.test_filenames, self.test_labels)
-            )
-            self.test_dataset = self.test_dataset.map(
-                map_func=self._parse_function_test,
-                num_parallel_calls=self.config.data_loader.num_parallel_calls,
-            )
+        elif self.config.data_loader.mode == "anomaly":
+            if self.use_store:
+                self.store_test = d.get_store(d.test)
+                self.test_dataset = self._store_dataset(self.store_test)
+            elif self.use_tfrecord:
+                self.records_test = d.get_records(d.test)
+                self.test_dataset = self._record_dataset(self.records_test)
+            else:
+                self.test_filenames, self.test_labels = d.get_test_dataset()
+                self.test_dataset = tf.data.Dataset.from_tensor_slices(
+                    (self.test_filenames, self.test_labels)
+                )
+                self.test_dataset = self.test_dataset.map(
+                    map_func=self._parse_function_test,
+                    num_parallel_calls=self.num_parallel_calls,
+                )
+            self.test_dataset = self._cache(self.test_dataset, d, d.test)
             # Shuffle the dataset
             # self.test_dataset = self.test_dataset.shuffle(self.config.data_loader.buffer_size)
-            # Repeat the dataset indefinitely
-            self.test_dataset = self.test_dataset.repeat()
             # Apply batching
             self.test_dataset = self.test_dataset.batch(self.config.data_loader.test_batch)
+            # Standardized records are ready to use
+            if not (self.use_tfrecord and self.records_test.standardized):
+                self.test_dataset = self._standardize_test_batches(self.test_dataset)
+            self.test_dataset = self._pad_test_batches(self.test_dataset, d.split_size(d.test))
             self.test_iterator = self.test_dataset.make_initializable_iterator()
-            self.test_image, self.test_label = self.test_iterator.get_next()
-        if self.config.data_loader.mode == "visualization":
-            self.test_filenames, self.test_labels, self.ground_truth = d.get_test_dataset_vis()
-            self.test_dataset = tf.data.Dataset.from_tensor_slices(
-                (self.test_filenames, self.test_labels, self.ground_truth)
-            )
-            self.test_dataset = self.test_dataset.map(
-                map_func=self._parse_function_test_2,
-                num_parallel_calls=self.config.data_loader.num_parallel_calls,
-            )
+            self.test_image, self.test_label, self.test_valid = self.next_test_batch()
+        elif self.config.data_loader.mode == "visualization":
+            if self.use_store:
+                self.store_test = d.get_store(d.test_vis)
+                self.test_dataset = self._store_dataset(self.store_test, masks=True)
+                self.test_dataset = self.test_dataset.map(
+                    map_func=self._parse_function_test_2_store,
+                    num_parallel_calls=self.num_parallel_calls,
+                )
+            elif self.use_tfrecord:
+                self.records_test = d.get_records(d.test_vis)
+                self.test_dataset = self._record_dataset(self.records_test, masks=True)
+                self.test_dataset = self.test_dataset.map(
+                    map_func=self._parse_function_test_2_store,
+                    num_parallel_calls=self.num_parallel_calls,
+                )
+            else:
+                self.test_filenames, self.test_labels, self.ground_truth = d.get_test_dataset_vis()
+                self.test_dataset = tf.data.Dataset.from_tensor_slices(
+                    (self.test_filenames, self.test_labels, self.ground_truth)
+                )
+                self.test_dataset = self.test_dataset.map(
+                    map_func=self._parse_function_test_2,
+                    num_parallel_calls=self.num_parallel_calls,
+                )
+            self.test_dataset = self._cache(self.test_dataset, d, d.test_vis)
             # Shuffle the dataset
             # self.test_dataset = self.test_dataset.shuffle(self.config.data_loader.buffer_size)
-            # Repeat the dataset indefinitely
-            self.test_dataset = self.test_dataset.repeat()
             # Apply batching
             self.test_dataset = self.test_dataset.batch(self.config.data_loader.test_batch)
+            self.test_dataset = self._pad_test_batches(self.test_dataset, d.split_size(d.test_vis))
             self.test_iterator = self.test_dataset.make_initializable_iterator()
-            self.test_image, self.test_label, self.ground_truth = self.test_iterator.get_next()
-        if self.config.data_loader.mode == "visualization_big":
-            self.test_filenames, self.test_labels, self.ground_truth = d.get_test_dataset_vis_big()
-            self.test_dataset = tf.data.Dataset.from_tensor_slices(
-                (self.test_filenames, self.test_labels, self.ground_truth)
-            )
-            self.test_dataset = self.test_dataset.map(
-                map_func=self._parse_function_test_2,
-                num_parallel_calls=self.config.data_loader.num_parallel_calls,
-            )
+            (
+                self.test_image,
+                self.test_label,
+                self.ground_truth,
+                self.test_valid,
+            ) = self.next_test_batch()
+        elif self.config.data_loader.mode == "visualization_big":
+            if self.use_store:
+                self.store_test = d.get_store(d.test_vis_big)
+                self.test_dataset = self._store_dataset(self.store_test, masks=True)
+                self.test_dataset = self.test_dataset.map(
+                    map_func=self._parse_function_test_2_store,
+                    num_parallel_calls=self.num_parallel_calls,
+                )
+            elif self.use_tfrecord:
+                self.records_test = d.get_records(d.test_vis_big)
+                self.test_dataset = self._record_dataset(self.records_test, masks=True)
+                self.test_dataset = self.test_dataset.map(
+                    map_func=self._parse_function_test_2_store,
+                    num_parallel_calls=self.num_parallel_calls,
+                )
+            else:
+                self.test_filenames, self.test_labels, self.ground_truth = d.get_test_dataset_vis_big()
+                self.test_dataset = tf.data.Dataset.from_tensor_slices(
+                    (self.test_filenames, self.test_labels, self.ground_truth)
+                )
+                self.test_dataset = self.test_dataset.map(
+                    map_func=self._parse_function_test_2,
+                    num_parallel_calls=self.num_parallel_calls,
+                )
+            self.test_dataset = self._cache(self.test_dataset, d, d.test_vis_big)
             # Shuffle the dataset
             # self.test_dataset = self.test_dataset.shuffle(self.config.data_loader.buffer_size)
-            # Repeat the dataset indefinitely
-            self.test_dataset = self.test_dataset.repeat()
             # Apply batching
             self.test_dataset = self.test_dataset.batch(self.config.data_loader.test_batch)
+            self.test_dataset = self._pad_test_batches(self.test_dataset, d.split_size(d.test_vis_big))
             self.test_iterator = self.test_dataset.make_initializable_iterator()
-            self.test_image, self.test_label, self.ground_truth = self.test_iterator.get_next()
+            (
+                self.test_image,
+                self.test_label,
+                self.ground_truth,
+                self.test_valid,
+            ) = self.next_test_batch()
+
+    def _store_dataset(self, store, shuffle=False, masks=False):
+        """
+        Args:
+            store: PatchStore of the split
+            shuffle: visit the blocks of the store in a new random order every epoch
+            masks: also emit the ground truth patches
+        Returns:
+            dataset of single (image, label) or (image, label, ground) uint8 elements
+        """
+        block_size = self.config.data_loader.store_block_size or 1024
+        epochs = itertools.count()
+        add_channel = len(store.patch_shape) == 2
+        patch_shape = list(store.patch_shape) + ([1] if add_channel else [])
+
+        def generator():
+            seed = self.config.data_loader.random_seed + next(epochs)
+            for shard, start, end in store.blocks(block_size, shuffle=shuffle, seed=seed):
+                images, grounds, labels, _ = store.block(shard, start, end)
+                # Adding the channel axis is still a view on the memory mapped shard
+                if add_channel:
+                    images = images[..., np.newaxis]
+                    grounds = grounds[..., np.newaxis] if masks else None
+                if masks:
+                    yield images, labels, grounds
+                else:
+                    yield images, labels
+
+        if masks:
+            output_types = (tf.uint8, tf.int32, tf.uint8)
+            output_shapes = ([None] + patch_shape, [None], [None] + patch_shape)
+        else:
+            output_types = (tf.uint8, tf.int32)
+            output_shapes = ([None] + patch_shape, [None])
+        dataset = tf.data.Dataset.from_generator(generator, output_types, output_shapes)
+        return dataset.apply(tf.data.experimental.unbatch())
+
+    def _record_dataset(self, records, shuffle=False, masks=False):
+        """
+        Reads the TFRecord shards of a split with parallel_interleave, every shard is a long
+        sequential read and several shards are read at the same time.
+        Args:
+            records: RecordShards of the split
+            shuffle: visit the shards in a new random order every epoch
+            masks: also emit the ground truth patches
+        Returns:
+            dataset of single (image, label) or (image, label, ground) elements, the images
+            are float32 for standardized records and uint8 otherwise
+        """
+        add_channel = len(records.patch_shape) == 2
+        patch_shape = list(records.patch_shape) + ([1] if add_channel else [])
+        image_dtype = tf.float32 if records.standardized else tf.uint8
+        features = record_features(masks)
+        files = tf.data.Dataset.from_tensor_slices(records.files)
+        if shuffle:
+            files = files.shuffle(len(records.files), seed=self.config.data_loader.random_seed)
+        cycle_length = min(len(records.files), self.config.data_loader.num_parallel_calls or 1)
+        dataset = files.apply(
+            tf.data.experimental.parallel_interleave(
+                lambda f: tf.data.TFRecordDataset(f, buffer_size=8 * 1024 * 1024),
+                cycle_length=max(cycle_length, 1),
+                # The order only matters for the test splits, which are not shuffled
+                sloppy=shuffle,
+            )
+        )
+
+        def parse(record):
+            example = tf.parse_single_example(record, features)
+            image = tf.reshape(tf.decode_raw(example["image"], image_dtype), patch_shape)
+            label = tf.cast(example["label"], tf.int32)
+            if masks:
+                ground = tf.reshape(tf.decode_raw(example["mask"], tf.uint8), patch_shape)
+                return image, label, ground
+            return image, label
+
+        return dataset.map(parse, num_parallel_calls=self.num_parallel_calls)
+
+    def _cache(self, dataset, d, split):
+        """
+        Caches the decoded and resized elements of a split with data_loader.cache set to
+        "memory" or to a folder, so that the later epochs only compute the batch level
+        standardization and augmentation. The files of a split are keyed by its inputs and by
+        the contents of its elements, see _cache_contents, and a new key starts a new cache.
+        Args:
+            dataset: deterministic dataset of the split, before any augmentation
+            d: DataLoader of the splits
+            split: name of the split
+        Returns:
+            the cached dataset, or dataset itself if data_loader.cache is not set
+        """
+        cache = self.config.data_loader.cache
+        if not cache:
+            return dataset
+        count = d.split_size(split)
+        element_bytes = self._element_bytes(dataset)
+        if cache == "memory":
+            location = "memory"
+            dataset = dataset.cache()
+        else:
+            if not os.path.exists(cache):
+                os.makedirs(cache)
+            key = d.cache_key(split, self._cache_contents(dataset))
+            location = os.path.join(cache, "{}_{}".format(split, key))
+            dataset = dataset.cache(location)
+        self.logger.info(
+            "{} patches of {} are cached in {} ({:.1f} MB)".format(
+                count, split, location, count * element_bytes / 2 ** 20
+            )
+        )
+        return dataset
+
+    def _cache_contents(self, dataset):
+        """
+        What the cached elements of a dataset hold besides the patches of the split: their
+        dtypes, and where they are normalized. The uint8 pipeline caches the raw patches and
+        normalizes the batches in the graph, otherwise the parse functions cast them to
+        float32 and normalize some of them, e.g. the images of the visualization modes, before
+        the cache.
+        Returns:
+            dict that is part of the key of a folder cache
+        """
+        types = dataset.output_types
+        if not isinstance(types, tuple):
+            types = (types,)
+        return {
+            "dtypes": [dtype.name for dtype in types],
+            "normalization": "graph" if self.use_uint8 else "parse",
+        }
+
+    def _element_bytes(self, dataset, batch_size=None):
+        """
+        Size in bytes of one element of dataset
+        Args:
+            dataset: dataset of single elements or of batches
+            batch_size: size of the unknown batch dimension of a batched dataset
+        """
+        shapes = dataset.output_shapes
+        types = dataset.output_types
+        if not isinstance(shapes, tuple):
+            shapes, types = (shapes,), (types,)
+        element_bytes = 0
+        for shape, dtype in zip(shapes, types):
+            dims = shape.as_list()
+            if batch_size and dims and dims[0] is None:
+                dims[0] = batch_size
+            # Unknown dimensions are the channels of decoded jpegs, the patches are grayscale
+            element_bytes += int(np.prod([x or 1 for x in dims])) * dtype.size
+        return element_bytes
+
+    def _shuffle(self, dataset, buffer_size, split):
+        """
+        Shuffles the decoded elements of a split. With data_loader.pipeline_tuning the
+        buffer holds at most data_loader.shuffle_memory_mb, the order of the files, blocks or
+        shards is already shuffled before the decode. A cached split replays the order of its
+        first epoch, only this shuffle changes the order of the later epochs.
+        Args:
+            dataset: dataset of single elements
+            buffer_size: number of elements of the buffer without the memory cap
+            split: name of the split, for the logs
+        """
+        element_bytes = self._element_bytes(dataset)
+        if self.tuning:
+            memory = (self.config.data_loader.shuffle_memory_mb or 256) * 2 ** 20
+            buffer_size = max(1, min(buffer_size, memory // element_bytes))
+            if self.config.data_loader.cache:
+                self.logger.info(
+                    "The cache of {} replays the order of its first epoch, the later epochs "
+                    "are only reordered by the shuffle of the decoded patches".format(split)
+                )
+        self.logger.info(
+            "Shuffle buffer of {}: {} elements ({:.1f} MB)".format(
+                split, buffer_size, buffer_size * element_bytes / 2 ** 20
+            )
+        )
+        return dataset.shuffle(buffer_size)
+
+    def _prefetch(self, dataset, split):
+        """
+        Prefetches the batches of a split. With data_loader.pipeline_tuning the buffer holds
+        at most data_loader.prefetch_memory_mb, or is autotuned when it is null.
+        Args:
+            dataset: dataset of batches
+            split: name of the split, for the logs
+        """
+        batch_bytes = self._element_bytes(dataset, self.config.data_loader.batch_size)
+        if not self.tuning:
+            # Prefetch the next 10 batches
+            buffer_size = 10 * self.config.data_loader.batch_size
+        elif self.config.data_loader.prefetch_memory_mb:
+            memory = self.config.data_loader.prefetch_memory_mb * 2 ** 20
+            buffer_size = max(1, memory // batch_bytes)
+        else:
+            self.logger.info("Prefetch buffer of {} is autotuned".format(split))
+            return dataset.prefetch(buffer_size=tf.data.experimental.AUTOTUNE)
+        self.logger.info(
+            "Prefetch buffer of {}: {} batches ({:.1f} MB)".format(
+                split, buffer_size, buffer_size * batch_bytes / 2 ** 20
+            )
+        )
+        return dataset.prefetch(buffer_size=buffer_size)
+
+    def _dense_test_dataset(self, d, with_ground):
+        """
+        Test windows emitted from the full anomalous images, nothing is read from disk.
+        The images are cut in bands of window rows with extract_image_patches to bound memory.
+        Args:
+            d: DataLoader holding the full anomalous images and masks
+            with_ground: also emit the ground truth window (visualization modes)
+        Returns:
+            dataset of single (image, label, [ground,] coords) elements, coords is
+            (image index, row, col) of the window in the full image
+        """
+        size = self.config.data_loader.image_size
+        mode = self.config.data_loader.mode
+        split = {"anomaly": d.test, "visualization": d.test_vis}.get(mode, d.test_vis_big)
+        index_list, stride, turns = d.test_layout(split)
+        # A free stride always uses every window that fits in the image
+        if self.config.data_loader.test_stride:
+            stride, turns = self.config.data_loader.test_stride, None
+        threshold = d.label_threshold
+        images = [d.anorm_img_array[i] for i in index_list]
+        masks = [d.anorm_tag_array[i] for i in index_list]
+        images = [img if img.ndim == 3 else img[..., np.newaxis] for img in images]
+        masks = [mask if mask.ndim == 3 else mask[..., np.newaxis] for mask in masks]
+        max_h = max(img.shape[0] for img in images)
+        max_w = max(img.shape[1] for img in images)
+        padded_imgs = np.zeros((len(images), max_h, max_w, images[0].shape[2]), dtype=np.uint8)
+        padded_masks = np.zeros((len(masks), max_h, max_w, masks[0].shape[2]), dtype=np.uint8)
+        bands = []
+        band_rows = self.config.data_loader.dense_band_windows or 16384
+        for ind, (img, mask) in enumerate(zip(images, masks)):
+            h, w = img.shape[:2]
+            padded_imgs[ind, :h, :w] = img
+            padded_masks[ind, :h, :w] = mask
+            if turns is not None:
+                h_turns, w_turns = turns(h, w)
+            else:
+                h_turns, w_turns = (h - size) // stride + 1, (w - size) // stride + 1
+            rows_per_band = max(1, band_rows // w_turns)
+            for row in range(0, h_turns, rows_per_band):
+                bands.append((ind, row, min(rows_per_band, h_turns - row), w_turns))
+        bands = np.asarray(bands, dtype=np.int32)
+        self.test_size = int(np.sum(bands[:, 2] * bands[:, 3]))
+        self.logger.info(
+            "Dense test source: {} windows with stride {} from {} images".format(
+                self.test_size, stride, len(images)
+            )
+        )
+        images_t = tf.constant(padded_imgs)
+        masks_t = tf.constant(padded_masks)
+        index_t = tf.constant(np.asarray(index_list, dtype=np.int32))
+
+        def windows(source, channels, ind, top, height, width):
+            band = source[ind, top : top + height, :width]
+            patches = tf.image.extract_image_patches(
+                band[tf.newaxis],
+                ksizes=[1, size, size, 1],
+                strides=[1, stride, stride, 1],
+                rates=[1, 1, 1, 1],
+                padding="VALID",
+            )
+            return tf.reshape(patches, [-1, size, size, channels])
+
+        def cut_band(ind, row, n_rows, n_cols):
+            top = row * stride
+            height = (n_rows - 1) * stride + size
+            width = (n_cols - 1) * stride + size
+            image = windows(images_t, padded_imgs.shape[3], ind, top, height, width)
+            ground = windows(masks_t, padded_masks.shape[3], ind, top, height, width)
+            sums = tf.reduce_sum(tf.cast(ground, tf.int64), axis=[1, 2, 3])
+            label = tf.cast(sums > threshold, tf.int32)
+            rows, cols = tf.meshgrid(
+                (row + tf.range(n_rows)) * stride, tf.range(n_cols) * stride, indexing="ij"
+            )
+            coords = tf.stack(
+                [
+                    tf.fill([n_rows * n_cols], tf.gather(index_t, ind)),
+                    tf.reshape(rows, [-1]),
+                    tf.reshape(cols, [-1]),
+                ],
+                axis=1,
+            )
+            if with_ground:
+                return image, label, ground, coords
+            return image, label, coords
+
+        dataset = tf.data.Dataset.from_tensor_slices(
+            (bands[:, 0], bands[:, 1], bands[:, 2], bands[:, 3])
+        )
+        dataset = dataset.map(cut_band).apply(tf.data.experimental.unbatch())
+        if with_ground:
+            return dataset.map(
+                map_func=lambda image, tag, ground, coords: self._parse_function_test_2_store(
+                    image, tag, ground
+                )
+                + (coords,),
+                num_parallel_calls=self.num_parallel_calls,
+            )
+        # The windows are standardized per batch
+        return dataset
+
+    def _random_crop_dataset(self, images):
+        """
+        Endless dataset of training batches cropped at random from the full images.
+        Args:
+            images: full resolution normal images, they can have different sizes
+        Returns:
+            dataset of uint8 batches of shape [batch_size, image_size, image_size, C]
+        """
+        size = self.config.data_loader.image_size
+        batch_size = self.config.data_loader.batch_size
+        seed = self.config.data_loader.random_seed
+        images = [img if img.ndim == 3 else img[..., np.newaxis] for img in images]
+        heights = np.asarray([img.shape[0] for img in images], dtype=np.int32)
+        widths = np.asarray([img.shape[1] for img in images], dtype=np.int32)
+        # Pad to a common shape, the valid crop range of every image is kept in heights/widths
+        padded = np.zeros(
+            (len(images), heights.max(), widths.max(), images[0].shape[2]), dtype=np.uint8
+        )
+        for ind, img in enumerate(images):
+            padded[ind, : img.shape[0], : img.shape[1]] = img
+        self.logger.info(
+            "Random crops are sampled from {} images kept in memory ({:.1f} MB)".format(
+                len(images), padded.nbytes / 2 ** 20
+            )
+        )
+
+        def sample_batch(images_t, heights_t, widths_t):
+            idx = tf.random.uniform(
+                [batch_size], 0, len(images), dtype=tf.int32, seed=seed
+            )
+            # Same range as np.random.randint(0, h - size)
+            top = tf.cast(
+                tf.floor(
+                    tf.random.uniform([batch_size], seed=seed + 1)
+                    * tf.cast(tf.gather(heights_t, idx) - size, tf.float32)
+                ),
+                tf.int32,
+            )
+            left = tf.cast(
+                tf.floor(
+                    tf.random.uniform([batch_size], seed=seed + 2)
+                    * tf.cast(tf.gather(widths_t, idx) - size, tf.float32)
+                ),
+                tf.int32,
+            )
+            # Gather all the pixels of the batch with a single op
+            offsets = tf.range(size)
+            rows = tf.tile((top[:, None] + offsets)[:, :, None], [1, 1, size])
+            cols = tf.tile((left[:, None] + offsets)[:, None, :], [1, size, 1])
+            img_ind = tf.tile(idx[:, None, None], [1, size, size])
+            return tf.gather_nd(images_t, tf.stack([img_ind, rows, cols], axis=-1))
+
+        dataset = tf.data.Dataset.from_tensors((padded, heights, widths)).repeat()
+        # Sampling stays sequential so that the crops only depend on the seed
+        return dataset.map(map_func=sample_batch)
+
+    def _augment_batches(self, dataset, standardize=True):
+        """
+        Standardizes and augments whole batches with vectorized ops. The random draws of a
+        batch only depend on the seed of the config and on the index of the batch, which
+        keeps growing over the epochs, so every epoch gets new flips whatever the number of
+        parallel calls.
+        Args:
+            dataset: dataset of batches of patches
+            standardize: apply the per image standardization
+        Returns:
+            dataset of float32 batches, uint8 ones with the uint8 pipeline
+        """
+        seed = self.config.data_loader.random_seed or 0
+        batch_index = tf.data.Dataset.range(np.iinfo(np.int64).max)
+
+        def augment(images, index):
+            # The uint8 pipeline normalizes the batches in next_batch, the flips keep the type
+            if not self.use_uint8:
+                images = tf.cast(images, tf.float32)
+                if standardize:
+                    images = self._standardize_batch(images)
+            return self._augment_batch(images, tf.stack([tf.constant(seed, tf.int64), index]))
+
+        dataset = tf.data.Dataset.zip((dataset, batch_index))
+        return dataset.map(
+            map_func=augment, num_parallel_calls=self.num_parallel_calls
+        )
+
+    def next_batch(self):
+        """
+        Next training batch, normalized in the graph with the uint8 pipeline
+        """
+        images = self.iterator.get_next()
+        if self.use_uint8 and self.standardize_train:
+            return self._normalize(images, "standardize")
+        return tf.cast(images, tf.float32)
+
+    def next_valid_batch(self):
+        """
+        Next validation batch, normalized in the graph with the uint8 pipeline
+        """
+        images = self.valid_iterator.get_next()
+        if self.use_uint8 and self.standardize_train:
+            return self._normalize(images, "standardize")
+        return tf.cast(images, tf.float32)
+
+    def next_test_batch(self):
+        """
+        Next test batch, with the uint8 pipeline its images (and ground truths) are
+        normalized in the graph like the per element parsing does it otherwise.
+        Returns:
+            tuple of the elements of the test batch
+        """
+        batch = self.test_iterator.get_next()
+        if not self.use_uint8:
+            return batch
+        normalization = self._test_normalization()
+        return tuple(
+            self._normalize(x, normalization[i]) if i in normalization else x
+            for i, x in enumerate(batch)
+        )
+
+    def _test_normalization(self):
+        """
+        Returns:
+            dict position in the test batches -> normalization of the uint8 pipeline
+        """
+        if self.config.data_loader.mode != "anomaly":
+            # Images and ground truths of the visualization modes, as in _parse_function_test_2
+            return {0: "scale", 2: "standardize"}
+        if self.use_tfrecord and not self.use_dense_test and self.records_test.standardized:
+            return {}
+        return {0: "standardize"}
+
+    def _normalize(self, images, normalization):
+        """
+        Casts a batch to float32 and normalizes it
+        Args:
+            images: uint8 batch of shape [N, size, size, C]
+            normalization: "standardize" for the per image standardization, "scale" to
+                divide the values by 255
+        """
+        images = tf.cast(images, tf.float32)
+        if normalization == "scale":
+            return images / 255.0
+        return self._standardize_batch(images)
+
+    def _pad_test_batches(self, dataset, count):
+        """
+        The test sets are read exactly once, the iterator ends with an OutOfRangeError. The
+        last batch is padded with zeros up to test_batch so that every forward pass has the
+        same size, and a validity mask of the rows is appended to every batch.
+        Args:
+            dataset: finite dataset of test batches
+            count: number of test elements
+        Returns:
+            dataset of the padded batches followed by their boolean mask of shape [test_batch]
+        """
+        test_batch = self.config.data_loader.test_batch
+        self.test_count = count
+        self.num_test_batches = -(-count // test_batch)
+        self.logger.info(
+            "Test set: {} elements in {} batches of {}".format(
+                count, self.num_test_batches, test_batch
+            )
+        )
+
+        def pad(*batch):
+            n = tf.shape(batch[0])[0]
+            padded = []
+            for x in batch:
+                paddings = [[0, test_batch - n]] + [[0, 0]] * (x.shape.ndims - 1)
+                x = tf.pad(x, paddings)
+                x.set_shape([test_batch] + x.shape.as_list()[1:])
+                padded.append(x)
+            return tuple(padded) + (tf.range(test_batch) < n,)
+
+        return dataset.map(map_func=pad, num_parallel_calls=self.num_parallel_calls)
+
+    def _standardize_test_batches(self, dataset):
+        # The uint8 pipeline standardizes the images in next_test_batch
+        if self.use_uint8:
+            return dataset
+        # The images are the first element of the test batches
+        return dataset.map(
+            map_func=lambda image, *rest: (self._standardize_batch(tf.cast(image, tf.float32)),)
+            + rest,
+            num_parallel_calls=self.num_parallel_calls,
+        )
+
+    def _standardize_batch(self, images):
+        # Same as tf.image.per_image_standardization applied to every image of the batch
+        # (x - mean) / adjusted_stddev
+        # adjusted_stddev = max(stddev, 1.0/sqrt(image.NumElements()))
+        mean, variance = tf.nn.moments(images, axes=[1, 2, 3], keep_dims=True)
+        num_elements = tf.cast(tf.reduce_prod(tf.shape(images)[1:]), tf.float32)
+        adjusted_stddev = tf.maximum(tf.sqrt(variance), tf.rsqrt(num_elements))
+        return (images - mean) / adjusted_stddev
+
+    def _augment_batch(self, images, seed):
+        """
+        Random flips of every image of the batch, and random 90 degree rotations with
+        data_loader.augment_rot90. The patches are square, so a transpose combined with the
+        two flips gives every rotation.
+        Args:
+            images: batch of shape [N, size, size, C]
+            seed: int64 tensor of shape [2] of the stateless random draws
+        """
+        n = tf.shape(images)[0]
+        coins = tf.contrib.stateless.stateless_random_uniform([3, n], seed=seed) < 0.5
+        if self.config.data_loader.augment_rot90:
+            images = tf.where(coins[2], tf.transpose(images, [0, 2, 1, 3]), images)
+        # Random image flip left-right
+        images = tf.where(coins[0], tf.reverse(images, [2]), images)
+        # Random image flip up-down
+        return tf.where(coins[1], tf.reverse(images, [1]), images)
+
+    def _parse_function_store(self, image, label):
+        # Store patches already have the right size, they are standardized per batch
+        return image
+
+    def _resize(self, image):
+        # Patches are written at the right size, only resize the ones that are not
+        size = self.config.data_loader.image_size
+        same_size = tf.reduce_all(tf.equal(tf.shape(image)[:2], [size, size]))
+        if self.use_uint8:
+            image_resized = tf.cond(
+                same_size,
+                lambda: image,
+                lambda: tf.saturate_cast(
+                    tf.round(tf.image.resize_images(image, [size, size])), tf.uint8
+                ),
+            )
+        else:
+            image_resized = tf.cond(
+                same_size,
+                lambda: tf.cast(image, tf.float32),
+                lambda: tf.image.resize_images(image, [size, size]),
+            )
+        image_resized.set_shape([size, size, image.shape[-1]])
+        return image_resized
+
+    def _parse_function_test_2_store(self, image, tag, ground):
+        # The uint8 pipeline normalizes the images and the ground truths in next_test_batch
+        if self.use_uint8:
+            return image, tag, ground
+        image_normalized = tf.cast(image, tf.float32) / 255.0
+        ground_normalized = tf.image.per_image_standardization(tf.cast(ground, tf.float32))
+        return image_normalized, tag, ground_normalized
 
     def _parse_function(self, filename):
         # Read the image
@@ -131,38 +823,17 @@ class DataGenerator:
         image_file = tf.read_file(filename)
         # Decode the image
         image_decoded = tf.image.decode_jpeg(image_file)
-        # Resize the image --> 28 is default
-        image_resized = tf.image.resize_images(
-            image_decoded, [self.config.data_loader.image_size, self.config.data_loader.image_size]
-        )
-        # Normalize the values of the pixels. The function that is applied is below
-        # (x - mean) / adjusted_stddev
-        # adjusted_stddev = max(stddev, 1.0/sqrt(image.NumElements()))
-        image_normalized = tf.image.per_image_standardization(image_resized)
-        #image_normalized = image_resized / 255.0
-        # Random image flip left-right
-        image_random_flip_lr = tf.image.random_flip_left_right(
-            image_normalized, seed=tf.random.set_random_seed(self.config.data_loader.random_seed)
-        )
-        # Random image flip up-down
-        image_random_flip_ud = tf.image.random_flip_up_down(
-            image_random_flip_lr,
-            seed=tf.random.set_random_seed(self.config.data_loader.random_seed),
-        )
-        return image_random_flip_ud
+        # Resize the image --> 28 is default, the standardization is applied per batch
+        return self._resize(image_decoded)
 
     def _parse_function_test(self, img_file, tag):
         # Read the image
         img = tf.read_file(img_file)
         # Decode the image and the label
         img_decoded = tf.image.decode_jpeg(img)
-        image_resized = tf.image.resize_images(
-            img_decoded, [self.config.data_loader.image_size, self.config.data_loader.image_size]
-        )
-        image_normalized = tf.image.per_image_standardization(image_resized)
-        #image_normalized = image_resized / 255.0
-
-        return image_normalized, tag
+        # The standardization is applied per batch
+        image_resized = self._resize(img_decoded)
+        return image_resized, tag
     
     def _parse_function_test_2(self, img_file, tag, ground):
         # Read the image
@@ -171,12 +842,10 @@ class DataGenerator:
         # Decode the image and the label
         img_decoded = tf.image.decode_jpeg(img)
         ground_decoded = tf.image.decode_jpeg(ground)
-        image_resized = tf.image.resize_images(
-            img_decoded, [self.config.data_loader.image_size, self.config.data_loader.image_size]
-        )
-        ground_resized = tf.image.resize_images(
-            ground_decoded, [self.config.data_loader.image_size, self.config.data_loader.image_size]
-        )
+        image_resized = self._resize(img_decoded)
+        ground_resized = self._resize(ground_decoded)
+        if self.use_uint8:
+            return image_resized, tag, ground_resized
         image_normalized = image_resized / 255.0
         ground_normalized = tf.image.per_image_standardization(ground_resized)
         
@@ -0,0 +1,67 @@
+"""
+Prepares the dataset of a config once and publishes it in data_loader.shared_memory, e.g.
+/dev/shm/material. The decoded images and, with the store format, the patch stores of the
+splits are written there as .npy files; every run.py process with the same config then maps
+the same pages read only instead of keeping its own copy. The server keeps running for the
+lifetime of the sweep: while it runs, no process can replace the published folders. Once it
+is stopped with Ctrl-C or SIGTERM it removes them, the runs that still map their files keep
+valid views.
+"""
+import os
+import signal
+import sys
+
+from utils.utils import get_args
+from utils.config import process_config
+from utils.config import get_config_from_json
+from utils.dirs import create_dirs
+from utils.logger import Logger
+from utils.DataLoader import DataLoader
+from utils.shared_data import hold, unpublish
+
+
+def serve():
+    args = get_args()
+    config, _ = get_config_from_json(args.config)
+    config.exp.name = args.experiment or "dataset_server"
+    config = process_config(config)
+    create_dirs([config.log.log_file_dir])
+    logger = Logger(config).get_logger(__name__)
+    shared_dir = config.data_loader.shared_memory
+    if not shared_dir:
+        raise ValueError("data_loader.shared_memory is not set in {}".format(args.config))
+    # Populating the splits publishes the decoded images
+    d = DataLoader(config)
+    directories = [os.path.join(shared_dir, "images")]
+    if d.use_store:
+        splits = []
+        if config.data_loader.train_source != "random_crop":
+            splits.append(d.train)
+        if config.data_loader.validation:
+            splits.append(d.valid)
+        if config.data_loader.test_source != "dense":
+            modes = {"anomaly": d.test, "visualization": d.test_vis}
+            splits.append(modes.get(config.data_loader.mode, d.test_vis_big))
+        for split in splits:
+            d.get_store(split)
+            directories.append(os.path.join(shared_dir, "store", split))
+    directories = [directory for directory in directories if os.path.isdir(directory)]
+    locks = [hold(directory) for directory in directories]
+    logger.info("Dataset is published in {}, stop the server to remove it".format(shared_dir))
+    # SIGTERM leaves through the finally block like Ctrl-C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while True:
+            signal.pause()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for lock in locks:
+            lock.close()
+        for directory in directories:
+            unpublish(directory)
+        logger.info("Dataset is removed from {}".format(shared_dir))
+
+
+if __name__ == "__main__":
+    serve()
@@ -5,12 +5,12 @@ import utils.alad_utils as sn
 
 
 class ALAD(BaseModel):
-    def __init__(self, config):
+    def __init__(self, config, data=None):
         """
         Args:
             config:
         """
-        super(ALAD, self).__init__(config)
+        super(ALAD, self).__init__(config, data)
         self.build_model()
         self.init_saver()
 
@@ -18,14 +18,11 @@ class ALAD(BaseModel):
 
         # Placeholdersn
         self.is_training = tf.placeholder(tf.bool)
-        self.image_tensor = tf.placeholder(
-            tf.float32, shape=[None] + self.config.trainer.image_dims, name="x"
-        )
-        self.noise_tensor = tf.placeholder(
-            tf.float32, shape=[None, self.config.trainer.noise_dim], name="noise"
-        )
-        self.true_labels = tf.placeholder(dtype=tf.float32, shape=[None, 1], name="true_labels")
-        self.generated_labels = tf.placeholder(dtype=tf.float32, shape=[None, 1], name="gen_labels")
+        self.image_tensor = self.init_image_input([None] + self.config.trainer.image_dims, name="x")
+        # Random inputs are drawn in the graph, with the batch size of the image input
+        batch_size = tf.shape(self.image_tensor)[0]
+        self.noise_tensor = self.init_noise_input(batch_size)
+        self.true_labels, self.generated_labels = self.init_label_inputs(batch_size)
         # Building the Graph
         with tf.variable_scope("ALAD"):
             # Generated noise from the encoder
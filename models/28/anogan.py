@@ -5,8 +5,8 @@ import utils.alad_utils as sn
 
 
 class ANOGAN(BaseModel):
-    def __init__(self, config):
-        super(ANOGAN, self).__init__(config)
+    def __init__(self, config, data=None):
+        super(ANOGAN, self).__init__(config, data)
         self.build_model()
         self.init_saver()
 
@@ -14,15 +14,12 @@ class ANOGAN(BaseModel):
         # Placeholdersn
         self.init_kernel = tf.random_normal_initializer(mean=0.0, stddev=0.01)
         self.is_training = tf.placeholder(tf.bool)
-        self.image_input = tf.placeholder(
-            tf.float32, shape=[None] + self.config.trainer.image_dims, name="x"
-        )
-        self.noise_tensor = tf.placeholder(
-            tf.float32, shape=[None, self.config.trainer.noise_dim], name="noise"
-        )
+        self.image_input = self.init_image_input([None] + self.config.trainer.image_dims, name="x")
+        # Random inputs are drawn in the graph, with the batch size of the image input
+        batch_size = tf.shape(self.image_input)[0]
+        self.noise_tensor = self.init_noise_input(batch_size)
         # Placeholders for the true and fake labels
-        self.true_labels = tf.placeholder(dtype=tf.float32, shape=[None, 1])
-        self.generated_labels = tf.placeholder(dtype=tf.float32, shape=[None, 1])
+        self.true_labels, self.generated_labels = self.init_label_inputs(batch_size)
         # Building the Graph
         self.logger.info("Building Graph")
         with tf.variable_scope("ANOGAN"):
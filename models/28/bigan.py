@@ -5,12 +5,12 @@ from utils.alad_utils import get_getter
 
 
 class BIGAN(BaseModel):
-    def __init__(self, config):
+    def __init__(self, config, data=None):
         """
         Args:
             config:
         """
-        super(BIGAN, self).__init__(config)
+        super(BIGAN, self).__init__(config, data)
         self.build_model()
         self.init_saver()
 
@@ -19,20 +19,13 @@ class BIGAN(BaseModel):
         self.init_kernel = tf.random_normal_initializer(mean=0.0, stddev=0.02)
         # Placeholders
         self.is_training = tf.placeholder(tf.bool)
-        self.image_input = tf.placeholder(
-            tf.float32, shape=[None] + self.config.trainer.image_dims, name="x"
-        )
-        self.noise_tensor = tf.placeholder(
-            tf.float32, shape=[None, self.config.trainer.noise_dim], name="noise"
-        )
-        self.true_labels = tf.placeholder(dtype=tf.float32, shape=[None, 1], name="true_labels")
-        self.generated_labels = tf.placeholder(dtype=tf.float32, shape=[None, 1], name="gen_labels")
-        self.real_noise = tf.placeholder(
-            dtype=tf.float32, shape=[None] + self.config.trainer.image_dims, name="real_noise"
-        )
-        self.fake_noise = tf.placeholder(
-            dtype=tf.float32, shape=[None] + self.config.trainer.image_dims, name="fake_noise"
-        )
+        self.image_input = self.init_image_input([None] + self.config.trainer.image_dims, name="x")
+        # Random inputs are drawn in the graph, with the batch size of the image input
+        batch_size = tf.shape(self.image_input)[0]
+        self.noise_tensor = self.init_noise_input(batch_size)
+        self.true_labels, self.generated_labels = self.init_label_inputs(batch_size)
+        self.real_noise = self.init_instance_noise(batch_size, name="real_noise")
+        self.fake_noise = self.init_instance_noise(tf.shape(self.noise_tensor)[0], name="fake_noise")
 
         self.logger.info("Building training graph...")
         with tf.variable_scope("BIGAN"):
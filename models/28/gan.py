@@ -4,20 +4,18 @@ from base.base_model import BaseModel
 
 
 class GAN(BaseModel):
-    def __init__(self, config):
-        super(GAN, self).__init__(config)
+    def __init__(self, config, data=None):
+        super(GAN, self).__init__(config, data)
         self.build_model()
         self.init_saver()
 
     def build_model(self):
         # Placeholders
         self.is_training = tf.placeholder(tf.bool)
-        self.image_input = tf.placeholder(
-            tf.float32, shape=[None] + self.config.trainer.image_dims, name="x"
-        )
-        self.noise_tensor = tf.placeholder(
-            tf.float32, shape=[None, self.config.trainer.noise_dim], name="noise"
-        )
+        self.image_input = self.init_image_input([None] + self.config.trainer.image_dims, name="x")
+        # Random inputs are drawn in the graph, with the batch size of the image input
+        batch_size = tf.shape(self.image_input)[0]
+        self.noise_tensor = self.init_noise_input(batch_size)
         self.sample_tensor = tf.placeholder(
             tf.float32, shape=[None, self.config.trainer.noise_dim], name="sample"
         )
@@ -26,17 +24,12 @@ class GAN(BaseModel):
         # Random Noise addition to both image and the noise
         # This makes it harder for the discriminator to do it's job, preventing
         # it from always "winning" the GAN min/max contest
-        self.real_noise = tf.placeholder(
-            dtype=tf.float32, shape=[None] + self.config.trainer.image_dims, name="real_noise"
-        )
-        self.fake_noise = tf.placeholder(
-            dtype=tf.float32, shape=[None] + self.config.trainer.image_dims, name="fake_noise"
-        )
+        self.real_noise = self.init_instance_noise(batch_size, name="real_noise")
+        self.fake_noise = self.init_instance_noise(tf.shape(self.noise_tensor)[0], name="fake_noise")
 
         # self.real_image = self.image_input + self.fake_noise
         # Placeholders for the true and fake labels
-        self.true_labels = tf.placeholder(dtype=tf.float32, shape=[None, 1], name="true_labels")
-        self.generated_labels = tf.placeholder(dtype=tf.float32, shape=[None, 1], name="gen_labels")
+        self.true_labels, self.generated_labels = self.init_label_inputs(batch_size)
         # Full Model Scope
         with tf.variable_scope("DCGAN"):
             with tf.variable_scope("Generator_Model"):
@@ -6,12 +6,12 @@ import utils.alad_utils as sn
 
 
 class Mark1(BaseModel):
-    def __init__(self, config):
+    def __init__(self, config, data=None):
         """
         Args:
             config:
         """
-        super(Mark1, self).__init__(config)
+        super(Mark1, self).__init__(config, data)
         self.build_model()
         self.init_saver()
 
@@ -20,13 +20,14 @@ class Mark1(BaseModel):
         self.init_kernel = tf.random_normal_initializer(mean=0.0, stddev=0.02)
         # Placeholders
         self.is_training = tf.placeholder(tf.bool)
-        self.image_input = tf.placeholder(
-            tf.float32, shape=[None] + self.config.trainer.image_dims, name="x"
+        self.image_input = self.init_image_input([None] + self.config.trainer.image_dims, name="x")
+        # Random inputs are drawn in the graph, with the batch size of the image input
+        batch_size = tf.shape(self.image_input)[0]
+        # The trainer never flips the soft labels
+        self.true_labels, self.generated_labels = self.init_label_inputs(
+            batch_size, noise_probability=0.0
         )
 
-        self.true_labels = tf.placeholder(dtype=tf.float32, shape=[None, 1], name="true_labels")
-        self.generated_labels = tf.placeholder(dtype=tf.float32, shape=[None, 1], name="gen_labels")
-
         self.logger.info("Building training graph...")
 
         with tf.variable_scope("Mark1"):
@@ -5,12 +5,12 @@ from utils.alad_utils import get_getter
 
 
 class SkipGANomaly(BaseModel):
-    def __init__(self, config):
+    def __init__(self, config, data=None):
         """
         Args:
             config:
         """
-        super(SkipGANomaly, self).__init__(config)
+        super(SkipGANomaly, self).__init__(config, data)
         self.build_model()
         self.init_saver()
 
@@ -18,12 +18,14 @@ class SkipGANomaly(BaseModel):
         # Place holders
         self.img_size = self.config.data_loader.image_size
         self.is_training = tf.placeholder(tf.bool)
-        self.image_input = tf.placeholder(
-            dtype=tf.float32, shape=[None] + self.config.trainer.image_dims, name="x"
-        )
+        self.image_input = self.init_image_input([None] + self.config.trainer.image_dims, name="x")
+        # Random inputs are drawn in the graph, with the batch size of the image input
+        batch_size = tf.shape(self.image_input)[0]
         self.init_kernel = tf.random_normal_initializer(mean=0.0, stddev=0.02)
-        self.true_labels = tf.placeholder(dtype=tf.float32, shape=[None, 1], name="true_labels")
-        self.generated_labels = tf.placeholder(dtype=tf.float32, shape=[None, 1], name="gen_labels")
+        # The trainer never flips the soft labels
+        self.true_labels, self.generated_labels = self.init_label_inputs(
+            batch_size, noise_probability=0.0
+        )
         #######################################################################
         # GRAPH
         ########################################################################
@@ -5,8 +5,8 @@ import utils.alad_utils as sn
 
 
 class ANOGAN(BaseModel):
-    def __init__(self, config):
-        super(ANOGAN, self).__init__(config)
+    def __init__(self, config, data=None):
+        super(ANOGAN, self).__init__(config, data)
         self.build_model()
         self.init_saver()
 
@@ -19,21 +19,14 @@ class ANOGAN(BaseModel):
                 uniform=False, seed=None, dtype=tf.float32
             )
         self.is_training = tf.placeholder(tf.bool)
-        self.image_input = tf.placeholder(
-            tf.float32, shape=[None] + self.config.trainer.image_dims, name="x"
-        )
-        self.noise_tensor = tf.placeholder(
-            tf.float32, shape=[None, self.config.trainer.noise_dim], name="noise"
-        )
+        self.image_input = self.init_image_input([None] + self.config.trainer.image_dims, name="x")
+        # Random inputs are drawn in the graph, with the batch size of the image input
+        batch_size = tf.shape(self.image_input)[0]
+        self.noise_tensor = self.init_noise_input(batch_size)
         # Placeholders for the true and fake labels
-        self.true_labels = tf.placeholder(dtype=tf.float32, shape=[None, 1])
-        self.generated_labels = tf.placeholder(dtype=tf.float32, shape=[None, 1])
-        self.real_noise = tf.placeholder(
-            dtype=tf.float32, shape=[None] + self.config.trainer.image_dims, name="real_noise"
-        )
-        self.fake_noise = tf.placeholder(
-            dtype=tf.float32, shape=[None] + self.config.trainer.image_dims, name="fake_noise"
-        )
+        self.true_labels, self.generated_labels = self.init_label_inputs(batch_size)
+        self.real_noise = self.init_instance_noise(batch_size, name="real_noise")
+        self.fake_noise = self.init_instance_noise(tf.shape(self.noise_tensor)[0], name="fake_noise")
         # Building the Graph
         self.logger.info("Building Graph")
         with tf.variable_scope("ANOGAN"):
@@ -6,12 +6,12 @@ import utils.alad_utils as sn
 
 
 class GANomaly(BaseModel):
-    def __init__(self, config):
+    def __init__(self, config, data=None):
         """
         Args:
             config:
         """
-        super(GANomaly, self).__init__(config)
+        super(GANomaly, self).__init__(config, data)
         self.build_model()
         self.init_saver()
 
@@ -25,17 +25,18 @@ class GANomaly(BaseModel):
             )
         # Placeholders
         self.is_training = tf.placeholder(tf.bool)
-        self.image_input = tf.placeholder(
-            tf.float32, shape=[None] + self.config.trainer.image_dims, name="x"
+        self.image_input = self.init_image_input([None] + self.config.trainer.image_dims, name="x")
+        # Random inputs are drawn in the graph, with the batch size of the image input
+        batch_size = tf.shape(self.image_input)[0]
+        # The trainer never flips the soft labels and keeps real_noise at zero
+        self.true_labels, self.generated_labels = self.init_label_inputs(
+            batch_size, noise_probability=0.0
         )
-
-        self.true_labels = tf.placeholder(dtype=tf.float32, shape=[None, 1], name="true_labels")
-        self.generated_labels = tf.placeholder(dtype=tf.float32, shape=[None, 1], name="gen_labels")
-        self.real_noise = tf.placeholder(
-            dtype=tf.float32, shape=[None] + self.config.trainer.image_dims, name="real_noise"
+        self.real_noise = self.init_instance_noise(
+            batch_size, name="real_noise", include_noise=False
         )
-        self.fake_noise = tf.placeholder(
-            dtype=tf.float32, shape=[None] + self.config.trainer.image_dims, name="fake_noise"
+        self.fake_noise = self.init_instance_noise(
+            batch_size, name="fake_noise", sigma_start=1.25, sigma_min=1.0
         )
         self.logger.info("Building training graph...")
 
@@ -5,12 +5,12 @@ import utils.alad_utils as sn
 
 
 class ALAD(BaseModel):
-    def __init__(self, config):
+    def __init__(self, config, data=None):
         """
         Args:
             config:
         """
-        super(ALAD, self).__init__(config)
+        super(ALAD, self).__init__(config, data)
         self.build_model()
         self.init_saver()
 
@@ -19,142 +19,40 @@ class ALAD(BaseModel):
         # Placeholdersn
         self.init_kernel = tf.random_normal_initializer(mean=0.0, stddev=0.02)
         self.is_training = tf.placeholder(tf.bool)
-        self.image_tensor = tf.placeholder(
-            tf.float32, shape=[None] + self.config.trainer.image_dims, name="x"
-        )
-        self.noise_tensor = tf.placeholder(
-            tf.float32, shape=[None, self.config.trainer.noise_dim], name="noise"
-        )
-        self.true_labels = tf.placeholder(dtype=tf.float32, shape=[None, 1], name="true_labels")
-        self.generated_labels = tf.placeholder(dtype=tf.float32, shape=[None, 1], name="gen_labels")
-        self.real_noise = tf.placeholder(
-            dtype=tf.float32, shape=[None] + self.config.trainer.image_dims, name="real_noise"
-        )
-        self.fake_noise = tf.placeholder(
-            dtype=tf.float32, shape=[None] + self.config.trainer.image_dims, name="fake_noise"
-        )
-        # Building the Graph
-        with tf.variable_scope("ALAD"):
-            # Generated noise from the encoder
-            with tf.variable_scope("Encoder_Model"):
-                self.z_gen = self.encoder(
-                    self.image_tensor, do_spectral_norm=self.config.trainer.do_spectral_norm
-                )
-            # Generated image and reconstructed image from the Generator
-            with tf.variable_scope("Generator_Model"):
-                self.img_gen = self.generator(self.noise_tensor) + self.fake_noise
-                self.rec_img = self.generator(self.z_gen)
-
-            # Reconstructed image of generated image from the encoder
-            with tf.variable_scope("Encoder_Model"):
-                self.rec_z = self.encoder(self.img_gen, do_spectral_norm=self.config.spectral_norm)
-
-            # Discriminator results of (G(z),z) and (x, E(x))
-            with tf.variable_scope("Discriminator_Model_XZ"):
-                l_generator, inter_layer_rct_xz = self.discriminator_xz(
-                    self.img_gen, self.noise_tensor, do_spectral_norm=self.config.spectral_norm
-                )
-                l_encoder, inter_layer_inp_xz = self.discriminator_xz(
-                    self.image_tensor + self.real_noise,
-                    self.z_gen,
-                    do_spectral_norm=self.config.do_spectral_norm,
-                )
-
-            # Discrimeinator results of (x, x) and (x, G(E(x))
-            with tf.variable_scope("Discriminator_Model_XX"):
-                x_logit_real, inter_layer_inp_xx = self.discriminator_xx(
-                    self.image_tensor + self.real_noise,
-                    self.image_tensor + self.real_noise,
-                    do_spectral_norm=self.config.spectral_norm,
-                )
-                x_logit_fake, inter_layer_rct_xx = self.discriminator_xx(
-                    self.image_tensor + self.real_noise,
-                    self.rec_img,
-                    do_spectral_norm=self.config.spectral_norm,
-                )
-            # Discriminator results of (z, z) and (z, E(G(z))
-            with tf.variable_scope("Discriminator_Model_ZZ"):
-                z_logit_real, _ = self.discriminator_zz(
-                    self.noise_tensor, self.noise_tensor, do_spectral_norm=self.config.spectral_norm
-                )
-                z_logit_fake, _ = self.discriminator_zz(
-                    self.noise_tensor, self.rec_z, do_spectral_norm=self.config.spectral_norm
-                )
-        ########################################################################
-        # LOSS FUNCTIONS
-        ########################################################################
-        with tf.name_scope("Loss_Functions"):
-            # discriminator xz
-
-            # Discriminator should classify encoder pair as real
-            loss_dis_enc = tf.reduce_mean(
-                tf.nn.sigmoid_cross_entropy_with_logits(labels=self.true_labels, logits=l_encoder)
-            )
-            # Discriminator should classify generator pair as fake
-            loss_dis_gen = tf.reduce_mean(
-                tf.nn.sigmoid_cross_entropy_with_logits(
-                    labels=self.generated_labels, logits=l_generator
-                )
-            )
-            self.dis_loss_xz = loss_dis_gen + loss_dis_enc
-
-            # discriminator xx
-            x_real_dis = tf.nn.sigmoid_cross_entropy_with_logits(
-                logits=x_logit_real, labels=tf.ones_like(x_logit_real)
-            )
-            x_fake_dis = tf.nn.sigmoid_cross_entropy_with_logits(
-                logits=x_logit_fake, labels=tf.zeros_like(x_logit_fake)
-            )
-            self.dis_loss_xx = tf.reduce_mean(x_real_dis + x_fake_dis)
-            # discriminator zz
-            z_real_dis = tf.nn.sigmoid_cross_entropy_with_logits(
-                logits=z_logit_real, labels=tf.ones_like(z_logit_real)
-            )
-            z_fake_dis = tf.nn.sigmoid_cross_entropy_with_logits(
-                logits=z_logit_fake, labels=tf.zeros_like(z_logit_fake)
-            )
-            self.dis_loss_zz = tf.reduce_mean(z_real_dis + z_fake_dis)
-            # Compute the whole discriminator loss
-            self.loss_discriminator = (
-                self.dis_loss_xz + self.dis_loss_xx + self.dis_loss_zz
-                if self.config.trainer.allow_zz
-                else self.dis_loss_xz + self.dis_loss_xx
-            )
-            # generator and encoder
-            if self.config.trainer.flip_labels:
-                labels_gen = tf.zeros_like(l_generator)
-                labels_enc = tf.ones_like(l_encoder)
-            else:
-                labels_gen = tf.ones_like(l_generator)
-                labels_enc = tf.zeros_like(l_encoder)
-
-            gen_loss_xz = tf.reduce_mean(
-                tf.nn.sigmoid_cross_entropy_with_logits(labels=labels_gen, logits=l_generator)
-            )
-            enc_loss_xz = tf.reduce_mean(
-                tf.nn.sigmoid_cross_entropy_with_logits(labels=labels_enc, logits=l_encoder)
-            )
-
-            x_real_gen = tf.nn.sigmoid_cross_entropy_with_logits(
-                logits=x_logit_real, labels=tf.zeros_like(x_logit_real)
-            )
-            x_fake_gen = tf.nn.sigmoid_cross_entropy_with_logits(
-                logits=x_logit_fake, labels=tf.ones_like(x_logit_fake)
-            )
-            z_real_gen = tf.nn.sigmoid_cross_entropy_with_logits(
-                logits=z_logit_real, labels=tf.zeros_like(z_logit_real)
-            )
-            z_fake_gen = tf.nn.sigmoid_cross_entropy_with_logits(
-                logits=z_logit_fake, labels=tf.ones_like(z_logit_fake)
-            )
-
-            cost_x = tf.reduce_mean(x_real_gen + x_fake_gen)
-            cost_z = tf.reduce_mean(z_real_gen + z_fake_gen)
-
-            cycle_consistency_loss = cost_x + cost_z if self.config.trainer.allow_zz else cost_x
-            self.loss_generator = gen_loss_xz + cycle_consistency_loss
-            self.loss_encoder = enc_loss_xz + cycle_consistency_loss
-
+        self.image_tensor = self.init_image_input([None] + self.config.trainer.image_dims, name="x")
+        # Random inputs are drawn in the graph, with the batch size of the image input
+        batch_size = tf.shape(self.image_tensor)[0]
+        self.noise_tensor = self.init_noise_input(batch_size)
+        self.true_labels, self.generated_labels = self.init_label_inputs(batch_size)
+        self.real_noise = self.init_instance_noise(batch_size, name="real_noise")
+        self.fake_noise = self.init_instance_noise(tf.shape(self.noise_tensor)[0], name="fake_noise")
+        # Building the Graph, data parallel training builds it on every shard of the batch,
+        # see build_replicas
+        inputs = [
+            self.image_tensor,
+            self.noise_tensor,
+            self.true_labels,
+            self.generated_labels,
+            self.real_noise,
+            self.fake_noise,
+        ]
+        if self.replicas > 1:
+            replicas = self.build_replicas(self.alad_losses, inputs)
+            alad = self.merge_replicas(replicas)
+        else:
+            alad = self.alad_losses(*inputs)
+        self.z_gen = alad["z_gen"]
+        self.img_gen = alad["img_gen"]
+        self.rec_img = alad["rec_img"]
+        self.rec_z = alad["rec_z"]
+        self.dis_loss_xz = alad["dis_loss_xz"]
+        self.dis_loss_xx = alad["dis_loss_xx"]
+        self.dis_loss_zz = alad["dis_loss_zz"]
+        self.loss_discriminator = alad["loss_discriminator"]
+        self.loss_generator = alad["loss_generator"]
+        self.loss_encoder = alad["loss_encoder"]
+        loss_dis_enc, loss_dis_gen = alad["loss_dis_enc"], alad["loss_dis_gen"]
+        cost_x, cost_z = alad["cost_x"], alad["cost_z"]
         ########################################################################
         # OPTIMIZATION
         ########################################################################
@@ -205,27 +103,70 @@ class ALAD(BaseModel):
                 beta2=self.config.trainer.optimizer_adam_beta2,
             )
 
-            with tf.control_dependencies(self.update_ops_gen):
-                self.gen_op = self.gen_optimizer.minimize(
-                    self.loss_generator, global_step=self.global_step_tensor, var_list=self.gvars
+            # Data parallel updates, see replicated_update
+            if self.replicas > 1:
+                self.gen_op = self.replicated_update(
+                    self.gen_optimizer,
+                    replicas,
+                    "loss_generator",
+                    self.gvars,
+                    "ALAD/Generator_Model",
+                    global_step=True,
+                )
+                self.enc_op = self.replicated_update(
+                    self.enc_optimizer,
+                    replicas,
+                    "loss_encoder",
+                    self.evars,
+                    "ALAD/Encoder_Model",
+                )
+                self.dis_op_xz = self.replicated_update(
+                    self.disc_optimizer,
+                    replicas,
+                    "dis_loss_xz",
+                    self.dxzvars,
+                    "ALAD/Discriminator_Model_XZ",
+                )
+                self.dis_op_xx = self.replicated_update(
+                    self.disc_optimizer,
+                    replicas,
+                    "dis_loss_xx",
+                    self.dxxvars,
+                    "ALAD/Discriminator_Model_XX",
+                )
+                self.dis_op_zz = self.replicated_update(
+                    self.disc_optimizer,
+                    replicas,
+                    "dis_loss_zz",
+                    self.dzzvars,
+                    "ALAD/Discriminator_Model_ZZ",
                 )
-            with tf.control_dependencies(self.update_ops_enc):
-                self.enc_op = self.enc_optimizer.minimize(self.loss_encoder, var_list=self.evars)
+            else:
+                with tf.control_dependencies(self.update_ops_gen):
+                    self.gen_op = self.gen_optimizer.minimize(
+                        self.loss_generator,
+                        global_step=self.global_step_tensor,
+                        var_list=self.gvars,
+                    )
+                with tf.control_dependencies(self.update_ops_enc):
+                    self.enc_op = self.enc_optimizer.minimize(
+                        self.loss_encoder, var_list=self.evars
+                    )
 
-            with tf.control_dependencies(self.update_ops_dis_xz):
-                self.dis_op_xz = self.disc_optimizer.minimize(
-                    self.dis_loss_xz, var_list=self.dxzvars
-                )
+                with tf.control_dependencies(self.update_ops_dis_xz):
+                    self.dis_op_xz = self.disc_optimizer.minimize(
+                        self.dis_loss_xz, var_list=self.dxzvars
+                    )
 
-            with tf.control_dependencies(self.update_ops_dis_xx):
-                self.dis_op_xx = self.disc_optimizer.minimize(
-                    self.dis_loss_xx, var_list=self.dxxvars
-                )
+                with tf.control_dependencies(self.update_ops_dis_xx):
+                    self.dis_op_xx = self.disc_optimizer.minimize(
+                        self.dis_loss_xx, var_list=self.dxxvars
+                    )
 
-            with tf.control_dependencies(self.update_ops_dis_zz):
-                self.dis_op_zz = self.disc_optimizer.minimize(
-                    self.dis_loss_zz, var_list=self.dzzvars
-                )
+                with tf.control_dependencies(self.update_ops_dis_zz):
+                    self.dis_op_zz = self.disc_optimizer.minimize(
+                        self.dis_loss_zz, var_list=self.dzzvars
+                    )
 
             # Exponential Moving Average for inference
             def train_op_with_ema_dependency(vars, op):
@@ -248,6 +189,13 @@ class ALAD(BaseModel):
                 self.dzzvars, self.dis_op_zz
             )
 
+        # Whole train steps in one run, see train_step of the trainer
+        self.fused_losses = None
+        if self.config.trainer.fused_steps and self.data is not None:
+            self.fused_losses = self.init_fused_train_op(
+                self.fused_step, ["gen", "enc", "disc", "disc_xz", "disc_xx", "disc_zz"]
+            )
+
         with tf.variable_scope("ALAD"):
             with tf.variable_scope("Encoder_Model"):
                 self.z_gen_ema = self.encoder(
@@ -346,6 +294,211 @@ class ALAD(BaseModel):
         self.sum_op_im = tf.summary.merge_all("image")
         self.sum_op_valid = tf.summary.merge_all("v")
 
+    def alad_losses(self, image, noise, true_labels, generated_labels, real_noise, fake_noise):
+        """
+        Forward pass of the encoder, the generator and the three discriminators and their
+        losses, built for the train graph and for every update of the fused loop
+        Args:
+            image: batch of real images
+            noise: latent noise of the generated images
+            true_labels, generated_labels: targets of the discriminator xz
+            real_noise, fake_noise: instance noise of the real and the generated images
+        Returns:
+            dict of the tensors of the pass
+        """
+        with tf.variable_scope("ALAD"):
+            # Generated noise from the encoder
+            with tf.variable_scope("Encoder_Model"):
+                z_gen = self.encoder(image, do_spectral_norm=self.config.trainer.do_spectral_norm)
+            # Generated image and reconstructed image from the Generator
+            with tf.variable_scope("Generator_Model"):
+                img_gen = self.generator(noise) + fake_noise
+                rec_img = self.generator(z_gen)
+
+            # Reconstructed image of generated image from the encoder
+            with tf.variable_scope("Encoder_Model"):
+                rec_z = self.encoder(img_gen, do_spectral_norm=self.config.spectral_norm)
+
+            # Discriminator results of (G(z),z) and (x, E(x))
+            with tf.variable_scope("Discriminator_Model_XZ"):
+                l_generator, inter_layer_rct_xz = self.discriminator_xz(
+                    img_gen, noise, do_spectral_norm=self.config.spectral_norm
+                )
+                l_encoder, inter_layer_inp_xz = self.discriminator_xz(
+                    image + real_noise,
+                    z_gen,
+                    do_spectral_norm=self.config.do_spectral_norm,
+                )
+
+            # Discrimeinator results of (x, x) and (x, G(E(x))
+            with tf.variable_scope("Discriminator_Model_XX"):
+                x_logit_real, inter_layer_inp_xx = self.discriminator_xx(
+                    image + real_noise,
+                    image + real_noise,
+                    do_spectral_norm=self.config.spectral_norm,
+                )
+                x_logit_fake, inter_layer_rct_xx = self.discriminator_xx(
+                    image + real_noise,
+                    rec_img,
+                    do_spectral_norm=self.config.spectral_norm,
+                )
+            # Discriminator results of (z, z) and (z, E(G(z))
+            with tf.variable_scope("Discriminator_Model_ZZ"):
+                z_logit_real, _ = self.discriminator_zz(
+                    noise, noise, do_spectral_norm=self.config.spectral_norm
+                )
+                z_logit_fake, _ = self.discriminator_zz(
+                    noise, rec_z, do_spectral_norm=self.config.spectral_norm
+                )
+        ########################################################################
+        # LOSS FUNCTIONS
+        ########################################################################
+        with tf.name_scope("Loss_Functions"):
+            # discriminator xz
+
+            # Discriminator should classify encoder pair as real
+            loss_dis_enc = tf.reduce_mean(
+                tf.nn.sigmoid_cross_entropy_with_logits(labels=true_labels, logits=l_encoder)
+            )
+            # Discriminator should classify generator pair as fake
+            loss_dis_gen = tf.reduce_mean(
+                tf.nn.sigmoid_cross_entropy_with_logits(
+                    labels=generated_labels, logits=l_generator
+                )
+            )
+            dis_loss_xz = loss_dis_gen + loss_dis_enc
+
+            # discriminator xx
+            x_real_dis = tf.nn.sigmoid_cross_entropy_with_logits(
+                logits=x_logit_real, labels=tf.ones_like(x_logit_real)
+            )
+            x_fake_dis = tf.nn.sigmoid_cross_entropy_with_logits(
+                logits=x_logit_fake, labels=tf.zeros_like(x_logit_fake)
+            )
+            dis_loss_xx = tf.reduce_mean(x_real_dis + x_fake_dis)
+            # discriminator zz
+            z_real_dis = tf.nn.sigmoid_cross_entropy_with_logits(
+                logits=z_logit_real, labels=tf.ones_like(z_logit_real)
+            )
+            z_fake_dis = tf.nn.sigmoid_cross_entropy_with_logits(
+                logits=z_logit_fake, labels=tf.zeros_like(z_logit_fake)
+            )
+            dis_loss_zz = tf.reduce_mean(z_real_dis + z_fake_dis)
+            # Compute the whole discriminator loss
+            loss_discriminator = (
+                dis_loss_xz + dis_loss_xx + dis_loss_zz
+                if self.config.trainer.allow_zz
+                else dis_loss_xz + dis_loss_xx
+            )
+            # generator and encoder
+            if self.config.trainer.flip_labels:
+                labels_gen = tf.zeros_like(l_generator)
+                labels_enc = tf.ones_like(l_encoder)
+            else:
+                labels_gen = tf.ones_like(l_generator)
+                labels_enc = tf.zeros_like(l_encoder)
+
+            gen_loss_xz = tf.reduce_mean(
+                tf.nn.sigmoid_cross_entropy_with_logits(labels=labels_gen, logits=l_generator)
+            )
+            enc_loss_xz = tf.reduce_mean(
+                tf.nn.sigmoid_cross_entropy_with_logits(labels=labels_enc, logits=l_encoder)
+            )
+
+            x_real_gen = tf.nn.sigmoid_cross_entropy_with_logits(
+                logits=x_logit_real, labels=tf.zeros_like(x_logit_real)
+            )
+            x_fake_gen = tf.nn.sigmoid_cross_entropy_with_logits(
+                logits=x_logit_fake, labels=tf.ones_like(x_logit_fake)
+            )
+            z_real_gen = tf.nn.sigmoid_cross_entropy_with_logits(
+                logits=z_logit_real, labels=tf.zeros_like(z_logit_real)
+            )
+            z_fake_gen = tf.nn.sigmoid_cross_entropy_with_logits(
+                logits=z_logit_fake, labels=tf.ones_like(z_logit_fake)
+            )
+
+            cost_x = tf.reduce_mean(x_real_gen + x_fake_gen)
+            cost_z = tf.reduce_mean(z_real_gen + z_fake_gen)
+
+            cycle_consistency_loss = cost_x + cost_z if self.config.trainer.allow_zz else cost_x
+            loss_generator = gen_loss_xz + cycle_consistency_loss
+            loss_encoder = enc_loss_xz + cycle_consistency_loss
+        return {
+            "z_gen": z_gen,
+            "img_gen": img_gen,
+            "rec_img": rec_img,
+            "rec_z": rec_z,
+            "dis_loss_xz": dis_loss_xz,
+            "dis_loss_xx": dis_loss_xx,
+            "dis_loss_zz": dis_loss_zz,
+            "loss_discriminator": loss_discriminator,
+            "loss_generator": loss_generator,
+            "loss_encoder": loss_encoder,
+            "loss_dis_enc": loss_dis_enc,
+            "loss_dis_gen": loss_dis_gen,
+            "cost_x": cost_x,
+            "cost_z": cost_z,
+        }
+
+    def fused_step(self):
+        """
+        One step of train_step inside the fused loop. The three discriminators are updated
+        on a batch, then the generator and the encoder on the same batch with the updated
+        discriminators.
+        Returns:
+            generator, encoder, discriminator, xz, xx and zz losses of the step
+        """
+        image = self.data.next_batch()
+        batch_size = tf.shape(image)[0]
+
+        def alad_pass():
+            true_labels, generated_labels = self.draw_labels(batch_size)
+            return self.alad_losses(
+                image,
+                self.draw_noise(batch_size),
+                true_labels,
+                generated_labels,
+                self.draw_instance_noise(batch_size),
+                self.draw_instance_noise(batch_size),
+            )
+
+        mark = self.update_ops_mark()
+        alad = alad_pass()
+        dis_losses = [
+            self.loop_update(
+                self.disc_optimizer,
+                alad["dis_loss_{}".format(name)],
+                var_list,
+                self.loop_update_ops(mark, "Discriminator_Model_{}".format(name.upper())),
+                ema=ema,
+            )
+            for name, var_list, ema in [
+                ("xz", self.dxzvars, self.xz_ema),
+                ("xx", self.dxxvars, self.xx_ema),
+                ("zz", self.dzzvars, self.zz_ema),
+            ]
+        ]
+        with tf.control_dependencies(dis_losses):
+            mark = self.update_ops_mark()
+            alad_gen = alad_pass()
+            gen_loss = self.loop_update(
+                self.gen_optimizer,
+                alad_gen["loss_generator"],
+                self.gvars,
+                self.loop_update_ops(mark, "Generator_Model"),
+                ema=self.gen_ema,
+                global_step=True,
+            )
+            enc_loss = self.loop_update(
+                self.enc_optimizer,
+                alad_gen["loss_encoder"],
+                self.evars,
+                self.loop_update_ops(mark, "Encoder_Model"),
+                ema=self.enc_ema,
+            )
+        return [gen_loss, enc_loss, alad["loss_discriminator"]] + dis_losses
+
     def encoder(self, img_tensor, getter=None, do_spectral_norm=True):
 
         """ Encoder architecture in tensorflow
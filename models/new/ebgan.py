@@ -6,8 +6,8 @@ import utils.alad_utils as sn
 
 
 class EBGAN(BaseModel):
-    def __init__(self, config):
-        super(EBGAN, self).__init__(config)
+    def __init__(self, config, data=None):
+        super(EBGAN, self).__init__(config, data)
         self.build_model()
         self.init_saver()
 
@@ -23,12 +23,10 @@ class EBGAN(BaseModel):
             )
         # Placeholders
         self.is_training = tf.placeholder(tf.bool)
-        self.image_input = tf.placeholder(
-            tf.float32, shape=[None] + self.config.trainer.image_dims, name="x"
-        )
-        self.noise_tensor = tf.placeholder(
-            tf.float32, shape=[None, self.config.trainer.noise_dim], name="noise"
-        )
+        self.image_input = self.init_image_input([None] + self.config.trainer.image_dims, name="x")
+        # Random inputs are drawn in the graph, with the batch size of the image input
+        batch_size = tf.shape(self.image_input)[0]
+        self.noise_tensor = self.init_noise_input(batch_size)
         # Build Training Graph
         self.logger.info("Building training graph...")
         with tf.variable_scope("EBGAN"):
@@ -6,8 +6,8 @@ import utils.alad_utils as sn
 
 
 class EncEBGAN(BaseModel):
-    def __init__(self, config):
-        super(EncEBGAN, self).__init__(config)
+    def __init__(self, config, data=None):
+        super(EncEBGAN, self).__init__(config, data)
         self.build_model()
         self.init_saver()
 
@@ -24,12 +24,10 @@ class EncEBGAN(BaseModel):
         self.is_training_gen = tf.placeholder(tf.bool)
         self.is_training_dis = tf.placeholder(tf.bool)
         self.is_training_enc = tf.placeholder(tf.bool)
-        self.image_input = tf.placeholder(
-            tf.float32, shape=[None] + self.config.trainer.image_dims, name="x"
-        )
-        self.noise_tensor = tf.placeholder(
-            tf.float32, shape=[None, self.config.trainer.noise_dim], name="noise"
-        )
+        self.image_input = self.init_image_input([None] + self.config.trainer.image_dims, name="x")
+        # Random inputs are drawn in the graph, with the batch size of the image input
+        batch_size = tf.shape(self.image_input)[0]
+        self.noise_tensor = self.init_noise_input(batch_size)
         # Build Training Graph
         self.logger.info("Building training graph...")
         with tf.variable_scope("EncEBGAN"):
@@ -5,8 +5,8 @@ from utils.alad_utils import get_getter
 
 
 class FAnogan(BaseModel):
-    def __init__(self, config):
-        super(FAnogan, self).__init__(config)
+    def __init__(self, config, data=None):
+        super(FAnogan, self).__init__(config, data)
         self.build_model()
         self.init_saver()
 
@@ -22,30 +22,32 @@ class FAnogan(BaseModel):
         self.is_training_gen = tf.placeholder(tf.bool)
         self.is_training_dis = tf.placeholder(tf.bool)
         self.is_training_enc = tf.placeholder(tf.bool)
-        self.image_input = tf.placeholder(
-            tf.float32, shape=[None] + self.config.trainer.image_dims, name="x"
-        )
-        self.noise_tensor = tf.placeholder(
-            tf.float32, shape=[None, self.config.trainer.noise_dim], name="noise"
-        )
-        self.true_labels = tf.placeholder(dtype=tf.float32, shape=[None, 1], name="true_labels")
-        self.generated_labels = tf.placeholder(dtype=tf.float32, shape=[None, 1], name="gen_labels")
-        self.real_noise = tf.placeholder(
-            dtype=tf.float32, shape=[None] + self.config.trainer.image_dims, name="real_noise"
-        )
-        self.fake_noise = tf.placeholder(
-            dtype=tf.float32, shape=[None] + self.config.trainer.image_dims, name="fake_noise"
-        )
+        self.image_input = self.init_image_input([None] + self.config.trainer.image_dims, name="x")
+        # Random inputs are drawn in the graph, with the batch size of the image input
+        batch_size = tf.shape(self.image_input)[0]
+        self.noise_tensor = self.init_noise_input(batch_size)
+        self.true_labels, self.generated_labels = self.init_label_inputs(batch_size)
+        self.real_noise = self.init_instance_noise(batch_size, name="real_noise")
+        self.fake_noise = self.init_instance_noise(tf.shape(self.noise_tensor)[0], name="fake_noise")
         self.logger.info("Building training graph...")
+        # Generator and Discriminator Training
+        gan = self.gan_losses(
+            self.image_input,
+            self.noise_tensor,
+            self.true_labels,
+            self.generated_labels,
+            self.real_noise,
+            self.fake_noise,
+        )
+        self.image_gen = gan["image_gen"]
+        self.disc_real, self.disc_f_real = gan["disc_real"], gan["disc_f_real"]
+        self.disc_fake, self.disc_f_fake = gan["disc_fake"], gan["disc_f_fake"]
+        self.loss_disc_real, self.loss_disc_fake = gan["loss_disc_real"], gan["loss_disc_fake"]
+        self.loss_discriminator = gan["loss_discriminator"]
+        self.loss_generator_ce = gan["loss_generator_ce"]
+        self.loss_generator_fm = gan["loss_generator_fm"]
+        self.loss_generator = gan["loss_generator"]
         with tf.variable_scope("FAnogan"):
-            # Generator and Discriminator Training
-            with tf.variable_scope("Generator_Model"):
-                self.image_gen = self.generator(self.noise_tensor) + self.fake_noise
-            with tf.variable_scope("Discriminator_Model"):
-                self.disc_real, self.disc_f_real = self.discriminator(
-                    self.image_input + self.real_noise
-                )
-                self.disc_fake, self.disc_f_fake = self.discriminator(self.image_gen)
             # Encoder Training
 
             with tf.variable_scope("Encoder_Model"):
@@ -100,64 +102,6 @@ class FAnogan(BaseModel):
                         / self.config.trainer.feature_layer_dim
                     )
                     self.loss_encoder = tf.reduce_mean(self.izi_reconstruction + self.izi_disc)
-            with tf.name_scope("Discriminator_Generator"):
-                if self.config.trainer.mode == "standard":
-                    self.loss_disc_real = tf.reduce_mean(
-                        tf.nn.sigmoid_cross_entropy_with_logits(
-                            labels=self.true_labels, logits=self.disc_real
-                        )
-                    )
-                    self.loss_disc_fake = tf.reduce_mean(
-                        tf.nn.sigmoid_cross_entropy_with_logits(
-                            labels=self.generated_labels, logits=self.disc_fake
-                        )
-                    )
-                    self.loss_discriminator = self.loss_disc_real + self.loss_disc_fake
-                    # Flip the weigths for the encoder and generator
-                    if self.config.trainer.flip_labels:
-                        labels_gen = tf.zeros_like(self.disc_fake)
-                    else:
-                        labels_gen = tf.ones_like(self.disc_fake)
-                    # Generator
-                    self.loss_generator_ce = tf.reduce_mean(
-                        tf.nn.sigmoid_cross_entropy_with_logits(
-                            labels=labels_gen, logits=self.disc_fake
-                        )
-                    )
-                    delta = self.disc_f_fake - self.disc_f_real
-                    delta = tf.layers.Flatten()(delta)
-                    self.loss_generator_fm = tf.reduce_mean(
-                        tf.norm(delta, ord=2, axis=1, keepdims=False)
-                    )
-                    self.loss_generator = (
-                        self.loss_generator_ce
-                        + self.config.trainer.feature_match_weight * self.loss_generator_fm
-                    )
-                elif self.config.trainer.mode == "wgan":
-                    self.loss_d_fake = -tf.reduce_mean(self.disc_fake)
-                    self.loss_d_real = -tf.reduce_mean(self.disc_real)
-                    self.loss_discriminator = -self.loss_d_fake + self.loss_d_real
-                    self.loss_generator = -tf.reduce_mean(self.disc_fake)
-
-                # Weight Clipping and Encoder Part
-                elif self.config.trainer.mode == "wgan_gp":
-                    self.loss_generator = -tf.reduce_mean(self.disc_fake)
-                    self.loss_d_fake = -tf.reduce_mean(self.disc_fake)
-                    self.loss_d_real = -tf.reduce_mean(self.disc_real)
-                    self.loss_discriminator = -self.loss_d_fake - self.loss_d_real
-                    alpha_x = tf.random_uniform(
-                        shape=[self.config.data_loader.batch_size] + self.config.trainer.image_dims,
-                        minval=0.0,
-                        maxval=1.0,
-                    )
-                    differences_x = self.image_gen - self.image_input
-                    interpolates_x = self.image_input + (alpha_x * differences_x)
-                    gradients = tf.gradients(self.discriminator(interpolates_x), [interpolates_x])[
-                        0
-                    ]
-                    slopes = tf.sqrt(tf.reduce_sum(tf.square(gradients), reduction_indices=[1]))
-                    gradient_penalty = tf.reduce_mean((slopes - 1.0) ** 2)
-                    self.loss_discriminator += self.config.trainer.wgan_gp_lambda * gradient_penalty
         with tf.name_scope("Optimizations"):
             if self.config.trainer.mode == "standard":
                 # Build the optimizers
@@ -267,6 +211,13 @@ class FAnogan(BaseModel):
             with tf.control_dependencies([self.enc_op]):
                 self.train_enc_op = tf.group(maintain_averages_op_enc)
 
+        # Whole GAN steps in one run, see train_step_gan of the trainer
+        self.fused_gan_losses = None
+        if self.config.trainer.fused_steps and self.data is not None:
+            self.fused_gan_losses = self.init_fused_train_op(
+                self.fused_gan_step, ["gen", "disc"], name="fused_gan"
+            )
+
         self.logger.info("Building Testing Graph...")
 
         with tf.variable_scope("FAnogan"):
@@ -361,6 +312,155 @@ class FAnogan(BaseModel):
         self.sum_op_im_2 = tf.summary.merge_all("image_2")
         self.sum_op_valid = tf.summary.merge_all("v")
 
+    def gan_losses(self, image, noise, true_labels, generated_labels, real_noise, fake_noise):
+        """
+        Forward pass of the generator and the discriminator and their losses, built for the
+        train graph and for every update of the fused loop
+        Args:
+            image: batch of real images
+            noise: latent noise of the generated images
+            true_labels, generated_labels: targets of the discriminator
+            real_noise, fake_noise: instance noise of the real and the generated images
+        Returns:
+            dict of the tensors of the pass
+        """
+        with tf.variable_scope("FAnogan"):
+            with tf.variable_scope("Generator_Model"):
+                image_gen = self.generator(noise) + fake_noise
+            with tf.variable_scope("Discriminator_Model"):
+                disc_real, disc_f_real = self.discriminator(image + real_noise)
+                disc_fake, disc_f_fake = self.discriminator(image_gen)
+        # The parts of the losses are only summarized in standard mode
+        loss_disc_real, loss_disc_fake = None, None
+        loss_generator_ce, loss_generator_fm = None, None
+        with tf.name_scope("Discriminator_Generator"):
+            if self.config.trainer.mode == "standard":
+                loss_disc_real = tf.reduce_mean(
+                    tf.nn.sigmoid_cross_entropy_with_logits(labels=true_labels, logits=disc_real)
+                )
+                loss_disc_fake = tf.reduce_mean(
+                    tf.nn.sigmoid_cross_entropy_with_logits(
+                        labels=generated_labels, logits=disc_fake
+                    )
+                )
+                loss_discriminator = loss_disc_real + loss_disc_fake
+                # Flip the weigths for the encoder and generator
+                if self.config.trainer.flip_labels:
+                    labels_gen = tf.zeros_like(disc_fake)
+                else:
+                    labels_gen = tf.ones_like(disc_fake)
+                # Generator
+                loss_generator_ce = tf.reduce_mean(
+                    tf.nn.sigmoid_cross_entropy_with_logits(labels=labels_gen, logits=disc_fake)
+                )
+                delta = disc_f_fake - disc_f_real
+                delta = tf.layers.Flatten()(delta)
+                loss_generator_fm = tf.reduce_mean(tf.norm(delta, ord=2, axis=1, keepdims=False))
+                loss_generator = (
+                    loss_generator_ce + self.config.trainer.feature_match_weight * loss_generator_fm
+                )
+            elif self.config.trainer.mode == "wgan":
+                loss_d_fake = -tf.reduce_mean(disc_fake)
+                loss_d_real = -tf.reduce_mean(disc_real)
+                loss_discriminator = -loss_d_fake + loss_d_real
+                loss_generator = -tf.reduce_mean(disc_fake)
+
+            # Weight Clipping and Encoder Part
+            elif self.config.trainer.mode == "wgan_gp":
+                loss_generator = -tf.reduce_mean(disc_fake)
+                loss_d_fake = -tf.reduce_mean(disc_fake)
+                loss_d_real = -tf.reduce_mean(disc_real)
+                loss_discriminator = -loss_d_fake - loss_d_real
+                alpha_x = tf.random_uniform(
+                    shape=[self.config.data_loader.batch_size] + self.config.trainer.image_dims,
+                    minval=0.0,
+                    maxval=1.0,
+                )
+                differences_x = image_gen - image
+                interpolates_x = image + (alpha_x * differences_x)
+                gradients = tf.gradients(self.discriminator(interpolates_x), [interpolates_x])[0]
+                slopes = tf.sqrt(tf.reduce_sum(tf.square(gradients), reduction_indices=[1]))
+                gradient_penalty = tf.reduce_mean((slopes - 1.0) ** 2)
+                loss_discriminator += self.config.trainer.wgan_gp_lambda * gradient_penalty
+        return {
+            "image_gen": image_gen,
+            "disc_real": disc_real,
+            "disc_f_real": disc_f_real,
+            "disc_fake": disc_fake,
+            "disc_f_fake": disc_f_fake,
+            "loss_disc_real": loss_disc_real,
+            "loss_disc_fake": loss_disc_fake,
+            "loss_discriminator": loss_discriminator,
+            "loss_generator_ce": loss_generator_ce,
+            "loss_generator_fm": loss_generator_fm,
+            "loss_generator": loss_generator,
+        }
+
+    def fused_gan_step(self):
+        """
+        One step of train_step_gan inside the fused loop. The critic updates and the
+        generator update share one batch, each update is built on the variables left by the
+        previous one, the weights of the critic are clipped after its updates in wgan mode.
+        Returns:
+            generator loss, mean discriminator loss of the step
+        """
+        if self.config.trainer.mode == "standard":
+            disc_iters = 1
+        else:
+            disc_iters = self.config.trainer.critic_iters
+        clip = None
+        if self.config.trainer.mode == "wgan":
+
+            def clip():
+                clip_ops = [
+                    tf.assign(v, tf.clip_by_value(v, -0.01, 0.01)) for v in self.discriminator_vars
+                ]
+                return tf.group(*clip_ops)
+
+        image = self.data.next_batch()
+        batch_size = tf.shape(image)[0]
+
+        def gan_pass():
+            true_labels, generated_labels = self.draw_labels(batch_size)
+            return self.gan_losses(
+                image,
+                self.draw_noise(batch_size),
+                true_labels,
+                generated_labels,
+                self.draw_instance_noise(batch_size),
+                self.draw_instance_noise(batch_size),
+            )
+
+        disc_losses = []
+        done = []
+        for _ in range(disc_iters):
+            with tf.control_dependencies(done):
+                mark = self.update_ops_mark()
+                gan = gan_pass()
+                done = [
+                    self.loop_update(
+                        self.discriminator_optimizer,
+                        gan["loss_discriminator"],
+                        self.discriminator_vars,
+                        self.loop_update_ops(mark, "Discriminator_Model"),
+                        ema=self.dis_ema,
+                        after=clip,
+                    )
+                ]
+            disc_losses += done
+        with tf.control_dependencies(done):
+            mark = self.update_ops_mark()
+            gan = gan_pass()
+            gen_loss = self.loop_update(
+                self.generator_optimizer,
+                gan["loss_generator"],
+                self.generator_vars,
+                self.loop_update_ops(mark, "Generator_Model"),
+                ema=self.gen_ema,
+                global_step=True,
+            )
+        return gen_loss, tf.reduce_mean(disc_losses)
+
     def generator(self, noise_input, getter=None):
         with tf.variable_scope("Generator", custom_getter=getter, reuse=tf.AUTO_REUSE):
             net_name = "Layer_1"
@@ -6,12 +6,12 @@ import utils.alad_utils as sn
 
 
 class GANomaly(BaseModel):
-    def __init__(self, config):
+    def __init__(self, config, data=None):
         """
         Args:
             config:
         """
-        super(GANomaly, self).__init__(config)
+        super(GANomaly, self).__init__(config, data)
         self.build_model()
         self.init_saver()
 
@@ -20,76 +20,44 @@ class GANomaly(BaseModel):
         self.init_kernel = tf.random_normal_initializer(mean=0.0, stddev=0.02)
         # Placeholders
         self.is_training = tf.placeholder(tf.bool)
-        self.image_input = tf.placeholder(
-            tf.float32, shape=[None] + self.config.trainer.image_dims, name="x"
+        self.image_input = self.init_image_input([None] + self.config.trainer.image_dims, name="x")
+        # Random inputs are drawn in the graph, with the batch size of the image input
+        batch_size = tf.shape(self.image_input)[0]
+        # The trainer never flips the soft labels and keeps real_noise at zero
+        self.true_labels, self.generated_labels = self.init_label_inputs(
+            batch_size, noise_probability=0.0
         )
-
-        self.true_labels = tf.placeholder(dtype=tf.float32, shape=[None, 1], name="true_labels")
-        self.generated_labels = tf.placeholder(dtype=tf.float32, shape=[None, 1], name="gen_labels")
-        self.real_noise = tf.placeholder(
-            dtype=tf.float32, shape=[None] + self.config.trainer.image_dims, name="real_noise"
+        self.real_noise = self.init_instance_noise(
+            batch_size, name="real_noise", include_noise=False
         )
-        self.fake_noise = tf.placeholder(
-            dtype=tf.float32, shape=[None] + self.config.trainer.image_dims, name="fake_noise"
+        self.fake_noise = self.init_instance_noise(
+            batch_size, name="fake_noise", sigma_start=1.25, sigma_min=1.0
         )
         self.logger.info("Building training graph...")
 
-        with tf.variable_scope("GANomaly"):
-            with tf.variable_scope("Generator_Model"):
-                self.noise_gen, self.img_rec, self.noise_rec = self.generator(
-                    self.image_input + self.fake_noise,
-                    do_spectral_norm=self.config.trainer.do_spectral_norm,
-                )
-
-            with tf.variable_scope("Discriminator_Model"):
-                l_real, inter_layer_inp = self.discriminator(
-                    self.image_input + self.real_noise,
-                    do_spectral_norm=self.config.trainer.do_spectral_norm,
-                )
-                l_fake, inter_layer_rct = self.discriminator(
-                    self.img_rec, do_spectral_norm=self.config.trainer.do_spectral_norm
-                )
-
-        with tf.name_scope("Loss_Functions"):
-            # Discriminator
-            self.loss_dis_real = tf.reduce_mean(
-                tf.nn.sigmoid_cross_entropy_with_logits(labels=self.true_labels, logits=l_real)
-            )
-            self.loss_dis_fake = tf.reduce_mean(
-                tf.nn.sigmoid_cross_entropy_with_logits(labels=self.generated_labels, logits=l_fake)
-            )
-            # Feature matching part
-            fm = inter_layer_inp - inter_layer_rct
-            fm = tf.layers.Flatten()(fm)
-            self.feature_match = tf.reduce_mean(tf.norm(fm, ord=2, axis=1, keepdims=False))
-            self.loss_discriminator = (
-                self.loss_dis_fake + self.loss_dis_real + self.feature_match
-                if self.config.trainer.loss_method == "fm"
-                else self.loss_dis_fake + self.loss_dis_real
-            )
-            # Generator
-            # Adversarial Loss
-            if self.config.trainer.flip_labels:
-                labels = tf.zeros_like(l_fake)
-            else:
-                labels = tf.ones_like(l_real)
-            self.gen_loss_ce = tf.reduce_mean(
-                tf.nn.sigmoid_cross_entropy_with_logits(labels=labels, logits=l_fake)
-            )
-            # Contextual Loss
-            l1_norm = self.image_input - self.img_rec
-            l1_norm = tf.layers.Flatten()(l1_norm)
-            self.gen_loss_con = tf.reduce_mean(tf.norm(l1_norm, ord=1, axis=1, keepdims=False))
-            # Encoder Loss
-            l2_norm = self.noise_gen - self.noise_rec
-            l2_norm = tf.layers.Flatten()(l2_norm)
-            self.gen_loss_enc = tf.reduce_mean(tf.norm(l2_norm, ord=2, axis=1, keepdims=False))
-
-            self.gen_loss_total = (
-                self.config.trainer.weight_adv * self.gen_loss_ce
-                + self.config.trainer.weight_cont * self.gen_loss_con
-                + self.config.trainer.weight_enc * self.gen_loss_enc
-            )
+        # Data parallel training builds the pass on every shard of the batch, see
+        # build_replicas
+        inputs = [
+            self.image_input,
+            self.true_labels,
+            self.generated_labels,
+            self.real_noise,
+            self.fake_noise,
+        ]
+        if self.replicas > 1:
+            replicas = self.build_replicas(self.ganomaly_losses, inputs)
+            ganomaly = self.merge_replicas(replicas)
+        else:
+            ganomaly = self.ganomaly_losses(*inputs)
+        self.noise_gen, self.img_rec = ganomaly["noise_gen"], ganomaly["img_rec"]
+        self.noise_rec = ganomaly["noise_rec"]
+        self.loss_dis_real = ganomaly["loss_dis_real"]
+        self.loss_dis_fake = ganomaly["loss_dis_fake"]
+        self.feature_match = ganomaly["feature_match"]
+        self.loss_discriminator = ganomaly["loss_discriminator"]
+        self.gen_loss_ce, self.gen_loss_con = ganomaly["gen_loss_ce"], ganomaly["gen_loss_con"]
+        self.gen_loss_enc = ganomaly["gen_loss_enc"]
+        self.gen_loss_total = ganomaly["gen_loss_total"]
 
         with tf.name_scope("Optimizers"):
             # Build the optimizers
@@ -122,17 +90,34 @@ class GANomaly(BaseModel):
             self.disc_update_ops = tf.get_collection(
                 tf.GraphKeys.UPDATE_OPS, scope="GANomaly/Discriminator_Model"
             )
-            # Initialization of Optimizers
-            with tf.control_dependencies(self.gen_update_ops):
-                self.gen_op = self.generator_optimizer.minimize(
-                    self.gen_loss_total,
-                    global_step=self.global_step_tensor,
-                    var_list=self.generator_vars,
+            # Initialization of Optimizers, data parallel updates see replicated_update
+            if self.replicas > 1:
+                self.gen_op = self.replicated_update(
+                    self.generator_optimizer,
+                    replicas,
+                    "gen_loss_total",
+                    self.generator_vars,
+                    "GANomaly/Generator_Model",
+                    global_step=True,
                 )
-            with tf.control_dependencies(self.disc_update_ops):
-                self.disc_op = self.discriminator_optimizer.minimize(
-                    self.loss_discriminator, var_list=self.discriminator_vars
+                self.disc_op = self.replicated_update(
+                    self.discriminator_optimizer,
+                    replicas,
+                    "loss_discriminator",
+                    self.discriminator_vars,
+                    "GANomaly/Discriminator_Model",
                 )
+            else:
+                with tf.control_dependencies(self.gen_update_ops):
+                    self.gen_op = self.generator_optimizer.minimize(
+                        self.gen_loss_total,
+                        global_step=self.global_step_tensor,
+                        var_list=self.generator_vars,
+                    )
+                with tf.control_dependencies(self.disc_update_ops):
+                    self.disc_op = self.discriminator_optimizer.minimize(
+                        self.loss_discriminator, var_list=self.discriminator_vars
+                    )
 
             # Exponential Moving Average for Estimation
             self.dis_ema = tf.train.ExponentialMovingAverage(decay=self.config.trainer.ema_decay)
@@ -203,6 +188,85 @@ class GANomaly(BaseModel):
         self.sum_op_im = tf.summary.merge_all("image")
         self.sum_op_valid = tf.summary.merge_all("v")
 
+    def ganomaly_losses(self, image, true_labels, generated_labels, real_noise, fake_noise):
+        """
+        Forward pass of the generator and the discriminator and their losses, built for the
+        train graph and for every replica of the data parallel training
+        Args:
+            image: batch of real images
+            true_labels, generated_labels: targets of the discriminator
+            real_noise, fake_noise: instance noise of the real and the reconstructed images
+        Returns:
+            dict of the tensors of the pass
+        """
+        with tf.variable_scope("GANomaly"):
+            with tf.variable_scope("Generator_Model"):
+                noise_gen, img_rec, noise_rec = self.generator(
+                    image + fake_noise, do_spectral_norm=self.config.trainer.do_spectral_norm
+                )
+
+            with tf.variable_scope("Discriminator_Model"):
+                l_real, inter_layer_inp = self.discriminator(
+                    image + real_noise, do_spectral_norm=self.config.trainer.do_spectral_norm
+                )
+                l_fake, inter_layer_rct = self.discriminator(
+                    img_rec, do_spectral_norm=self.config.trainer.do_spectral_norm
+                )
+
+        with tf.name_scope("Loss_Functions"):
+            # Discriminator
+            loss_dis_real = tf.reduce_mean(
+                tf.nn.sigmoid_cross_entropy_with_logits(labels=true_labels, logits=l_real)
+            )
+            loss_dis_fake = tf.reduce_mean(
+                tf.nn.sigmoid_cross_entropy_with_logits(labels=generated_labels, logits=l_fake)
+            )
+            # Feature matching part
+            fm = inter_layer_inp - inter_layer_rct
+            fm = tf.layers.Flatten()(fm)
+            feature_match = tf.reduce_mean(tf.norm(fm, ord=2, axis=1, keepdims=False))
+            loss_discriminator = (
+                loss_dis_fake + loss_dis_real + feature_match
+                if self.config.trainer.loss_method == "fm"
+                else loss_dis_fake + loss_dis_real
+            )
+            # Generator
+            # Adversarial Loss
+            if self.config.trainer.flip_labels:
+                labels = tf.zeros_like(l_fake)
+            else:
+                labels = tf.ones_like(l_real)
+            gen_loss_ce = tf.reduce_mean(
+                tf.nn.sigmoid_cross_entropy_with_logits(labels=labels, logits=l_fake)
+            )
+            # Contextual Loss
+            l1_norm = image - img_rec
+            l1_norm = tf.layers.Flatten()(l1_norm)
+            gen_loss_con = tf.reduce_mean(tf.norm(l1_norm, ord=1, axis=1, keepdims=False))
+            # Encoder Loss
+            l2_norm = noise_gen - noise_rec
+            l2_norm = tf.layers.Flatten()(l2_norm)
+            gen_loss_enc = tf.reduce_mean(tf.norm(l2_norm, ord=2, axis=1, keepdims=False))
+
+            gen_loss_total = (
+                self.config.trainer.weight_adv * gen_loss_ce
+                + self.config.trainer.weight_cont * gen_loss_con
+                + self.config.trainer.weight_enc * gen_loss_enc
+            )
+        return {
+            "noise_gen": noise_gen,
+            "img_rec": img_rec,
+            "noise_rec": noise_rec,
+            "loss_dis_real": loss_dis_real,
+            "loss_dis_fake": loss_dis_fake,
+            "feature_match": feature_match,
+            "loss_discriminator": loss_discriminator,
+            "gen_loss_ce": gen_loss_ce,
+            "gen_loss_con": gen_loss_con,
+            "gen_loss_enc": gen_loss_enc,
+            "gen_loss_total": gen_loss_total,
+        }
+
     def generator(self, image_input, getter=None, do_spectral_norm=False):
         # This generator will take the image from the input dataset, and first it will
         # it will create a latent representation of that image then with the decoder part,
@@ -6,8 +6,8 @@ import utils.alad_utils as sn
 
 
 class SENCEBGAN(BaseModel):
-    def __init__(self, config):
-        super(SENCEBGAN, self).__init__(config)
+    def __init__(self, config, data=None):
+        super(SENCEBGAN, self).__init__(config, data)
         self.build_model()
         self.init_saver()
 
@@ -29,225 +29,37 @@ class SENCEBGAN(BaseModel):
         self.is_training_enc_r = tf.placeholder(tf.bool)
         self.feature_match1 = tf.placeholder(tf.float32)
         self.feature_match2 = tf.placeholder(tf.float32)
-        self.image_input = tf.placeholder(
-            tf.float32, shape=[None] + self.config.trainer.image_dims, name="x"
-        )
-        self.noise_tensor = tf.placeholder(
-            tf.float32, shape=[None, self.config.trainer.noise_dim], name="noise"
-        )
+        self.image_input = self.init_image_input([None] + self.config.trainer.image_dims, name="x")
+        # Random inputs are drawn in the graph, with the batch size of the image input
+        batch_size = tf.shape(self.image_input)[0]
+        self.noise_tensor = self.init_noise_input(batch_size)
         ############################################################################################
         # MODEL
         ############################################################################################
         self.logger.info("Building training graph...")
-        with tf.variable_scope("SENCEBGAN"):
-            # First training part
-            # G(z) ==> x'
-            with tf.variable_scope("Generator_Model"):
-                self.image_gen = self.generator(self.noise_tensor)
-            # Discriminator outputs
-            with tf.variable_scope("Discriminator_Model"):
-                self.embedding_real, self.decoded_real = self.discriminator(
-                    self.image_input, do_spectral_norm=self.config.trainer.do_spectral_norm
-                )
-                self.embedding_fake, self.decoded_fake = self.discriminator(
-                    self.image_gen, do_spectral_norm=self.config.trainer.do_spectral_norm
-                )
-            # Second training part
-            # E(x) ==> z'
-            with tf.variable_scope("Encoder_G_Model"):
-                self.image_encoded = self.encoder_g(self.image_input)
-            # G(z') ==> G(E(x)) ==> x''
-            with tf.variable_scope("Generator_Model"):
-                self.image_gen_enc = self.generator(self.image_encoded)
-            # Discriminator outputs
-            with tf.variable_scope("Discriminator_Model"):
-                self.embedding_enc_fake, self.decoded_enc_fake = self.discriminator(
-                    self.image_gen_enc, do_spectral_norm=self.config.trainer.do_spectral_norm
-                )
-                self.embedding_enc_real, self.decoded_enc_real = self.discriminator(
-                    self.image_input, do_spectral_norm=self.config.trainer.do_spectral_norm
-                )
-            with tf.variable_scope("Discriminator_Model_XX"):
-                self.im_logit_real, self.im_f_real = self.discriminator_xx(
-                    self.image_input,
-                    self.image_input,
-                    do_spectral_norm=self.config.trainer.do_spectral_norm,
-                )
-                self.im_logit_fake, self.im_f_fake = self.discriminator_xx(
-                    self.image_input,
-                    self.image_gen_enc,
-                    do_spectral_norm=self.config.trainer.do_spectral_norm,
-                )
-            # Third training part
-            with tf.variable_scope("Encoder_G_Model"):
-                self.image_encoded_r = self.encoder_g(self.image_input)
-
-            with tf.variable_scope("Generator_Model"):
-                self.image_gen_enc_r = self.generator(self.image_encoded_r)
-
-            with tf.variable_scope("Encoder_R_Model"):
-                self.image_ege = self.encoder_r(self.image_gen_enc_r)
-
-            with tf.variable_scope("Discriminator_Model_ZZ"):
-                self.z_logit_real, self.z_f_real = self.discriminator_zz(
-                    self.image_encoded_r,
-                    self.image_encoded_r,
-                    do_spectral_norm=self.config.trainer.do_spectral_norm,
-                )
-                self.z_logit_fake, self.z_f_fake = self.discriminator_zz(
-                    self.image_encoded_r,
-                    self.image_ege,
-                    do_spectral_norm=self.config.trainer.do_spectral_norm,
-                )
-
-        ############################################################################################
-        # LOSS FUNCTIONS
-        ############################################################################################
-        with tf.name_scope("Loss_Functions"):
-            with tf.name_scope("Generator_Discriminator"):
-                # Discriminator Loss
-                if self.config.trainer.mse_mode == "norm":
-                    self.disc_loss_real = tf.reduce_mean(
-                        self.mse_loss(
-                            self.decoded_real,
-                            self.image_input,
-                            mode="norm",
-                            order=self.config.trainer.order,
-                        )
-                    )
-                    self.disc_loss_fake = tf.reduce_mean(
-                        self.mse_loss(
-                            self.decoded_fake,
-                            self.image_gen,
-                            mode="norm",
-                            order=self.config.trainer.order,
-                        )
-                    )
-                elif self.config.trainer.mse_mode == "mse":
-                    self.disc_loss_real = self.mse_loss(
-                        self.decoded_real,
-                        self.image_input,
-                        mode="mse",
-                        order=self.config.trainer.order,
-                    )
-                    self.disc_loss_fake = self.mse_loss(
-                        self.decoded_fake,
-                        self.image_gen,
-                        mode="mse",
-                        order=self.config.trainer.order,
-                    )
-                self.loss_discriminator = (
-                    tf.math.maximum(self.config.trainer.disc_margin - self.disc_loss_fake, 0)
-                    + self.disc_loss_real
-                )
-                # Generator Loss
-                pt_loss = 0
-                if self.config.trainer.pullaway:
-                    pt_loss = self.pullaway_loss(self.embedding_fake)
-                self.loss_generator = self.disc_loss_fake + self.config.trainer.pt_weight * pt_loss
-                # New addition to enforce visual similarity
-                delta_noise = self.embedding_real - self.embedding_fake
-                delta_flat = tf.layers.Flatten()(delta_noise)
-                loss_noise_gen = tf.reduce_mean(tf.norm(delta_flat, ord=2, axis=1, keepdims=False))
-                self.loss_generator += 0.1 * loss_noise_gen
-
-            with tf.name_scope("Encoder_G"):
-                if self.config.trainer.mse_mode == "norm":
-                    self.loss_enc_rec = tf.reduce_mean(
-                        self.mse_loss(
-                            self.image_gen_enc,
-                            self.image_input,
-                            mode="norm",
-                            order=self.config.trainer.order,
-                        )
-                    )
-                    self.loss_enc_f = tf.reduce_mean(
-                        self.mse_loss(
-                            self.decoded_enc_real,
-                            self.decoded_enc_fake,
-                            mode="norm",
-                            order=self.config.trainer.order,
-                        )
-                    )
-                elif self.config.trainer.mse_mode == "mse":
-                    self.loss_enc_rec = tf.reduce_mean(
-                        self.mse_loss(
-                            self.image_gen_enc,
-                            self.image_input,
-                            mode="mse",
-                            order=self.config.trainer.order,
-                        )
-                    )
-                    self.loss_enc_f = tf.reduce_mean(
-                        self.mse_loss(
-                            self.embedding_enc_real,
-                            self.embedding_enc_fake,
-                            mode="mse",
-                            order=self.config.trainer.order,
-                        )
-                    )
-                self.loss_encoder_g = (
-                    self.loss_enc_rec + self.config.trainer.encoder_f_factor * self.loss_enc_f
-                )
-                if self.config.trainer.enable_disc_xx:
-                    self.enc_xx_real = tf.nn.sigmoid_cross_entropy_with_logits(
-                        logits=self.im_logit_real, labels=tf.zeros_like(self.im_logit_real)
-                    )
-                    self.enc_xx_fake = tf.nn.sigmoid_cross_entropy_with_logits(
-                        logits=self.im_logit_fake, labels=tf.ones_like(self.im_logit_fake)
-                    )
-                    self.enc_loss_xx = tf.reduce_mean(self.enc_xx_real + self.enc_xx_fake)
-                    self.loss_encoder_g += self.enc_loss_xx
-
-            with tf.name_scope("Encoder_R"):
-                if self.config.trainer.mse_mode == "norm":
-                    self.loss_encoder_r = tf.reduce_mean(
-                        self.mse_loss(
-                            self.image_ege,
-                            self.image_encoded_r,
-                            mode="norm",
-                            order=self.config.trainer.order,
-                        )
-                    )
-
-                elif self.config.trainer.mse_mode == "mse":
-                    self.loss_encoder_r = tf.reduce_mean(
-                        self.mse_loss(
-                            self.image_ege,
-                            self.image_encoded_r,
-                            mode="mse",
-                            order=self.config.trainer.order,
-                        )
-                    )
-
-                if self.config.trainer.enable_disc_zz:
-                    self.enc_zz_real = tf.nn.sigmoid_cross_entropy_with_logits(
-                        logits=self.z_logit_real, labels=tf.zeros_like(self.z_logit_real)
-                    )
-                    self.enc_zz_fake = tf.nn.sigmoid_cross_entropy_with_logits(
-                        logits=self.z_logit_fake, labels=tf.ones_like(self.z_logit_fake)
-                    )
-                    self.enc_loss_zz = tf.reduce_mean(self.enc_zz_real + self.enc_zz_fake)
-                    self.loss_encoder_r += self.enc_loss_zz
-
-            if self.config.trainer.enable_disc_xx:
-                with tf.name_scope("Discriminator_XX"):
-                    self.loss_xx_real = tf.nn.sigmoid_cross_entropy_with_logits(
-                        logits=self.im_logit_real, labels=tf.ones_like(self.im_logit_real)
-                    )
-                    self.loss_xx_fake = tf.nn.sigmoid_cross_entropy_with_logits(
-                        logits=self.im_logit_fake, labels=tf.zeros_like(self.im_logit_fake)
-                    )
-                    self.dis_loss_xx = tf.reduce_mean(self.loss_xx_real + self.loss_xx_fake)
-            if self.config.trainer.enable_disc_zz:
-                with tf.name_scope("Discriminator_ZZ"):
-                    self.loss_zz_real = tf.nn.sigmoid_cross_entropy_with_logits(
-                        logits=self.z_logit_real, labels=tf.ones_like(self.z_logit_real)
-                    )
-                    self.loss_zz_fake = tf.nn.sigmoid_cross_entropy_with_logits(
-                        logits=self.z_logit_fake, labels=tf.zeros_like(self.z_logit_fake)
-                    )
-                    self.dis_loss_zz = tf.reduce_mean(self.loss_zz_real + self.loss_zz_fake)
+        # The three training parts, see train_losses. Data parallel training builds them on
+        # every shard of the batch, see build_replicas
+        if self.replicas > 1:
+            replicas = self.build_replicas(self.train_losses, [self.image_input, self.noise_tensor])
+            train = self.merge_replicas(replicas)
+        else:
+            train = self.train_losses(self.image_input, self.noise_tensor)
+        self.image_gen = train["image_gen"]
+        self.embedding_real, self.decoded_real = train["embedding_real"], train["decoded_real"]
+        self.embedding_fake, self.decoded_fake = train["embedding_fake"], train["decoded_fake"]
+        self.disc_loss_real = train["disc_loss_real"]
+        self.disc_loss_fake = train["disc_loss_fake"]
+        self.loss_discriminator = train["loss_discriminator"]
+        self.loss_generator = train["loss_generator"]
+        self.image_gen_enc = train["image_gen_enc"]
+        self.decoded_enc_real = train["decoded_enc_real"]
+        self.decoded_enc_fake = train["decoded_enc_fake"]
+        self.loss_encoder_g = train["loss_encoder_g"]
+        self.loss_encoder_r = train["loss_encoder_r"]
+        if self.config.trainer.enable_disc_xx:
+            self.dis_loss_xx = train["dis_loss_xx"]
+        if self.config.trainer.enable_disc_zz:
+            self.dis_loss_zz = train["dis_loss_zz"]
 
         ############################################################################################
         # OPTIMIZERS
@@ -317,38 +129,88 @@ class SENCEBGAN(BaseModel):
             self.update_ops_dis_zz = tf.get_collection(
                 tf.GraphKeys.UPDATE_OPS, scope="SENCEBGAN/Discriminator_Model_ZZ"
             )
-            with tf.control_dependencies(self.gen_update_ops):
-                self.gen_op = self.generator_optimizer.minimize(
-                    self.loss_generator,
-                    var_list=self.generator_vars,
-                    global_step=self.global_step_tensor,
+            # Data parallel updates, see replicated_update
+            if self.replicas > 1:
+                self.disc_op = self.replicated_update(
+                    self.discriminator_optimizer,
+                    replicas,
+                    "loss_discriminator",
+                    self.discriminator_vars,
+                    "SENCEBGAN/Discriminator_Model",
                 )
-            with tf.control_dependencies(self.disc_update_ops):
-                self.disc_op = self.discriminator_optimizer.minimize(
-                    self.loss_discriminator, var_list=self.discriminator_vars
+                self.gen_op = self.replicated_update(
+                    self.generator_optimizer,
+                    replicas,
+                    "loss_generator",
+                    self.generator_vars,
+                    "SENCEBGAN/Generator_Model",
+                    global_step=True,
                 )
-            with tf.control_dependencies(self.encg_update_ops):
-                self.encg_op = self.encoder_g_optimizer.minimize(
-                    self.loss_encoder_g,
-                    var_list=self.encoder_g_vars,
-                    global_step=self.global_step_tensor,
+                self.encg_op = self.replicated_update(
+                    self.encoder_g_optimizer,
+                    replicas,
+                    "loss_encoder_g",
+                    self.encoder_g_vars,
+                    "SENCEBGAN/Encoder_G_Model",
+                    global_step=True,
                 )
-            with tf.control_dependencies(self.encr_update_ops):
-                self.encr_op = self.encoder_r_optimizer.minimize(
-                    self.loss_encoder_r,
-                    var_list=self.encoder_r_vars,
-                    global_step=self.global_step_tensor,
+                self.encr_op = self.replicated_update(
+                    self.encoder_r_optimizer,
+                    replicas,
+                    "loss_encoder_r",
+                    self.encoder_r_vars,
+                    "SENCEBGAN/Encoder_R_Model",
+                    global_step=True,
                 )
-            if self.config.trainer.enable_disc_xx:
-                with tf.control_dependencies(self.update_ops_dis_xx):
-                    self.disc_op_xx = self.discriminator_optimizer.minimize(
-                        self.dis_loss_xx, var_list=self.dxxvars
+                if self.config.trainer.enable_disc_xx:
+                    self.disc_op_xx = self.replicated_update(
+                        self.discriminator_optimizer,
+                        replicas,
+                        "dis_loss_xx",
+                        self.dxxvars,
+                        "SENCEBGAN/Discriminator_Model_XX",
                     )
-            if self.config.trainer.enable_disc_zz:
-                with tf.control_dependencies(self.update_ops_dis_zz):
-                    self.disc_op_zz = self.discriminator_optimizer.minimize(
-                        self.dis_loss_zz, var_list=self.dzzvars
+                if self.config.trainer.enable_disc_zz:
+                    self.disc_op_zz = self.replicated_update(
+                        self.discriminator_optimizer,
+                        replicas,
+                        "dis_loss_zz",
+                        self.dzzvars,
+                        "SENCEBGAN/Discriminator_Model_ZZ",
+                    )
+            else:
+                with tf.control_dependencies(self.gen_update_ops):
+                    self.gen_op = self.generator_optimizer.minimize(
+                        self.loss_generator,
+                        var_list=self.generator_vars,
+                        global_step=self.global_step_tensor,
+                    )
+                with tf.control_dependencies(self.disc_update_ops):
+                    self.disc_op = self.discriminator_optimizer.minimize(
+                        self.loss_discriminator, var_list=self.discriminator_vars
                     )
+                with tf.control_dependencies(self.encg_update_ops):
+                    self.encg_op = self.encoder_g_optimizer.minimize(
+                        self.loss_encoder_g,
+                        var_list=self.encoder_g_vars,
+                        global_step=self.global_step_tensor,
+                    )
+                with tf.control_dependencies(self.encr_update_ops):
+                    self.encr_op = self.encoder_r_optimizer.minimize(
+                        self.loss_encoder_r,
+                        var_list=self.encoder_r_vars,
+                        global_step=self.global_step_tensor,
+                    )
+                if self.config.trainer.enable_disc_xx:
+                    with tf.control_dependencies(self.update_ops_dis_xx):
+                        self.disc_op_xx = self.discriminator_optimizer.minimize(
+                            self.dis_loss_xx, var_list=self.dxxvars
+                        )
+                if self.config.trainer.enable_disc_zz:
+                    with tf.control_dependencies(self.update_ops_dis_zz):
+                        self.disc_op_zz = self.discriminator_optimizer.minimize(
+                            self.dis_loss_zz, var_list=self.dzzvars
+                        )
             # Exponential Moving Average for Estimation
             self.dis_ema = tf.train.ExponentialMovingAverage(decay=self.config.trainer.ema_decay)
             maintain_averages_op_dis = self.dis_ema.apply(self.discriminator_vars)
@@ -394,6 +256,13 @@ class SENCEBGAN(BaseModel):
                 with tf.control_dependencies([self.disc_op_zz]):
                     self.train_dis_op_zz = tf.group(maintain_averages_op_dis_zz)
 
+        # Whole GAN steps in one run, see train_step_gan of the trainers
+        self.fused_gan_losses = None
+        if self.config.trainer.fused_steps and self.data is not None:
+            self.fused_gan_losses = self.init_fused_train_op(
+                self.fused_gan_step, ["gen", "disc"], name="fused_gan"
+            )
+
         ############################################################################################
         # TESTING
         ############################################################################################
@@ -599,6 +468,287 @@ class SENCEBGAN(BaseModel):
             self.sum_op_im_test = tf.summary.merge_all("test")
             self.sum_op = tf.summary.merge([self.sum_op_dis, self.sum_op_gen])
 
+    def gan_losses(self, image, noise):
+        """
+        Forward pass of the generator and the discriminator of the first training part and
+        their losses, built for the train graph and for every update of the fused loop
+        Args:
+            image: batch of real images
+            noise: latent noise of the generated images
+        Returns:
+            dict of the tensors of the pass
+        """
+        with tf.variable_scope("SENCEBGAN"):
+            # G(z) ==> x'
+            with tf.variable_scope("Generator_Model"):
+                image_gen = self.generator(noise)
+            # Discriminator outputs
+            with tf.variable_scope("Discriminator_Model"):
+                embedding_real, decoded_real = self.discriminator(
+                    image, do_spectral_norm=self.config.trainer.do_spectral_norm
+                )
+                embedding_fake, decoded_fake = self.discriminator(
+                    image_gen, do_spectral_norm=self.config.trainer.do_spectral_norm
+                )
+        with tf.name_scope("Generator_Discriminator"):
+            # Discriminator Loss
+            if self.config.trainer.mse_mode == "norm":
+                disc_loss_real = tf.reduce_mean(
+                    self.mse_loss(
+                        decoded_real, image, mode="norm", order=self.config.trainer.order
+                    )
+                )
+                disc_loss_fake = tf.reduce_mean(
+                    self.mse_loss(
+                        decoded_fake, image_gen, mode="norm", order=self.config.trainer.order
+                    )
+                )
+            elif self.config.trainer.mse_mode == "mse":
+                disc_loss_real = self.mse_loss(
+                    decoded_real, image, mode="mse", order=self.config.trainer.order
+                )
+                disc_loss_fake = self.mse_loss(
+                    decoded_fake, image_gen, mode="mse", order=self.config.trainer.order
+                )
+            loss_discriminator = (
+                tf.math.maximum(self.config.trainer.disc_margin - disc_loss_fake, 0)
+                + disc_loss_real
+            )
+            # Generator Loss
+            pt_loss = 0
+            if self.config.trainer.pullaway:
+                pt_loss = self.pullaway_loss(embedding_fake)
+            loss_generator = disc_loss_fake + self.config.trainer.pt_weight * pt_loss
+            # New addition to enforce visual similarity
+            delta_noise = embedding_real - embedding_fake
+            delta_flat = tf.layers.Flatten()(delta_noise)
+            loss_noise_gen = tf.reduce_mean(tf.norm(delta_flat, ord=2, axis=1, keepdims=False))
+            loss_generator += 0.1 * loss_noise_gen
+        return {
+            "image_gen": image_gen,
+            "embedding_real": embedding_real,
+            "decoded_real": decoded_real,
+            "embedding_fake": embedding_fake,
+            "decoded_fake": decoded_fake,
+            "disc_loss_real": disc_loss_real,
+            "disc_loss_fake": disc_loss_fake,
+            "loss_discriminator": loss_discriminator,
+            "loss_generator": loss_generator,
+        }
+
+    def train_losses(self, image, noise):
+        """
+        Forward passes and losses of the three training parts, see gan_losses,
+        encoder_g_losses and encoder_r_losses
+        Returns:
+            dict of the tensors of the passes
+        """
+        train = self.gan_losses(image, noise)
+        train.update(self.encoder_g_losses(image))
+        train.update(self.encoder_r_losses(image))
+        return train
+
+    def encoder_g_losses(self, image):
+        """
+        Forward pass of the second training part, the encoder of the generator and its
+        regularizer discriminator, and their losses
+        Args:
+            image: batch of real images
+        Returns:
+            dict of the tensors of the pass
+        """
+        with tf.variable_scope("SENCEBGAN"):
+            # E(x) ==> z'
+            with tf.variable_scope("Encoder_G_Model"):
+                image_encoded = self.encoder_g(image)
+            # G(z') ==> G(E(x)) ==> x''
+            with tf.variable_scope("Generator_Model"):
+                image_gen_enc = self.generator(image_encoded)
+            # Discriminator outputs
+            with tf.variable_scope("Discriminator_Model"):
+                embedding_enc_fake, decoded_enc_fake = self.discriminator(
+                    image_gen_enc, do_spectral_norm=self.config.trainer.do_spectral_norm
+                )
+                embedding_enc_real, decoded_enc_real = self.discriminator(
+                    image, do_spectral_norm=self.config.trainer.do_spectral_norm
+                )
+            with tf.variable_scope("Discriminator_Model_XX"):
+                im_logit_real, _ = self.discriminator_xx(
+                    image, image, do_spectral_norm=self.config.trainer.do_spectral_norm
+                )
+                im_logit_fake, _ = self.discriminator_xx(
+                    image, image_gen_enc, do_spectral_norm=self.config.trainer.do_spectral_norm
+                )
+        encoder_g = {
+            "image_gen_enc": image_gen_enc,
+            "decoded_enc_real": decoded_enc_real,
+            "decoded_enc_fake": decoded_enc_fake,
+        }
+        with tf.name_scope("Loss_Functions"):
+            with tf.name_scope("Encoder_G"):
+                if self.config.trainer.mse_mode == "norm":
+                    loss_enc_rec = tf.reduce_mean(
+                        self.mse_loss(
+                            image_gen_enc, image, mode="norm", order=self.config.trainer.order
+                        )
+                    )
+                    loss_enc_f = tf.reduce_mean(
+                        self.mse_loss(
+                            decoded_enc_real,
+                            decoded_enc_fake,
+                            mode="norm",
+                            order=self.config.trainer.order,
+                        )
+                    )
+                elif self.config.trainer.mse_mode == "mse":
+                    loss_enc_rec = tf.reduce_mean(
+                        self.mse_loss(
+                            image_gen_enc, image, mode="mse", order=self.config.trainer.order
+                        )
+                    )
+                    loss_enc_f = tf.reduce_mean(
+                        self.mse_loss(
+                            embedding_enc_real,
+                            embedding_enc_fake,
+                            mode="mse",
+                            order=self.config.trainer.order,
+                        )
+                    )
+                loss_encoder_g = loss_enc_rec + self.config.trainer.encoder_f_factor * loss_enc_f
+                if self.config.trainer.enable_disc_xx:
+                    enc_xx_real = tf.nn.sigmoid_cross_entropy_with_logits(
+                        logits=im_logit_real, labels=tf.zeros_like(im_logit_real)
+                    )
+                    enc_xx_fake = tf.nn.sigmoid_cross_entropy_with_logits(
+                        logits=im_logit_fake, labels=tf.ones_like(im_logit_fake)
+                    )
+                    loss_encoder_g += tf.reduce_mean(enc_xx_real + enc_xx_fake)
+            encoder_g["loss_encoder_g"] = loss_encoder_g
+            if self.config.trainer.enable_disc_xx:
+                with tf.name_scope("Discriminator_XX"):
+                    loss_xx_real = tf.nn.sigmoid_cross_entropy_with_logits(
+                        logits=im_logit_real, labels=tf.ones_like(im_logit_real)
+                    )
+                    loss_xx_fake = tf.nn.sigmoid_cross_entropy_with_logits(
+                        logits=im_logit_fake, labels=tf.zeros_like(im_logit_fake)
+                    )
+                    encoder_g["dis_loss_xx"] = tf.reduce_mean(loss_xx_real + loss_xx_fake)
+        return encoder_g
+
+    def encoder_r_losses(self, image):
+        """
+        Forward pass of the third training part, the encoder of the reconstructions and its
+        regularizer discriminator, and their losses
+        Args:
+            image: batch of real images
+        Returns:
+            dict of the tensors of the pass
+        """
+        with tf.variable_scope("SENCEBGAN"):
+            with tf.variable_scope("Encoder_G_Model"):
+                image_encoded_r = self.encoder_g(image)
+
+            with tf.variable_scope("Generator_Model"):
+                image_gen_enc_r = self.generator(image_encoded_r)
+
+            with tf.variable_scope("Encoder_R_Model"):
+                image_ege = self.encoder_r(image_gen_enc_r)
+
+            with tf.variable_scope("Discriminator_Model_ZZ"):
+                z_logit_real, _ = self.discriminator_zz(
+                    image_encoded_r,
+                    image_encoded_r,
+                    do_spectral_norm=self.config.trainer.do_spectral_norm,
+                )
+                z_logit_fake, _ = self.discriminator_zz(
+                    image_encoded_r,
+                    image_ege,
+                    do_spectral_norm=self.config.trainer.do_spectral_norm,
+                )
+        encoder_r = {}
+        with tf.name_scope("Loss_Functions"):
+            with tf.name_scope("Encoder_R"):
+                if self.config.trainer.mse_mode == "norm":
+                    loss_encoder_r = tf.reduce_mean(
+                        self.mse_loss(
+                            image_ege, image_encoded_r, mode="norm", order=self.config.trainer.order
+                        )
+                    )
+                elif self.config.trainer.mse_mode == "mse":
+                    loss_encoder_r = tf.reduce_mean(
+                        self.mse_loss(
+                            image_ege, image_encoded_r, mode="mse", order=self.config.trainer.order
+                        )
+                    )
+                if self.config.trainer.enable_disc_zz:
+                    enc_zz_real = tf.nn.sigmoid_cross_entropy_with_logits(
+                        logits=z_logit_real, labels=tf.zeros_like(z_logit_real)
+                    )
+                    enc_zz_fake = tf.nn.sigmoid_cross_entropy_with_logits(
+                        logits=z_logit_fake, labels=tf.ones_like(z_logit_fake)
+                    )
+                    loss_encoder_r += tf.reduce_mean(enc_zz_real + enc_zz_fake)
+            encoder_r["loss_encoder_r"] = loss_encoder_r
+            if self.config.trainer.enable_disc_zz:
+                with tf.name_scope("Discriminator_ZZ"):
+                    loss_zz_real = tf.nn.sigmoid_cross_entropy_with_logits(
+                        logits=z_logit_real, labels=tf.ones_like(z_logit_real)
+                    )
+                    loss_zz_fake = tf.nn.sigmoid_cross_entropy_with_logits(
+                        logits=z_logit_fake, labels=tf.zeros_like(z_logit_fake)
+                    )
+                    encoder_r["dis_loss_zz"] = tf.reduce_mean(loss_zz_real + loss_zz_fake)
+        return encoder_r
+
+    def fused_gan_step(self):
+        """
+        One step of train_step_gan inside the fused loop. The critic updates share one batch
+        and every generator update takes a new one, each update is built on the variables
+        left by the previous one.
+        Returns:
+            mean generator loss, mean discriminator loss of the step
+        """
+        if self.config.trainer.mode == "standard":
+            disc_iters, gen_iters = 1, 1
+        else:
+            disc_iters, gen_iters = self.config.trainer.critic_iters, 3
+        disc_losses, gen_losses = [], []
+        done = []
+        image = None
+        for _ in range(disc_iters):
+            with tf.control_dependencies(done):
+                if image is None:
+                    image = self.data.next_batch()
+                mark = self.update_ops_mark()
+                gan = self.gan_losses(image, self.draw_noise(tf.shape(image)[0]))
+                done = [
+                    self.loop_update(
+                        self.discriminator_optimizer,
+                        gan["loss_discriminator"],
+                        self.discriminator_vars,
+                        self.loop_update_ops(mark, "Discriminator_Model"),
+                        ema=self.dis_ema,
+                    )
+                ]
+            disc_losses += done
+        for _ in range(gen_iters):
+            with tf.control_dependencies(done):
+                image = self.data.next_batch()
+                mark = self.update_ops_mark()
+                gan = self.gan_losses(image, self.draw_noise(tf.shape(image)[0]))
+                done = [
+                    self.loop_update(
+                        self.generator_optimizer,
+                        gan["loss_generator"],
+                        self.generator_vars,
+                        self.loop_update_ops(mark, "Generator_Model"),
+                        ema=self.gen_ema,
+                        global_step=True,
+                    )
+                ]
+            gen_losses += done
+        return tf.reduce_mean(gen_losses), tf.reduce_mean(disc_losses)
+
     ###############################################################################################
     # MODULES
     ###############################################################################################
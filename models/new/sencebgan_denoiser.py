@@ -6,8 +6,8 @@ import utils.alad_utils as sn
 
 
 class SENCEBGAN_Denoiser(BaseModel):
-    def __init__(self, config):
-        super(SENCEBGAN_Denoiser, self).__init__(config)
+    def __init__(self, config, data=None):
+        super(SENCEBGAN_Denoiser, self).__init__(config, data)
         self.build_model()
         self.init_saver()
 
@@ -27,14 +27,16 @@ class SENCEBGAN_Denoiser(BaseModel):
         self.is_training_dis = tf.placeholder(tf.bool)
         self.is_training_enc_g = tf.placeholder(tf.bool)
         self.is_training_enc_r = tf.placeholder(tf.bool)
-        self.image_input = tf.placeholder(
-            tf.float32, shape=[None] + self.config.trainer.image_dims, name="x"
-        )
-        self.noise_tensor = tf.placeholder(
-            tf.float32, shape=[None, self.config.trainer.noise_dim], name="noise"
-        )
-        self.denoiser_noise = tf.placeholder(
-            tf.float32, shape=[None] + self.config.trainer.image_dims, name="noise"
+        self.image_input = self.init_image_input([None] + self.config.trainer.image_dims, name="x")
+        # Random inputs are drawn in the graph, with the batch size of the image input
+        batch_size = tf.shape(self.image_input)[0]
+        self.noise_tensor = self.init_noise_input(batch_size)
+        self.denoiser_noise = tf.placeholder_with_default(
+            tf.random.normal(
+                tf.stack([batch_size] + self.config.trainer.image_dims), seed=self.op_seed()
+            ),
+            [None] + self.config.trainer.image_dims,
+            name="denoiser_noise",
         )
         ############################################################################################
         # MODEL
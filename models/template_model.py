@@ -3,8 +3,8 @@ import tensorflow as tf
 
 
 class TemplateModel(BaseModel):
-    def __init__(self, config):
-        super(TemplateModel, self).__init__(config)
+    def __init__(self, config, data=None):
+        super(TemplateModel, self).__init__(config, data)
 
         self.build_model()
         self.init_saver()
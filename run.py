@@ -6,6 +6,7 @@ from utils.factory import create
 from utils.dirs import create_dirs
 from utils.logger import Logger
 from utils.copy_codebase_new import copy_codebase
+from utils.session import session_config
 import os
 
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
@@ -38,17 +39,17 @@ def run():
     # Set the random seed
     tf.random.set_random_seed(config.data_loader.random_seed)
     # Create the tensorflow session
-    sess = tf.Session()
+    sess = tf.Session(config=session_config(config))
     # Create the dataloader
     data = create("data_loader." + config.data_loader.name)(config)
     # Create the model instance
-    model = create("models.new." + config.model.name)(config)
+    model = create("models.new." + config.model.name)(config, data)
     # Create the summarizer Object
     summarizer = create("utils." + config.log.name)(sess, config)
     # Create the trainer
     trainer = create("trainers." + config.trainer.name)(sess, model, data, config, summarizer)
-    # Load model if exists
-    model.load(sess)
+    # Load model if exists, the checkpoint of a single phase when restore_phase is set
+    model.load(sess, config.log.restore_phase)
     # Train the model
     if args.train:
         trainer.train()
@@ -59,7 +59,7 @@ def run(config,args):
     # Create the dataloader
     data = create("data_loader." + config.data_loader.name)(config)
     # Create the model instance
-    model = create("models.32." + config.model.name)(config)
+    model = create("models.32." + config.model.name)(config, data)
     # Create the summarizer Object
     summarizer = create("utils." + config.log.name)(sess, config)
     # Create the trainer
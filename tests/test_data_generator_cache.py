@@ -0,0 +1,73 @@
+import logging
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+DotMap = pytest.importorskip("dotmap").DotMap
+pytest.importorskip("natsort")
+
+from data_loader.data_generator import DataGenerator
+from utils.DataLoader import DataLoader
+
+
+class SplitInputs:
+    """
+    Stands for the DataLoader of a split whose inputs never change
+    """
+
+    cache_key = DataLoader.cache_key
+
+    def split_inputs(self, split):
+        return ["source.zip"], {"image_size": 4}
+
+    def split_size(self, split):
+        return 3
+
+
+def generator(cache, uint8_pipeline):
+    # Only the attributes used by _cache, the rest of the pipeline is not built
+    data = DataGenerator.__new__(DataGenerator)
+    data.config = DotMap({"data_loader": {"cache": str(cache)}})
+    data.logger = logging.getLogger(__name__)
+    data.use_uint8 = uint8_pipeline
+    return data
+
+
+def parsed_dataset(patches, uint8_pipeline):
+    # Same outputs as the parse functions: raw uint8 patches, or float32 ones
+    dataset = tf.data.Dataset.from_tensor_slices(patches)
+    if uint8_pipeline:
+        return dataset
+    return dataset.map(lambda x: tf.cast(x, tf.float32) / 255.0)
+
+
+def read_all(dataset):
+    next_element = dataset.make_one_shot_iterator().get_next()
+    values = []
+    with tf.Session() as sess:
+        try:
+            while True:
+                values.append(sess.run(next_element))
+        except tf.errors.OutOfRangeError:
+            return np.stack(values)
+
+
+def test_switching_the_uint8_pipeline_starts_a_new_folder_cache(tmp_path):
+    patches = np.arange(3 * 4 * 4, dtype=np.uint8).reshape(3, 4, 4, 1)
+    split_inputs = SplitInputs()
+    results = {}
+    # Float32 first, then the uint8 pipeline and back over the same cache folder
+    for uint8_pipeline in [False, True, False]:
+        with tf.Graph().as_default():
+            data = generator(tmp_path, uint8_pipeline)
+            dataset = data._cache(parsed_dataset(patches, uint8_pipeline), split_inputs, "train")
+            results.setdefault(uint8_pipeline, []).append(read_all(dataset))
+    assert results[True][0].dtype == np.uint8
+    np.testing.assert_array_equal(results[True][0], patches)
+    for values in results[False]:
+        assert values.dtype == np.float32
+        np.testing.assert_allclose(values, patches / 255.0, rtol=1e-6)
+    # One cache per content, the float32 one is reused when switching back
+    prefixes = {path.name.split(".")[0] for path in tmp_path.iterdir()}
+    assert len(prefixes) == 2
@@ -1,7 +1,6 @@
 from base.base_train import BaseTrain
-from tqdm import tqdm
+import tensorflow as tf
 import numpy as np
-from time import sleep
 from time import time
 from utils.evaluations import save_results
 
@@ -15,12 +14,16 @@ class ALAD_Trainer(BaseTrain):
         self.img_dims = self.config.trainer.image_dims
         # Inititalize the train Dataset Iterator
         self.sess.run(self.data.iterator.initializer)
-        # Initialize the test Dataset Iterator
-        self.sess.run(self.data.test_iterator.initializer)
         if self.config.data_loader.validation:
             self.sess.run(self.data.valid_iterator.initializer)
             self.best_valid_loss = 0
             self.nb_without_improvements = 0
+        # With fused_steps the fused train op of the model runs that many steps per sess.run
+        self.fused_runs = None
+        if self.config.trainer.fused_steps:
+            self.fused_runs = max(
+                self.config.data_loader.num_iter_per_epoch // self.config.trainer.fused_steps, 1
+            )
 
     def train_epoch(self):
         """
@@ -31,58 +34,38 @@ class ALAD_Trainer(BaseTrain):
         # Attach the epoch loop to a variable
         begin = time()
         # Make the loop of the epoch iterations
-        loop = tqdm(range(self.config.data_loader.num_iter_per_epoch))
-        # Define Losses
-        gen_losses = []
-        enc_losses = []
-        disc_losses = []
-        disc_xz_losses = []
-        disc_xx_losses = []
-        disc_zz_losses = []
-        summaries = []
         # Get the current epoch counter
         cur_epoch = self.model.cur_epoch_tensor.eval(self.sess)
-        image = self.data.image
-        for _ in loop:
-            loop.set_description("Epoch:{}".format(cur_epoch + 1))
-            loop.refresh()  # to show immediately the update
-            sleep(0.01)
+
+        def step():
             # Compute the main losses
-            lg, le, ld, ldxz, ldxx, ldzz, summary = self.train_step(image, cur_epoch)
-            gen_losses.append(lg)
-            enc_losses.append(le)
-            disc_losses.append(ld)
-            disc_xz_losses.append(ldxz)
-            disc_xx_losses.append(ldxx)
-            disc_zz_losses.append(ldzz)
-            summaries.append(summary)
+            lg, le, ld, ldxz, ldxx, ldzz, summary = self.train_step(cur_epoch)
+            self.summarizer.write(summary)
+            return {
+                "gen": lg,
+                "enc": le,
+                "disc": ld,
+                "disc_xz": ldxz,
+                "disc_xx": ldxx,
+                "disc_zz": ldzz,
+            }
+
+        losses = self.run_steps(step, "Epoch:{}".format(cur_epoch + 1), self.fused_runs)
         self.logger.info("Epoch {} terminated".format(cur_epoch))
-        self.summarizer.add_tensorboard(step=cur_epoch, summaries=summaries)
         # Check for reconstruction
         if cur_epoch % self.config.log.frequency_test == 0:
-            noise = np.random.normal(
-                loc=0.0, scale=1.0, size=[self.config.data_loader.batch_size, self.noise_dim]
-            )
-            real_noise, fake_noise = self.generate_noise(
-                self.config.trainer.include_noise, cur_epoch
-            )
-            image_eval = self.sess.run(image)
             feed_dict = {
-                self.model.image_tensor: image_eval,
-                self.model.noise_tensor: noise,
-                self.model.real_noise: real_noise,
-                self.model.fake_noise: fake_noise,
                 self.model.is_training: False,
             }
             reconstruction = self.sess.run(self.model.sum_op_im, feed_dict=feed_dict)
             self.summarizer.add_tensorboard(step=cur_epoch, summaries=[reconstruction])
         # Get the means of the loss values to display
-        gl_m = np.mean(gen_losses)
-        el_m = np.mean(enc_losses)
-        dl_m = np.mean(disc_losses)
-        dlxz_m = np.mean(disc_xz_losses)
-        dlxx_m = np.mean(disc_xx_losses)
-        dlzz_m = np.mean(disc_zz_losses)
+        gl_m = losses["gen"]
+        el_m = losses["enc"]
+        dl_m = losses["disc"]
+        dlxz_m = losses["disc_xz"]
+        dlxx_m = losses["disc_xx"]
+        dlzz_m = losses["disc_zz"]
         if self.config.trainer.allow_zz:
             self.logger.info(
                 "Epoch {} | time = {} | loss gen = {:4f} | loss enc = {:4f} | "
@@ -105,12 +88,8 @@ class ALAD_Trainer(BaseTrain):
         ) % self.config.trainer.frequency_eval == 0 and self.config.trainer.enable_early_stop:
             valid_loss = 0
             image_valid = self.sess.run(self.data.valid_image)
-            noise = np.random.normal(
-                loc=0.0, scale=1.0, size=[image_valid.shape[0], self.noise_dim]
-            )
             feed_dict = {
                 self.model.image_tensor: image_valid,
-                self.model.noise_tensor: noise,
                 self.model.is_training: False,
             }
             vl, lat = self.sess.run(
@@ -130,8 +109,8 @@ class ALAD_Trainer(BaseTrain):
                 self.logger.info(
                     "Best model - valid loss = {:.4f} - saving...".format(self.best_valid_loss)
                 )
-                # Save the model state
-                self.model.save(self.sess)
+                # Keep the weights of the best model apart from the periodic checkpoints
+                self.model.save_best(self.sess, self.best_valid_loss)
                 self.nb_without_improvements = 0
             else:
                 self.nb_without_improvements += self.config.trainer.frequency_eval
@@ -143,26 +122,30 @@ class ALAD_Trainer(BaseTrain):
                     )
                 )
 
-    def train_step(self, image, cur_epoch):
+    def train_step(self, cur_epoch):
         """
        implement the logic of the train step
        - run the tensorflow session
        - return any metrics you need to summarize
        """
-        noise = np.random.normal(loc=0.0, scale=1.0, size=[self.batch_size, self.noise_dim])
-        true_labels, generated_labels = self.generate_labels(
-            self.config.trainer.soft_labels, self.config.trainer.flip_labels
-        )
+        if self.fused_runs:
+            # The updates below run fused_steps times in the graph, without summaries
+            feed_dict = {
+                self.model.is_training: True,
+            }
+            losses = self.sess.run(self.model.fused_losses, feed_dict=feed_dict)
+            return (
+                losses["gen"],
+                losses["enc"],
+                losses["disc"],
+                losses["disc_xz"],
+                losses["disc_xx"],
+                losses["disc_zz"],
+                None,
+            )
         # Train the discriminator
-        real_noise, fake_noise = self.generate_noise(self.config.trainer.include_noise, cur_epoch)
-        image_eval = self.sess.run(image)
+        # The discriminators are trained on the next batch of the iterator
         feed_dict = {
-            self.model.image_tensor: image_eval,
-            self.model.noise_tensor: noise,
-            self.model.generated_labels: generated_labels,
-            self.model.true_labels: true_labels,
-            self.model.real_noise: real_noise,
-            self.model.fake_noise: fake_noise,
             self.model.is_training: True,
         }
         _, _, _, ld, ldxz, ldxx, ldzz = self.sess.run(
@@ -177,36 +160,23 @@ class ALAD_Trainer(BaseTrain):
             ],
             feed_dict=feed_dict,
         )
-        # Train the Generator and Encoder
-        noise = np.random.normal(loc=0.0, scale=1.0, size=[self.batch_size, self.noise_dim])
-        true_labels, generated_labels = self.generate_labels(
-            self.config.trainer.soft_labels, self.config.trainer.flip_labels
-        )
-        real_noise, fake_noise = self.generate_noise(self.config.trainer.include_noise, cur_epoch)
+        # Train the Generator and Encoder on the same batch
         feed_dict = {
-            self.model.image_tensor: image_eval,
-            self.model.noise_tensor: noise,
-            self.model.generated_labels: generated_labels,
-            self.model.true_labels: true_labels,
-            self.model.real_noise: real_noise,
-            self.model.fake_noise: fake_noise,
+            self.model.reuse_batch: True,
             self.model.is_training: True,
         }
-        _, _, le, lg = self.sess.run(
+        sum_op = self.model.sum_op if self.config.log.enable_summary else None
+        _, _, le, lg, sm = self.sess.run(
             [
                 self.model.train_gen_op,
                 self.model.train_enc_op,
                 self.model.loss_encoder,
                 self.model.loss_generator,
+                self.summary_fetch(sum_op),
             ],
             feed_dict=feed_dict,
         )
 
-        if self.config.log.enable_summary:
-            sm = self.sess.run(self.model.sum_op, feed_dict=feed_dict)
-        else:
-            sm = None
-
         return lg, le, ld, ldxz, ldxx, ldzz, sm
 
     def test_epoch(self):
@@ -220,28 +190,36 @@ class ALAD_Trainer(BaseTrain):
         true_labels = []
         summaries = []
         # Create the scores
-        test_loop = tqdm(range(self.config.data_loader.num_iter_per_test))
+        test_loop = self.test_loop()
         cur_epoch = self.model.cur_epoch_tensor.eval(self.sess)
         for _ in test_loop:
             test_batch_begin = time()
-            test_batch, test_labels = self.sess.run([self.data.test_image, self.data.test_label])
-            test_loop.refresh()  # to show immediately the update
-            sleep(0.01)
-            noise = np.random.normal(
-                loc=0.0, scale=1.0, size=[self.config.data_loader.test_batch, self.noise_dim]
-            )
             feed_dict = {
-                self.model.image_tensor: test_batch,
-                self.model.noise_tensor: noise,
+                self.model.input_from_test: True,
                 self.model.is_training: False,
             }
-            scores_ch += self.sess.run(self.model.score_ch, feed_dict=feed_dict).tolist()
-            scores_l1 += self.sess.run(self.model.score_l1, feed_dict=feed_dict).tolist()
-            scores_l2 += self.sess.run(self.model.score_l2, feed_dict=feed_dict).tolist()
-            scores_fm += self.sess.run(self.model.score_fm, feed_dict=feed_dict).tolist()
-            summaries += self.sess.run([self.model.sum_op_im_test], feed_dict=feed_dict)
+            try:
+                score_ch, score_l1, score_l2, score_fm, sm, test_labels = self.run_test(
+                    [
+                        self.model.score_ch,
+                        self.model.score_l1,
+                        self.model.score_l2,
+                        self.model.score_fm,
+                        self.model.sum_op_im_test,
+                        self.model.input_label,
+                    ],
+                    feed_dict,
+                )
+            except tf.errors.OutOfRangeError:
+                break
+            scores_ch += score_ch.tolist()
+            scores_l1 += score_l1.tolist()
+            scores_l2 += score_l2.tolist()
+            scores_fm += score_fm.tolist()
+            summaries.append(sm)
             inference_time.append(time() - test_batch_begin)
             true_labels += test_labels.tolist()
+        test_loop.close()
         scores_ch = np.asarray(scores_ch)
         scores_l1 = np.asarray(scores_l1)
         scores_l2 = np.asarray(scores_l2)
@@ -314,52 +292,3 @@ class ALAD_Trainer(BaseTrain):
             step,
             percentile=percentiles,
         )
-
-    def generate_labels(self, soft_labels, flip_labels):
-
-        if not soft_labels:
-            true_labels = np.ones((self.config.data_loader.batch_size, 1))
-            generated_labels = np.zeros((self.config.data_loader.batch_size, 1))
-        else:
-            generated_labels = np.zeros(
-                (self.config.data_loader.batch_size, 1)
-            ) + np.random.uniform(low=0.0, high=0.1, size=[self.config.data_loader.batch_size, 1])
-            flipped_idx = np.random.choice(
-                np.arange(len(generated_labels)),
-                size=int(self.config.trainer.noise_probability * len(generated_labels)),
-            )
-            generated_labels[flipped_idx] = 1 - generated_labels[flipped_idx]
-            true_labels = np.ones((self.config.data_loader.batch_size, 1)) - np.random.uniform(
-                low=0.0, high=0.1, size=[self.config.data_loader.batch_size, 1]
-            )
-            flipped_idx = np.random.choice(
-                np.arange(len(true_labels)),
-                size=int(self.config.trainer.noise_probability * len(true_labels)),
-            )
-            true_labels[flipped_idx] = 1 - true_labels[flipped_idx]
-        if flip_labels:
-            return generated_labels, true_labels
-        else:
-            return true_labels, generated_labels
-
-    def generate_noise(self, include_noise, cur_epoch):
-        sigma = max(0.75 * (10.0 - cur_epoch) / (10), 0.05)
-        if include_noise:
-            # If we want to add this is will add the noises
-            real_noise = np.random.normal(
-                scale=sigma,
-                size=[self.config.data_loader.batch_size] + self.config.trainer.image_dims,
-            )
-            fake_noise = np.random.normal(
-                scale=sigma,
-                size=[self.config.data_loader.batch_size] + self.config.trainer.image_dims,
-            )
-        else:
-            # Otherwise we are just going to add zeros which will not break anything
-            real_noise = np.zeros(
-                ([self.config.data_loader.batch_size] + self.config.trainer.image_dims)
-            )
-            fake_noise = np.zeros(
-                ([self.config.data_loader.batch_size] + self.config.trainer.image_dims)
-            )
-        return real_noise, fake_noise
@@ -1,7 +1,6 @@
 from base.base_train import BaseTrain
-from tqdm import tqdm
+import tensorflow as tf
 import numpy as np
-from time import sleep
 from time import time
 from utils.evaluations import save_results
 
@@ -14,8 +13,6 @@ class ANOGAN_Trainer(BaseTrain):
         self.img_dims = self.config.trainer.image_dims
         # Inititalize the train Dataset Iterator
         self.sess.run(self.data.iterator.initializer)
-        # Initialize the test Dataset Iterator
-        self.sess.run(self.data.test_iterator.initializer)
         if self.config.data_loader.validation:
             self.sess.run(self.data.valid_iterator.initializer)
             self.best_valid_loss = 0
@@ -25,35 +22,26 @@ class ANOGAN_Trainer(BaseTrain):
         # Attach the epoch loop to a variable
         begin = time()
         # Make the loop of the epoch iterations
-        loop = tqdm(range(self.config.data_loader.num_iter_per_epoch))
-        # Define Losses
-        gen_losses = []
-        disc_losses = []
-        summaries = []
-        image = self.data.image
         cur_epoch = self.model.cur_epoch_tensor.eval(self.sess)
-        for _ in loop:
-            loop.set_description("Epoch:{}".format(cur_epoch + 1))
-            loop.refresh()  # to show immediately the update
-            sleep(0.01)
-            ld, lg, sm = self.train_step(image, cur_epoch)
-            gen_losses.append(lg)
-            disc_losses.append(ld)
-            summaries.append(sm)
+
+        def step():
+            ld, lg, sm = self.train_step(cur_epoch)
+            self.summarizer.write(sm)
+            return {
+                "gen": lg,
+                "disc": ld,
+            }
+
+        losses = self.run_steps(step, "Epoch:{}".format(cur_epoch + 1))
         self.logger.info("Epoch {} terminated".format(cur_epoch))
-        gl_m = np.mean(gen_losses)
-        dl_m = np.mean(disc_losses)
-        self.summarizer.add_tensorboard(step=cur_epoch, summaries=summaries)
+        gl_m = losses["gen"]
+        dl_m = losses["disc"]
         # Check for reconstruction
         if cur_epoch % self.config.log.frequency_test == 0:
-            image_eval = self.sess.run(image)
             noise = np.random.normal(loc=0.0, scale=1.0, size=[self.batch_size, self.noise_dim])
-            real_noise, fake_noise = self.generate_noise(False, cur_epoch)
             feed_dict = {
-                self.model.image_input: image_eval,
                 self.model.noise_tensor: noise,
-                self.model.real_noise: real_noise,
-                self.model.fake_noise: fake_noise,
+                self.model.instance_noise: False,
                 self.model.is_training: False,
             }
             reconstruction = self.sess.run(self.model.sum_op_im, feed_dict=feed_dict)
@@ -96,8 +84,8 @@ class ANOGAN_Trainer(BaseTrain):
                 self.logger.info(
                     "Best model - valid loss = {:.4f} - saving...".format(self.best_valid_loss)
                 )
-                # Save the model state
-                self.model.save(self.sess)
+                # Keep the weights of the best model apart from the periodic checkpoints
+                self.model.save_best(self.sess, self.best_valid_loss)
                 self.nb_without_improvements = 0
             else:
                 self.nb_without_improvements += self.config.trainer.frequency_eval
@@ -117,22 +105,29 @@ class ANOGAN_Trainer(BaseTrain):
         true_labels = []
         summaries = []
         # Create the scores
-        test_loop = tqdm(range(self.config.data_loader.num_iter_per_test))
+        test_loop = self.test_loop()
         cur_epoch = self.model.cur_epoch_tensor.eval(self.sess)
         for _ in test_loop:
             begin_val_batch = time()
-            test_batch, test_labels = self.sess.run([self.data.test_image, self.data.test_label])
-            test_loop.refresh()  # to show immediately the update
-            sleep(0.01)
-            noise = np.random.normal(
-                loc=0.0, scale=1.0, size=[self.config.data_loader.test_batch, self.noise_dim]
-            )
             feed_dict = {
-                self.model.image_input: test_batch,
-                self.model.noise_tensor: noise,
+                self.model.input_from_test: True,
                 self.model.is_training: False,
             }
-            for _ in range(self.config.trainer.steps_number):
+            # The first inversion step takes the batch from the test iterator, the next ones
+            # are fed with the same batch
+            try:
+                _, feed_dict[self.model.image_input], test_labels, valid = self.sess.run(
+                    [
+                        self.model.invert_op,
+                        self.model.image_input,
+                        self.model.input_label,
+                        self.model.input_valid,
+                    ],
+                    feed_dict=feed_dict,
+                )
+            except tf.errors.OutOfRangeError:
+                break
+            for _ in range(self.config.trainer.steps_number - 1):
                 _ = self.sess.run(self.model.invert_op, feed_dict=feed_dict)
 
             brect_x, brec_error,brec_error2, bscores_1, bscores_2, blatent = self.sess.run(
@@ -146,16 +141,18 @@ class ANOGAN_Trainer(BaseTrain):
                 ],
                 feed_dict=feed_dict,
             )
-            rect_x.append(brect_x)
-            rec_error.append(brec_error)
-            rec_error2.append(brec_error2)
-            scores_1.append(bscores_1)
-            scores_2.append(bscores_2)
-            latent.append(blatent)
+            # The padded rows of the last batch are dropped
+            rect_x.append(self._valid_rows(brect_x, valid))
+            rec_error.append(self._valid_rows(brec_error, valid))
+            rec_error2.append(self._valid_rows(brec_error2, valid))
+            scores_1.append(self._valid_rows(bscores_1, valid))
+            scores_2.append(self._valid_rows(bscores_2, valid))
+            latent.append(self._valid_rows(blatent, valid))
             self.sess.run(self.model.reinit_test_graph_op)
             inference_time.append(time() - begin_val_batch)
-            true_labels += test_labels.tolist()
+            true_labels += test_labels[valid].tolist()
             summaries += self.sess.run([self.model.sum_op_im_test], feed_dict=feed_dict)
+        test_loop.close()
         true_labels = np.asarray(true_labels)
         inference_time = np.mean(inference_time)
         self.summarizer.add_tensorboard(step=cur_epoch, summaries=summaries, summarizer="test")
@@ -197,97 +194,24 @@ class ANOGAN_Trainer(BaseTrain):
             percentile=percentiles,
         )
 
-    def train_step(self, image, cur_epoch):
-        noise = np.random.normal(loc=0.0, scale=1.0, size=[self.batch_size, self.noise_dim])
-        true_labels, generated_labels = self.generate_labels(
-            self.config.trainer.soft_labels, self.config.trainer.flip_labels
-        )
-        real_noise, fake_noise = self.generate_noise(self.config.trainer.include_noise, cur_epoch)
-        # Train the discriminator
-        image_eval = self.sess.run(image)
+    def train_step(self, cur_epoch):
+        # Train the discriminator on the next batch of the iterator
         feed_dict = {
-            self.model.image_input: image_eval,
-            self.model.noise_tensor: noise,
-            self.model.true_labels: true_labels,
-            self.model.generated_labels: generated_labels,
-            self.model.real_noise: real_noise,
-            self.model.fake_noise: fake_noise,
             self.model.is_training: True,
         }
         _, ld = self.sess.run(
             [self.model.train_dis_op, self.model.total_disc_loss], feed_dict=feed_dict
         )
 
-        noise = np.random.normal(loc=0.0, scale=1.0, size=[self.batch_size, self.noise_dim])
-        true_labels, generated_labels = self.generate_labels(
-            self.config.trainer.soft_labels, self.config.trainer.flip_labels
-        )
-        real_noise, fake_noise = self.generate_noise(self.config.trainer.include_noise, cur_epoch)
         feed_dict = {
-            self.model.image_input: image_eval,
-            self.model.noise_tensor: noise,
-            self.model.true_labels: true_labels,
-            self.model.generated_labels: generated_labels,
-            self.model.real_noise: real_noise,
-            self.model.fake_noise: fake_noise,
+            self.model.reuse_batch: True,
             self.model.is_training: True,
         }
-        # Train the generator
-        _, lg = self.sess.run([self.model.train_gen_op, self.model.gen_loss], feed_dict=feed_dict)
-
-        if self.config.log.enable_summary:
-            sm = self.sess.run(self.model.sum_op, feed_dict=feed_dict)
-        else:
-            sm = None
+        # Train the generator on the same batch
+        sum_op = self.model.sum_op if self.config.log.enable_summary else None
+        _, lg, sm = self.sess.run(
+            [self.model.train_gen_op, self.model.gen_loss, self.summary_fetch(sum_op)],
+            feed_dict=feed_dict,
+        )
 
         return ld, lg, sm
-
-    def generate_labels(self, soft_labels, flip_labels):
-
-        if not soft_labels:
-            true_labels = np.ones((self.config.data_loader.batch_size, 1))
-            generated_labels = np.zeros((self.config.data_loader.batch_size, 1))
-        else:
-            generated_labels = np.zeros(
-                (self.config.data_loader.batch_size, 1)
-            ) + np.random.uniform(low=0.0, high=0.1, size=[self.config.data_loader.batch_size, 1])
-            flipped_idx = np.random.choice(
-                np.arange(len(generated_labels)),
-                size=int(self.config.trainer.noise_probability * len(generated_labels)),
-            )
-            generated_labels[flipped_idx] = 1 - generated_labels[flipped_idx]
-            true_labels = np.ones((self.config.data_loader.batch_size, 1)) - np.random.uniform(
-                low=0.0, high=0.1, size=[self.config.data_loader.batch_size, 1]
-            )
-            flipped_idx = np.random.choice(
-                np.arange(len(true_labels)),
-                size=int(self.config.trainer.noise_probability * len(true_labels)),
-            )
-            true_labels[flipped_idx] = 1 - true_labels[flipped_idx]
-
-        if flip_labels:
-            return generated_labels, true_labels
-        else:
-            return true_labels, generated_labels
-
-    def generate_noise(self, include_noise, cur_epoch):
-        sigma = max(0.75 * (10.0 - cur_epoch) / (10), 0.05)
-        if include_noise:
-            # If we want to add this is will add the noises
-            real_noise = np.random.normal(
-                scale=sigma,
-                size=[self.config.data_loader.batch_size] + self.config.trainer.image_dims,
-            )
-            fake_noise = np.random.normal(
-                scale=sigma,
-                size=[self.config.data_loader.batch_size] + self.config.trainer.image_dims,
-            )
-        else:
-            # Otherwise we are just going to add zeros which will not break anything
-            real_noise = np.zeros(
-                ([self.config.data_loader.batch_size] + self.config.trainer.image_dims)
-            )
-            fake_noise = np.zeros(
-                ([self.config.data_loader.batch_size] + self.config.trainer.image_dims)
-            )
-        return real_noise, fake_noise
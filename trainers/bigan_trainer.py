@@ -1,7 +1,6 @@
 from base.base_train import BaseTrain
-from tqdm import tqdm
+import tensorflow as tf
 import numpy as np
-from time import sleep
 from time import time
 from utils.evaluations import do_roc, save_results
 
@@ -14,8 +13,6 @@ class BIGANTrainer(BaseTrain):
         self.img_dims = self.config.trainer.image_dims
         # Inititalize the train Dataset Iterator
         self.sess.run(self.data.iterator.initializer)
-        # Initialize the test Dataset Iterator
-        self.sess.run(self.data.test_iterator.initializer)
         if self.config.data_loader.validation:
             self.sess.run(self.data.valid_iterator.initializer)
             self.best_valid_loss = 0
@@ -23,46 +20,33 @@ class BIGANTrainer(BaseTrain):
 
     def train_epoch(self):
         begin = time()
-        # Attach the epoch loop to a variable
-        loop = tqdm(range(self.config.data_loader.num_iter_per_epoch))
-        # Define the lists for summaries and losses
-        gen_losses = []
-        disc_losses = []
-        enc_losses = []
-        summaries = []
 
         # Get the current epoch counter
         cur_epoch = self.model.cur_epoch_tensor.eval(self.sess)
-        image = self.data.image
-        for _ in loop:
-            loop.set_description("Epoch:{}".format(cur_epoch + 1))
-            loop.refresh()  # to show immediately the update
-            sleep(0.01)
-            gen, dis, enc, sum_g, sum_d = self.train_step(image, cur_epoch)
-            gen_losses.append(gen)
-            disc_losses.append(dis)
-            enc_losses.append(enc)
-            summaries.append(sum_g)
-            summaries.append(sum_d)
+
+        def step():
+            gen, dis, enc, sum_g, sum_d = self.train_step(cur_epoch)
+            self.summarizer.write(sum_g)
+            self.summarizer.write(sum_d)
+            return {
+                "gen": gen,
+                "disc": dis,
+                "enc": enc,
+            }
+
+        losses = self.run_steps(step, "Epoch:{}".format(cur_epoch + 1))
         self.logger.info("Epoch {} terminated".format(cur_epoch))
-        self.summarizer.add_tensorboard(step=cur_epoch, summaries=summaries)
         # Check for reconstruction
         if cur_epoch % self.config.log.frequency_test == 0:
-            noise = np.random.normal(
-                loc=0.0, scale=1.0, size=[self.config.data_loader.test_batch, self.noise_dim]
-            )
-            image_eval = self.sess.run(image)
             feed_dict = {
-                self.model.image_input: image_eval,
-                self.model.noise_tensor: noise,
                 self.model.is_training: False,
             }
             reconstruction = self.sess.run(self.model.sum_op_im, feed_dict=feed_dict)
             self.summarizer.add_tensorboard(step=cur_epoch, summaries=[reconstruction])
         # Get the means of the loss values to display
-        gen_m = np.mean(gen_losses)
-        dis_m = np.mean(disc_losses)
-        enc_m = np.mean(enc_losses)
+        gen_m = losses["gen"]
+        dis_m = losses["disc"]
+        enc_m = losses["enc"]
         self.logger.info(
             "Epoch: {} | time = {} s | loss gen= {:4f} | loss dis = {:4f} | loss enc = {:4f}".format(
                 cur_epoch, time() - begin, gen_m, dis_m, enc_m
@@ -75,11 +59,7 @@ class BIGANTrainer(BaseTrain):
         ) % self.config.trainer.frequency_eval == 0 and self.config.trainer.enable_early_stop:
             valid_loss = 0
             image_valid = self.sess.run(self.data.valid_image)
-            noise = np.random.normal(
-                loc=0.0, scale=1.0, size=[self.config.data_loader.test_batch, self.noise_dim]
-            )
             feed_dict = {
-                self.model.noise_tensor: noise,
                 self.model.image_input: image_valid,
                 self.model.is_training: False,
             }
@@ -98,8 +78,8 @@ class BIGANTrainer(BaseTrain):
                 self.logger.info(
                     "Best model - valid loss = {:.4f} - saving...".format(self.best_valid_loss)
                 )
-                # Save the model state
-                self.model.save(self.sess)
+                # Keep the weights of the best model apart from the periodic checkpoints
+                self.model.save_best(self.sess, self.best_valid_loss)
                 self.nb_without_improvements = 0
             else:
                 self.nb_without_improvements += self.config.trainer.frequency_eval
@@ -119,26 +99,32 @@ class BIGANTrainer(BaseTrain):
         true_labels = []
         summaries = []
         # Create the scores
-        test_loop = tqdm(range(self.config.data_loader.num_iter_per_test))
+        test_loop = self.test_loop()
         cur_epoch = self.model.cur_epoch_tensor.eval(self.sess)
         for _ in test_loop:
             test_batch_begin = time()
-            test_batch, test_labels = self.sess.run([self.data.test_image, self.data.test_label])
-            test_loop.refresh()  # to show immediately the update
-            sleep(0.01)
-            noise = np.random.normal(
-                loc=0.0, scale=1.0, size=[self.config.data_loader.test_batch, self.noise_dim]
-            )
             feed_dict = {
-                self.model.image_input: test_batch,
-                self.model.noise_tensor: noise,
+                self.model.input_from_test: True,
                 self.model.is_training: False,
             }
-            scores_1 += self.sess.run(self.model.list_scores_1, feed_dict=feed_dict).tolist()
-            scores_2 += self.sess.run(self.model.list_scores_2, feed_dict=feed_dict).tolist()
-            summaries += self.sess.run([self.model.sum_op_im_test], feed_dict=feed_dict)
+            try:
+                score_1, score_2, sm, test_labels = self.run_test(
+                    [
+                        self.model.list_scores_1,
+                        self.model.list_scores_2,
+                        self.model.sum_op_im_test,
+                        self.model.input_label,
+                    ],
+                    feed_dict,
+                )
+            except tf.errors.OutOfRangeError:
+                break
+            scores_1 += score_1.tolist()
+            scores_2 += score_2.tolist()
+            summaries.append(sm)
             inference_time.append(time() - test_batch_begin)
             true_labels += test_labels.tolist()
+        test_loop.close()
         # Since the higher anomaly score indicates the anomalous one, and we inverted the labels to show that
         # normal images are 0 meaning that contains no anomaly and anomalous images are 1 meaning that it contains
         # an anomalous region, we first scale the scores and then invert them to match the scores
@@ -179,51 +165,33 @@ class BIGANTrainer(BaseTrain):
             percentile=percentiles,
         )
 
-    def train_step(self, image, cur_epoch):
-        image_eval = self.sess.run(image)
-        # Train the discriminator
+    def train_step(self, cur_epoch):
+        # Train the discriminator, the batch is taken from the iterator by the first run
         ld, sm_d = 0, None
         if self.config.trainer.mode == "standard":
             disc_iters = 1
         else:
             disc_iters = self.config.trainer.critic_iters
-        for _ in range(disc_iters):
-            noise = np.random.normal(loc=0.0, scale=1.0, size=[self.batch_size, self.noise_dim])
-            true_labels, generated_labels = self.generate_labels(
-                self.config.trainer.soft_labels, self.config.trainer.flip_labels
-            )
-            real_noise, fake_noise = self.generate_noise(
-                self.config.trainer.include_noise, cur_epoch
-            )
+        for i in range(disc_iters):
             feed_dict = {
-                self.model.image_input: image_eval,
-                self.model.noise_tensor: noise,
-                self.model.generated_labels: generated_labels,
-                self.model.true_labels: true_labels,
-                self.model.real_noise: real_noise,
-                self.model.fake_noise: fake_noise,
                 self.model.is_training: True,
             }
+            if i > 0:
+                feed_dict[self.model.reuse_batch] = True
             # Train Discriminator
             _, ld, sm_d = self.sess.run(
-                [self.model.train_dis_op, self.model.loss_discriminator, self.model.sum_op_dis],
+                [
+                    self.model.train_dis_op,
+                    self.model.loss_discriminator,
+                    self.summary_fetch(self.model.sum_op_dis),
+                ],
                 feed_dict=feed_dict,
             )
             if self.config.trainer.mode == "wgan":
                 _ = self.sess.run(self.model.clip_disc_weights)
         # Train Generator and Encoder
-        noise = np.random.normal(loc=0.0, scale=1.0, size=[self.batch_size, self.noise_dim])
-        true_labels, generated_labels = self.generate_labels(
-            self.config.trainer.soft_labels, self.config.trainer.flip_labels
-        )
-        real_noise, fake_noise = self.generate_noise(self.config.trainer.include_noise, cur_epoch)
         feed_dict = {
-            self.model.image_input: image_eval,
-            self.model.noise_tensor: noise,
-            self.model.generated_labels: generated_labels,
-            self.model.true_labels: true_labels,
-            self.model.real_noise: real_noise,
-            self.model.fake_noise: fake_noise,
+            self.model.reuse_batch: True,
             self.model.is_training: True,
         }
         _, _, le, lg, sm_g = self.sess.run(
@@ -232,58 +200,9 @@ class BIGANTrainer(BaseTrain):
                 self.model.train_enc_op,
                 self.model.loss_encoder,
                 self.model.loss_generator,
-                self.model.sum_op_gen,
+                self.summary_fetch(self.model.sum_op_gen),
             ],
             feed_dict=feed_dict,
         )
 
         return lg, np.mean(ld), le, sm_g, sm_d
-
-    def generate_labels(self, soft_labels, flip_labels):
-
-        if not soft_labels:
-            true_labels = np.ones((self.config.data_loader.batch_size, 1))
-            generated_labels = np.zeros((self.config.data_loader.batch_size, 1))
-        else:
-            generated_labels = np.zeros(
-                (self.config.data_loader.batch_size, 1)
-            ) + np.random.uniform(low=0.0, high=0.1, size=[self.config.data_loader.batch_size, 1])
-            flipped_idx = np.random.choice(
-                np.arange(len(generated_labels)),
-                size=int(self.config.trainer.noise_probability * len(generated_labels)),
-            )
-            generated_labels[flipped_idx] = 1 - generated_labels[flipped_idx]
-            true_labels = np.ones((self.config.data_loader.batch_size, 1)) - np.random.uniform(
-                low=0.0, high=0.1, size=[self.config.data_loader.batch_size, 1]
-            )
-            flipped_idx = np.random.choice(
-                np.arange(len(true_labels)),
-                size=int(self.config.trainer.noise_probability * len(true_labels)),
-            )
-            true_labels[flipped_idx] = 1 - true_labels[flipped_idx]
-        if flip_labels:
-            return generated_labels, true_labels
-        else:
-            return true_labels, generated_labels
-
-    def generate_noise(self, include_noise, cur_epoch):
-        sigma = max(0.75 * (10.0 - cur_epoch) / (10), 0.05)
-        if include_noise:
-            # If we want to add this is will add the noises
-            real_noise = np.random.normal(
-                scale=sigma,
-                size=[self.config.data_loader.batch_size] + self.config.trainer.image_dims,
-            )
-            fake_noise = np.random.normal(
-                scale=sigma,
-                size=[self.config.data_loader.batch_size] + self.config.trainer.image_dims,
-            )
-        else:
-            # Otherwise we are just going to add zeros which will not break anything
-            real_noise = np.zeros(
-                ([self.config.data_loader.batch_size] + self.config.trainer.image_dims)
-            )
-            fake_noise = np.zeros(
-                ([self.config.data_loader.batch_size] + self.config.trainer.image_dims)
-            )
-        return real_noise, fake_noise
@@ -1,7 +1,6 @@
 from base.base_train import BaseTrain
-from tqdm import tqdm
+import tensorflow as tf
 import numpy as np
-from time import sleep
 from time import time
 from utils.evaluations import save_results
 
@@ -14,8 +13,6 @@ class EBGANTrainer(BaseTrain):
         self.img_dims = self.config.trainer.image_dims
         # Inititalize the train Dataset Iterator
         self.sess.run(self.data.iterator.initializer)
-        # Initialize the test Dataset Iterator
-        self.sess.run(self.data.test_iterator.initializer)
         if self.config.data_loader.validation:
             self.sess.run(self.data.valid_iterator.initializer)
             self.best_valid_loss = 0
@@ -23,35 +20,23 @@ class EBGANTrainer(BaseTrain):
 
     def train_epoch(self):
         begin = time()
-        # Attach the epoch loop to a variable
-        loop = tqdm(range(self.config.data_loader.num_iter_per_epoch))
-        # Define the lists for summaries and losses
-        gen_losses = []
-        disc_losses = []
-        summaries = []
         # Get the current epoch counter
         cur_epoch = self.model.cur_epoch_tensor.eval(self.sess)
-        image = self.data.image
-        for _ in loop:
-            loop.set_description("Epoch:{}".format(cur_epoch + 1))
-            loop.refresh()  # to show immediately the update
-            sleep(0.01)
-            gen, dis, sum_g, sum_d = self.train_step(image, cur_epoch)
-            gen_losses.append(gen)
-            disc_losses.append(dis)
-            summaries.append(sum_g)
-            summaries.append(sum_d)
+
+        def step():
+            gen, dis, sum_g, sum_d = self.train_step(cur_epoch)
+            self.summarizer.write(sum_g)
+            self.summarizer.write(sum_d)
+            return {
+                "gen": gen,
+                "disc": dis,
+            }
+
+        losses = self.run_steps(step, "Epoch:{}".format(cur_epoch + 1))
         self.logger.info("Epoch {} terminated".format(cur_epoch))
-        self.summarizer.add_tensorboard(step=cur_epoch, summaries=summaries)
         # Check for reconstruction
         if cur_epoch % self.config.log.frequency_test == 0:
-            noise = np.random.normal(
-                loc=0.0, scale=1.0, size=[self.config.data_loader.test_batch, self.noise_dim]
-            )
-            image_eval = self.sess.run(image)
             feed_dict = {
-                self.model.image_input: image_eval,
-                self.model.noise_tensor: noise,
                 self.model.is_training: False,
             }
             reconstruction = self.sess.run(self.model.sum_op_im, feed_dict=feed_dict)
@@ -77,8 +62,8 @@ class EBGANTrainer(BaseTrain):
             self.save_generated_images(imgs_25, cur_epoch,num=1,row=1)
 
         # Get the means of the loss values to display
-        gen_m = np.mean(gen_losses)
-        dis_m = np.mean(disc_losses)
+        gen_m = losses["gen"]
+        dis_m = losses["disc"]
         self.logger.info(
             "Epoch: {} | time = {} s | loss gen= {:4f} | loss dis = {:4f} ".format(
                 cur_epoch, time() - begin, gen_m, dis_m
@@ -98,28 +83,36 @@ class EBGANTrainer(BaseTrain):
         true_labels = []
         summaries = []
         # Create the scores
-        test_loop = tqdm(range(self.config.data_loader.num_iter_per_test))
+        test_loop = self.test_loop()
         cur_epoch = self.model.cur_epoch_tensor.eval(self.sess)
         for _ in test_loop:
             test_batch_begin = time()
-            test_batch, test_labels = self.sess.run([self.data.test_image, self.data.test_label])
-            test_loop.refresh()  # to show immediately the update
-            sleep(0.01)
-            noise = np.random.normal(
-                loc=0.0, scale=1.0, size=[self.config.data_loader.test_batch, self.noise_dim]
-            )
             feed_dict = {
-                self.model.image_input: test_batch,
-                self.model.noise_tensor: noise,
+                self.model.input_from_test: True,
                 self.model.is_training: False,
             }
-            scores_im1 += self.sess.run(self.model.img_score_l1, feed_dict=feed_dict).tolist()
-            scores_im2 += self.sess.run(self.model.img_score_l2, feed_dict=feed_dict).tolist()
-            scores_z1 += self.sess.run(self.model.z_score_l1, feed_dict=feed_dict).tolist()
-            scores_z2 += self.sess.run(self.model.z_score_l2, feed_dict=feed_dict).tolist()
-            summaries += self.sess.run([self.model.sum_op_im_test], feed_dict=feed_dict)
+            try:
+                score_im1, score_im2, score_z1, score_z2, sm, test_labels = self.run_test(
+                    [
+                        self.model.img_score_l1,
+                        self.model.img_score_l2,
+                        self.model.z_score_l1,
+                        self.model.z_score_l2,
+                        self.model.sum_op_im_test,
+                        self.model.input_label,
+                    ],
+                    feed_dict,
+                )
+            except tf.errors.OutOfRangeError:
+                break
+            scores_im1 += score_im1.tolist()
+            scores_im2 += score_im2.tolist()
+            scores_z1 += score_z1.tolist()
+            scores_z2 += score_z2.tolist()
+            summaries.append(sm)
             inference_time.append(time() - test_batch_begin)
             true_labels += test_labels.tolist()
+        test_loop.close()
         self.summarizer.add_tensorboard(step=cur_epoch, summaries=summaries, summarizer="test")
         scores_im1 = np.asarray(scores_im1)
         scores_im2 = np.asarray(scores_im2)
@@ -188,7 +181,7 @@ class EBGANTrainer(BaseTrain):
             percentile=percentiles,
         )
 
-    def train_step(self, image, cur_epoch):
+    def train_step(self, cur_epoch):
         # Train Generator
         if self.config.trainer.mode == "standard":
             gen_iters = 1
@@ -198,32 +191,36 @@ class EBGANTrainer(BaseTrain):
         sm_g = 0
         ld_t = 0
         for _ in range(gen_iters):
-            image_eval = self.sess.run(image)
-            noise = np.random.normal(loc=0.0, scale=1.0, size=[self.batch_size, self.noise_dim])
+            # Every generator iteration takes a new batch from the iterator
             feed_dict = {
-                self.model.image_input: image_eval,
-                self.model.noise_tensor: noise,
                 self.model.is_training: True,
             }
             _, lg, sm_g = self.sess.run(
-                [self.model.train_gen_op, self.model.loss_generator, self.model.sum_op_gen],
+                [
+                    self.model.train_gen_op,
+                    self.model.loss_generator,
+                    self.summary_fetch(self.model.sum_op_gen),
+                ],
                 feed_dict=feed_dict,
             )
             lg_t += lg
-        image_eval = self.sess.run(image)
+        # The critic iterations share one batch, taken from the iterator by the first run
         if self.config.trainer.mode == "standard":
             disc_iters = 1
         else:
             disc_iters = self.config.trainer.critic_iters
-        for _ in range(disc_iters):
-            noise = np.random.normal(loc=0.0, scale=1.0, size=[self.batch_size, self.noise_dim])
+        for i in range(disc_iters):
             feed_dict = {
-                self.model.image_input: image_eval,
-                self.model.noise_tensor: noise,
                 self.model.is_training: True,
             }
+            if i > 0:
+                feed_dict[self.model.reuse_batch] = True
             _, ld, sm_d = self.sess.run(
-                [self.model.train_dis_op, self.model.loss_discriminator, self.model.sum_op_dis],
+                [
+                    self.model.train_dis_op,
+                    self.model.loss_discriminator,
+                    self.summary_fetch(self.model.sum_op_dis),
+                ],
                 feed_dict=feed_dict,
             )
             ld_t += ld
@@ -1,7 +1,5 @@
 from base.base_train_multi import BaseTrainMulti
-from tqdm import tqdm
 import numpy as np
-from time import sleep
 from time import time
 from utils.evaluations import save_results
 
@@ -14,8 +12,6 @@ class EncEBGANTrainer(BaseTrainMulti):
         self.img_dims = self.config.trainer.image_dims
         # Inititalize the train Dataset Iterator
         self.sess.run(self.data.iterator.initializer)
-        # Initialize the test Dataset Iterator
-        self.sess.run(self.data.test_iterator.initializer)
         if self.config.data_loader.validation:
             self.sess.run(self.data.valid_iterator.initializer)
             self.best_valid_loss = 0
@@ -25,74 +21,55 @@ class EncEBGANTrainer(BaseTrainMulti):
         # Attach the epoch loop to a variable
         begin = time()
         # Make the loop of the epoch iterations
-        loop = tqdm(range(self.config.data_loader.num_iter_per_epoch))
-        gen_losses = []
-        disc_losses = []
-        summaries = []
-        image = self.data.image
         cur_epoch = self.model.cur_epoch_tensor.eval(self.sess)
-        for _ in loop:
-            loop.set_description("Epoch:{}".format(cur_epoch + 1))
-            loop.refresh()  # to show immediately the update
-            sleep(0.01)
-            lg, ld, sum_g, sum_d = self.train_step_gan(image, cur_epoch)
-            gen_losses.append(lg)
-            disc_losses.append(ld)
-            summaries.append(sum_g)
-            summaries.append(sum_d)
+
+        def step():
+            lg, ld, sum_g, sum_d = self.train_step_gan(cur_epoch)
+            self.summarizer.write(sum_g)
+            self.summarizer.write(sum_d)
+            return {
+                "gen": lg,
+                "disc": ld,
+            }
+
+        losses = self.run_steps(step, "Epoch:{}".format(cur_epoch + 1))
         self.logger.info("Epoch {} terminated".format(cur_epoch))
-        self.summarizer.add_tensorboard(step=cur_epoch, summaries=summaries)
 
         # Check for reconstruction
         if cur_epoch % self.config.log.frequency_test == 0:
-            noise = np.random.normal(
-                loc=0.0, scale=1.0, size=[self.config.data_loader.test_batch, self.noise_dim]
-            )
-            image_eval = self.sess.run(image)
             feed_dict = {
-                self.model.image_input: image_eval,
-                self.model.noise_tensor: noise,
                 self.model.is_training_gen: False,
                 self.model.is_training_dis: False,
             }
             reconstruction = self.sess.run(self.model.sum_op_im_1, feed_dict=feed_dict)
             self.summarizer.add_tensorboard(step=cur_epoch, summaries=[reconstruction])
-        gen_m = np.mean(gen_losses)
-        dis_m = np.mean(disc_losses)
+        gen_m = losses["gen"]
+        dis_m = losses["disc"]
         self.logger.info(
             "Epoch: {} | time = {} s | loss gen= {:4f} | loss dis = {:4f} ".format(
                 cur_epoch, time() - begin, gen_m, dis_m
             )
         )
-        self.model.save(self.sess)
+        self.model.save(self.sess, "gan")
 
     def train_epoch_enc(self):
         # Attach the epoch loop to a variable
         begin = time()
         # Make the loop of the epoch iterations
-        loop = tqdm(range(self.config.data_loader.num_iter_per_epoch))
-        enc_losses = []
-        summaries = []
-        image = self.data.image
         cur_epoch = self.model.cur_epoch_tensor.eval(self.sess)
-        for _ in loop:
-            loop.set_description("Epoch:{}".format(cur_epoch + 1))
-            loop.refresh()  # to show immediately the update
-            sleep(0.01)
-            le, sum_e = self.train_step_enc(image, cur_epoch)
-            enc_losses.append(le)
-            summaries.append(sum_e)
+
+        def step():
+            le, sum_e = self.train_step_enc(cur_epoch)
+            self.summarizer.write(sum_e, "valid")
+            return {
+                "enc": le,
+            }
+
+        losses = self.run_steps(step, "Epoch:{}".format(cur_epoch + 1))
         self.logger.info("Epoch {} terminated".format(cur_epoch))
-        self.summarizer.add_tensorboard(step=cur_epoch, summaries=summaries, summarizer="valid")
         # Check for reconstruction
         if cur_epoch % self.config.log.frequency_test == 0:
-            noise = np.random.normal(
-                loc=0.0, scale=1.0, size=[self.config.data_loader.test_batch, self.noise_dim]
-            )
-            image_eval = self.sess.run(image)
             feed_dict = {
-                self.model.image_input: image_eval,
-                self.model.noise_tensor: noise,
                 self.model.is_training_gen: False,
                 self.model.is_training_enc: False,
                 self.model.is_training_dis: False,
@@ -101,30 +78,33 @@ class EncEBGANTrainer(BaseTrainMulti):
             self.summarizer.add_tensorboard(
                 step=cur_epoch, summaries=[reconstruction], summarizer="valid"
             )
-        enc_m = np.mean(enc_losses)
+        enc_m = losses["enc"]
         self.logger.info(
             "Epoch: {} | time = {} s | loss enc= {:4f}  ".format(cur_epoch, time() - begin, enc_m)
         )
-        self.model.save(self.sess)
+        self.model.save(self.sess, "enc")
 
-    def train_step_gan(self, image, cur_epoch):
+    def train_step_gan(self, cur_epoch):
         ld_t, lg_t, sm_g, sm_d = [], [], None, None
-        image_eval = self.sess.run(image)
+        # The critic iterations share one batch, taken from the iterator by the first run
         if self.config.trainer.mode == "standard":
             disc_iters = 1
         else:
             disc_iters = self.config.trainer.critic_iters
-        for _ in range(disc_iters):
-            noise = np.random.normal(loc=0.0, scale=1.0, size=[self.batch_size, self.noise_dim])
+        for i in range(disc_iters):
             feed_dict = {
-                self.model.image_input: image_eval,
-                self.model.noise_tensor: noise,
                 self.model.is_training_gen: True,
                 self.model.is_training_dis: True,
                 self.model.is_training_enc: False,
             }
+            if i > 0:
+                feed_dict[self.model.reuse_batch] = True
             _, ld, sm_d = self.sess.run(
-                [self.model.train_dis_op, self.model.loss_discriminator, self.model.sum_op_dis],
+                [
+                    self.model.train_dis_op,
+                    self.model.loss_discriminator,
+                    self.summary_fetch(self.model.sum_op_dis),
+                ],
                 feed_dict=feed_dict,
             )
             ld_t.append(ld)
@@ -134,35 +114,36 @@ class EncEBGANTrainer(BaseTrainMulti):
         else:
             gen_iters = 3
         for _ in range(gen_iters):
-            image_eval = self.sess.run(image)
-            noise = np.random.normal(loc=0.0, scale=1.0, size=[self.batch_size, self.noise_dim])
+            # Every generator iteration takes a new batch from the iterator
             feed_dict = {
-                self.model.image_input: image_eval,
-                self.model.noise_tensor: noise,
                 self.model.is_training_gen: True,
                 self.model.is_training_dis: True,
                 self.model.is_training_enc: False,
             }
             _, lg, sm_g = self.sess.run(
-                [self.model.train_gen_op, self.model.loss_generator, self.model.sum_op_gen],
+                [
+                    self.model.train_gen_op,
+                    self.model.loss_generator,
+                    self.summary_fetch(self.model.sum_op_gen),
+                ],
                 feed_dict=feed_dict,
             )
             lg_t.append(lg)
 
         return np.mean(lg_t), np.mean(ld_t), sm_g, sm_d
 
-    def train_step_enc(self, image, cur_epoch):
-        image_eval = self.sess.run(image)
-        noise = np.random.normal(loc=0.0, scale=1.0, size=[self.batch_size, self.noise_dim])
+    def train_step_enc(self, cur_epoch):
         feed_dict = {
-            self.model.image_input: image_eval,
-            self.model.noise_tensor: noise,
             self.model.is_training_gen: False,
             self.model.is_training_dis: False,
             self.model.is_training_enc: True,
         }
         _, le, sm_e = self.sess.run(
-            [self.model.train_enc_op, self.model.loss_encoder, self.model.sum_op_enc],
+            [
+                self.model.train_enc_op,
+                self.model.loss_encoder,
+                self.summary_fetch(self.model.sum_op_enc),
+            ],
             feed_dict=feed_dict,
         )
         return le, sm_e
@@ -179,32 +160,48 @@ class EncEBGANTrainer(BaseTrainMulti):
         true_labels = []
         summaries = []
         # Create the scores
-        test_loop = tqdm(range(self.config.data_loader.num_iter_per_test))
+        test_loop = self.test_loop()
         cur_epoch = self.model.cur_epoch_tensor.eval(self.sess)
         for _ in test_loop:
             test_batch_begin = time()
-            test_batch, test_labels = self.sess.run([self.data.test_image, self.data.test_label])
-            test_loop.refresh()  # to show immediately the update
-            sleep(0.01)
-            noise = np.random.normal(
-                loc=0.0, scale=1.0, size=[self.config.data_loader.test_batch, self.noise_dim]
-            )
             feed_dict = {
-                self.model.image_input: test_batch,
-                self.model.noise_tensor: noise,
+                self.model.input_from_test: True,
                 self.model.is_training_gen: False,
                 self.model.is_training_dis: False,
                 self.model.is_training_enc: False,
             }
-            scores_im1 += self.sess.run(self.model.img_score_l1, feed_dict=feed_dict).tolist()
-            scores_im2 += self.sess.run(self.model.img_score_l2, feed_dict=feed_dict).tolist()
-            scores_z1 += self.sess.run(self.model.z_score_l1, feed_dict=feed_dict).tolist()
-            scores_z2 += self.sess.run(self.model.z_score_l2, feed_dict=feed_dict).tolist()
-            scores_comb += self.sess.run(self.model.score_comb, feed_dict=feed_dict).tolist()
-            scores_comb2 += self.sess.run(self.model.score_comb_2, feed_dict=feed_dict).tolist()
-            summaries += self.sess.run([self.model.sum_op_im_test], feed_dict=feed_dict)
+            (
+                score_im1,
+                score_im2,
+                score_z1,
+                score_z2,
+                score_comb,
+                score_comb2,
+                sm,
+                test_labels,
+            ) = self.sess.run(
+                [
+                    self.model.img_score_l1,
+                    self.model.img_score_l2,
+                    self.model.z_score_l1,
+                    self.model.z_score_l2,
+                    self.model.score_comb,
+                    self.model.score_comb_2,
+                    self.model.sum_op_im_test,
+                    self.model.input_label,
+                ],
+                feed_dict=feed_dict,
+            )
+            scores_im1 += score_im1.tolist()
+            scores_im2 += score_im2.tolist()
+            scores_z1 += score_z1.tolist()
+            scores_z2 += score_z2.tolist()
+            scores_comb += score_comb.tolist()
+            scores_comb2 += score_comb2.tolist()
+            summaries.append(sm)
             inference_time.append(time() - test_batch_begin)
             true_labels += test_labels.tolist()
+        test_loop.close()
         self.summarizer.add_tensorboard(step=cur_epoch, summaries=summaries, summarizer="test")
         scores_im1 = np.asarray(scores_im1)
         scores_im2 = np.asarray(scores_im2)
@@ -1,7 +1,6 @@
 from base.base_train import BaseTrain
-from tqdm import tqdm
+import tensorflow as tf
 import numpy as np
-from time import sleep
 from time import time
 from utils.evaluations import save_results
 
@@ -15,8 +14,6 @@ class Mark1_Trainer(BaseTrain):
         self.img_dims = self.config.trainer.image_dims
         # Inititalize the train Dataset Iterator
         self.sess.run(self.data.iterator.initializer)
-        # Initialize the test Dataset Iterator
-        self.sess.run(self.data.test_iterator.initializer)
         if self.config.data_loader.validation:
             self.sess.run(self.data.valid_iterator.initializer)
             self.best_valid_loss = 0
@@ -24,44 +21,34 @@ class Mark1_Trainer(BaseTrain):
 
     def train_epoch(self):
         begin = time()
-        # Attach the epoch loop to a variable
-        loop = tqdm(range(self.config.data_loader.num_iter_per_epoch))
-        # Define the lists for summaries and losses
-        gen_losses = []
-        disc_losses = []
-        disc_xz_losses = []
-        disc_xx_losses = []
-        disc_zz_losses = []
-        summaries = []
         # Get the current epoch counter
         cur_epoch = self.model.cur_epoch_tensor.eval(self.sess)
-        image = self.data.image
-        for _ in loop:
-            loop.set_description("Epoch:{}".format(cur_epoch + 1))
-            loop.refresh()  # to show immediately the update
-            sleep(0.01)
-            lg, ld, ldxz, ldxx, ldzz, sum_g, sum_d = self.train_step(image, cur_epoch)
-            gen_losses.append(lg)
-            disc_losses.append(ld)
-            disc_xz_losses.append(ldxz)
-            disc_xx_losses.append(ldxx)
-            disc_zz_losses.append(ldzz)
-            summaries.append(sum_g)
-            summaries.append(sum_d)
+
+        def step():
+            lg, ld, ldxz, ldxx, ldzz, sum_g, sum_d = self.train_step(cur_epoch)
+            self.summarizer.write(sum_g)
+            self.summarizer.write(sum_d)
+            return {
+                "gen": lg,
+                "disc": ld,
+                "disc_xz": ldxz,
+                "disc_xx": ldxx,
+                "disc_zz": ldzz,
+            }
+
+        losses = self.run_steps(step, "Epoch:{}".format(cur_epoch + 1))
         self.logger.info("Epoch {} terminated".format(cur_epoch))
-        self.summarizer.add_tensorboard(step=cur_epoch, summaries=summaries)
         # Check for reconstruction
         if cur_epoch % self.config.log.frequency_test == 0:
-            image_eval = self.sess.run(image)
-            feed_dict = {self.model.image_input: image_eval, self.model.is_training: False}
+            feed_dict = {self.model.is_training: False}
             reconstruction = self.sess.run(self.model.sum_op_im, feed_dict=feed_dict)
             self.summarizer.add_tensorboard(step=cur_epoch, summaries=[reconstruction])
         # Get the means of the loss values to display
-        gl_m = np.mean(gen_losses)
-        dl_m = np.mean(disc_losses)
-        dlxz_m = np.mean(disc_xz_losses)
-        dlxx_m = np.mean(disc_xx_losses)
-        dlzz_m = np.mean(disc_zz_losses)
+        gl_m = losses["gen"]
+        dl_m = losses["disc"]
+        dlxz_m = losses["disc_xz"]
+        dlxx_m = losses["disc_xx"]
+        dlzz_m = losses["disc_zz"]
         if self.config.trainer.allow_zz:
             self.logger.info(
                 "Epoch {} | time = {} | loss gen = {:4f} |"
@@ -102,8 +89,8 @@ class Mark1_Trainer(BaseTrain):
                 self.logger.info(
                     "Best model - valid loss = {:.4f} - saving...".format(self.best_valid_loss)
                 )
-                # Save the model state
-                self.model.save(self.sess)
+                # Keep the weights of the best model apart from the periodic checkpoints
+                self.model.save_best(self.sess, self.best_valid_loss)
                 self.nb_without_improvements = 0
             else:
                 self.nb_without_improvements += self.config.trainer.frequency_eval
@@ -120,16 +107,20 @@ class Mark1_Trainer(BaseTrain):
         inference_time = []
         true_labels = []
         # Create the scores
-        test_loop = tqdm(range(self.config.data_loader.num_iter_per_test))
+        test_loop = self.test_loop()
         for _ in test_loop:
             test_batch_begin = time()
-            test_batch, test_labels = self.sess.run([self.data.test_image, self.data.test_label])
-            test_loop.refresh()  # to show immediately the update
-            sleep(0.01)
-            feed_dict = {self.model.image_input: test_batch, self.model.is_training: False}
-            scores += self.sess.run(self.model.score, feed_dict=feed_dict).tolist()
+            feed_dict = {self.model.input_from_test: True, self.model.is_training: False}
+            try:
+                score, test_labels = self.run_test(
+                    [self.model.score, self.model.input_label], feed_dict
+                )
+            except tf.errors.OutOfRangeError:
+                break
+            scores += score.tolist()
             inference_time.append(time() - test_batch_begin)
             true_labels += test_labels.tolist()
+        test_loop.close()
         true_labels = np.asarray(true_labels)
         inference_time = np.mean(inference_time)
         self.logger.info("Testing: Mean inference time is {:4f}".format(inference_time))
@@ -150,21 +141,14 @@ class Mark1_Trainer(BaseTrain):
             step,
         )
 
-    def train_step(self, image, cur_epoch):
+    def train_step(self, cur_epoch):
         """
           implement the logic of the train step
           - run the tensorflow session
           - return any metrics you need to summarize
         """
-        true_labels, generated_labels = self.generate_labels(
-            self.config.trainer.soft_labels, self.config.trainer.flip_labels
-        )
-        # Train the discriminator
-        image_eval = self.sess.run(image)
+        # Train the discriminator on the next batch of the iterator
         feed_dict = {
-            self.model.image_input: image_eval,
-            self.model.generated_labels: generated_labels,
-            self.model.true_labels: true_labels,
             self.model.is_training: True,
         }
         _, _, _, ld, ldxz, ldxx, ldzz, sm_d = self.sess.run(
@@ -176,51 +160,23 @@ class Mark1_Trainer(BaseTrain):
                 self.model.dis_loss_xz,
                 self.model.dis_loss_xx,
                 self.model.dis_loss_zz,
-                self.model.sum_op_dis,
+                self.summary_fetch(self.model.sum_op_dis),
             ],
             feed_dict=feed_dict,
         )
 
-        # Train Generator
-        true_labels, generated_labels = self.generate_labels(
-            self.config.trainer.soft_labels, self.config.trainer.flip_labels
-        )
+        # Train Generator on the same batch
         feed_dict = {
-            self.model.image_input: image_eval,
-            self.model.generated_labels: generated_labels,
-            self.model.true_labels: true_labels,
+            self.model.reuse_batch: True,
             self.model.is_training: True,
         }
         _, lg, sm_g = self.sess.run(
-            [self.model.train_gen_op, self.model.gen_loss_total, self.model.sum_op_gen],
+            [
+                self.model.train_gen_op,
+                self.model.gen_loss_total,
+                self.summary_fetch(self.model.sum_op_gen),
+            ],
             feed_dict=feed_dict,
         )
 
         return lg, ld, ldxz, ldxx, ldzz, sm_g, sm_d
-
-    def generate_labels(self, soft_labels, flip_labels):
-
-        if not soft_labels:
-            true_labels = np.ones((self.config.data_loader.batch_size, 1))
-            generated_labels = np.zeros((self.config.data_loader.batch_size, 1))
-        else:
-            generated_labels = np.zeros(
-                (self.config.data_loader.batch_size, 1)
-            ) + np.random.uniform(low=0.0, high=0.1, size=[self.config.data_loader.batch_size, 1])
-            # flipped_idx = np.random.choice(
-            #     np.arange(len(generated_labels)),
-            #     size=int(self.config.trainer.noise_probability * len(generated_labels)),
-            # )
-            # generated_labels[flipped_idx] = 1 - generated_labels[flipped_idx]
-            true_labels = np.ones((self.config.data_loader.batch_size, 1)) - np.random.uniform(
-                low=0.0, high=0.1, size=[self.config.data_loader.batch_size, 1]
-            )
-            # flipped_idx = np.random.choice(
-            #     np.arange(len(true_labels)),
-            #     size=int(self.config.trainer.noise_probability * len(true_labels)),
-            # )
-            # true_labels[flipped_idx] = 1 - true_labels[flipped_idx]
-        if flip_labels:
-            return generated_labels, true_labels
-        else:
-            return true_labels, generated_labels
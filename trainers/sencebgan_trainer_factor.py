@@ -1,7 +1,6 @@
 from base.base_train_sequential import BaseTrainSequential
-from tqdm import tqdm
+import tensorflow as tf
 import numpy as np
-from time import sleep
 from time import time
 from utils.evaluations import save_results
 
@@ -14,89 +13,71 @@ class SENCEBGANTrainerFactor(BaseTrainSequential):
         self.img_dims = self.config.trainer.image_dims
         # Inititalize the train Dataset Iterator
         self.sess.run(self.data.iterator.initializer)
-        # Initialize the test Dataset Iterator
-        self.sess.run(self.data.test_iterator.initializer)
         if self.config.data_loader.validation:
             self.sess.run(self.data.valid_iterator.initializer)
             self.best_valid_loss = 0
             self.nb_without_improvements = 0
+        # With fused_steps the fused train op of the model runs that many steps per sess.run
+        self.fused_runs = None
+        if self.config.trainer.fused_steps:
+            self.fused_runs = max(
+                self.config.data_loader.num_iter_per_epoch // self.config.trainer.fused_steps, 1
+            )
 
     def train_epoch_gan(self):
         # Attach the epoch loop to a variable
         begin = time()
         # Make the loop of the epoch iterations
-        loop = tqdm(range(self.config.data_loader.num_iter_per_epoch))
-        gen_losses = []
-        disc_losses = []
-        summaries = []
-        image = self.data.image
         cur_epoch = self.model.cur_epoch_tensor.eval(self.sess)
-        for _ in loop:
-            loop.set_description("Epoch:{}".format(cur_epoch + 1))
-            loop.refresh()  # to show immediately the update
-            sleep(0.01)
-            lg, ld, sum_g, sum_d = self.train_step_gan(image, cur_epoch)
-            gen_losses.append(lg)
-            disc_losses.append(ld)
-            summaries.append(sum_g)
-            summaries.append(sum_d)
+
+        def step():
+            lg, ld, sum_g, sum_d = self.train_step_gan(cur_epoch)
+            self.summarizer.write(sum_g)
+            self.summarizer.write(sum_d)
+            return {
+                "gen": lg,
+                "disc": ld,
+            }
+
+        losses = self.run_steps(step, "Epoch:{}".format(cur_epoch + 1), self.fused_runs)
         self.logger.info("Epoch {} terminated".format(cur_epoch))
-        self.summarizer.add_tensorboard(step=cur_epoch, summaries=summaries)
 
         # Check for reconstruction
         if cur_epoch % self.config.log.frequency_test == 0:
-            noise = np.random.normal(
-                loc=0.0, scale=1.0, size=[self.config.data_loader.test_batch, self.noise_dim]
-            )
-            image_eval = self.sess.run(image)
             feed_dict = {
-                self.model.image_input: image_eval,
-                self.model.noise_tensor: noise,
                 self.model.is_training_gen: False,
                 self.model.is_training_dis:False,
             }
             reconstruction = self.sess.run(self.model.sum_op_im_1, feed_dict=feed_dict)
             self.summarizer.add_tensorboard(step=cur_epoch, summaries=[reconstruction])
-        gen_m = np.mean(gen_losses)
-        dis_m = np.mean(disc_losses)
+        gen_m = losses["gen"]
+        dis_m = losses["disc"]
         self.logger.info(
             "Epoch: {} | time = {} s | loss gen= {:4f} | loss dis = {:4f} ".format(
                 cur_epoch, time() - begin, gen_m, dis_m
             )
         )
-        self.model.save(self.sess)
+        self.model.save(self.sess, "gan")
 
     def train_epoch_enc_gen(self):
         # Attach the epoch loop to a variable
         begin = time()
         # Make the loop of the epoch iterations
-        loop = tqdm(range(self.config.data_loader.num_iter_per_epoch))
-        enc_losses = []
-        disc_xx_losses = []
-        summaries = []
-        image = self.data.image
         cur_epoch = self.model.cur_epoch_tensor.eval(self.sess)
-        for _ in loop:
-            loop.set_description("Epoch:{}".format(cur_epoch + 1))
-            loop.refresh()  # to show immediately the update
-            sleep(0.01)
-            le, sum_e, ldxx = self.train_step_enc_gen(image, cur_epoch)
-            enc_losses.append(le)
-            if self.config.trainer.enable_disc_xx:
-                disc_xx_losses.append(ldxx)
-            summaries.append(sum_e)
 
+        def step():
+            le, sum_e, ldxx = self.train_step_enc_gen(cur_epoch)
+            self.summarizer.write(sum_e, "valid")
+            return {
+                "enc": le,
+                "disc_xx": ldxx if self.config.trainer.enable_disc_xx else None,
+            }
+
+        losses = self.run_steps(step, "Epoch:{}".format(cur_epoch + 1))
         self.logger.info("Epoch {} terminated".format(cur_epoch))
-        self.summarizer.add_tensorboard(step=cur_epoch, summaries=summaries, summarizer="valid")
         # Check for reconstruction
         if cur_epoch % self.config.log.frequency_test == 0:
-            noise = np.random.normal(
-                loc=0.0, scale=1.0, size=[self.config.data_loader.test_batch, self.noise_dim]
-            )
-            image_eval = self.sess.run(image)
             feed_dict = {
-                self.model.image_input: image_eval,
-                self.model.noise_tensor: noise,
                 self.model.is_training_gen: False,
                 self.model.is_training_enc_g: False,
                 self.model.is_training_enc_r: False,
@@ -106,9 +87,9 @@ class SENCEBGANTrainerFactor(BaseTrainSequential):
             self.summarizer.add_tensorboard(
                 step=cur_epoch, summaries=[reconstruction], summarizer="valid"
             )
-        enc_m = np.mean(enc_losses)
+        enc_m = losses["enc"]
         if self.config.trainer.enable_disc_xx:
-            dis_xx_m = np.mean(disc_xx_losses)
+            dis_xx_m = losses["disc_xx"]
             self.logger.info(
                 "Epoch: {} | time = {} s | loss enc generation= {:4f}  | loss dis xx = {:4f}".format(
                     cur_epoch, time() - begin, enc_m, dis_xx_m
@@ -120,32 +101,27 @@ class SENCEBGANTrainerFactor(BaseTrainSequential):
                     cur_epoch, time() - begin, enc_m
                 )
             )
-        self.model.save(self.sess)
+        self.model.save(self.sess, "enc_gen")
 
     def train_epoch_enc_rec(self):
         # Attach the epoch loop to a variable
         begin = time()
         # Make the loop of the epoch iterations
-        loop = tqdm(range(self.config.data_loader.num_iter_per_epoch))
-        enc_losses = []
-        disc_zz_losses = []
-        summaries = []
-        image = self.data.image
         cur_epoch = self.model.cur_epoch_tensor.eval(self.sess)
-        for _ in loop:
-            loop.set_description("Epoch:{}".format(cur_epoch + 1))
-            loop.refresh()  # to show immediately the update
-            sleep(0.01)
-            le, sum_e, ldzz = self.train_step_enc_rec(image, cur_epoch)
-            enc_losses.append(le)
-            if self.config.trainer.enable_disc_zz:
-                disc_zz_losses.append(ldzz)
-            summaries.append(sum_e)
+
+        def step():
+            le, sum_e, ldzz = self.train_step_enc_rec(cur_epoch)
+            self.summarizer.write(sum_e, "valid_2")
+            return {
+                "enc": le,
+                "disc_zz": ldzz if self.config.trainer.enable_disc_zz else None,
+            }
+
+        losses = self.run_steps(step, "Epoch:{}".format(cur_epoch + 1))
         self.logger.info("Epoch {} terminated".format(cur_epoch))
-        self.summarizer.add_tensorboard(step=cur_epoch, summaries=summaries, summarizer="valid_2")
-        enc_m = np.mean(enc_losses)
+        enc_m = losses["enc"]
         if self.config.trainer.enable_disc_zz:
-            dis_zz_m = np.mean(disc_zz_losses)
+            dis_zz_m = losses["disc_zz"]
             self.logger.info(
                 "Epoch: {} | time = {} s | loss enc reconstruction= {:4f}  | loss dis zz = {:4f}".format(
                     cur_epoch, time() - begin, enc_m, dis_zz_m
@@ -157,27 +133,40 @@ class SENCEBGANTrainerFactor(BaseTrainSequential):
                     cur_epoch, time() - begin, enc_m
                 )
             )
-        self.model.save(self.sess)
+        self.model.save(self.sess, "enc_rec")
 
-    def train_step_gan(self, image, cur_epoch):
+    def train_step_gan(self, cur_epoch):
+        if self.fused_runs:
+            # The schedule below runs fused_steps times in the graph, without summaries
+            feed_dict = {
+                self.model.is_training_gen: True,
+                self.model.is_training_dis: True,
+                self.model.is_training_enc_g: False,
+                self.model.is_training_enc_r: False,
+            }
+            losses = self.sess.run(self.model.fused_gan_losses, feed_dict=feed_dict)
+            return losses["gen"], losses["disc"], None, None
         ld_t, lg_t, sm_g, sm_d = [], [], None, None
-        image_eval = self.sess.run(image)
+        # The critic iterations share one batch, taken from the iterator by the first run
         if self.config.trainer.mode == "standard":
             disc_iters = 1
         else:
             disc_iters = self.config.trainer.critic_iters
-        for _ in range(disc_iters):
-            noise = np.random.normal(loc=0.0, scale=1.0, size=[self.batch_size, self.noise_dim])
+        for i in range(disc_iters):
             feed_dict = {
-                self.model.image_input: image_eval,
-                self.model.noise_tensor: noise,
                 self.model.is_training_gen: True,
                 self.model.is_training_dis: True,
                 self.model.is_training_enc_g: False,
                 self.model.is_training_enc_r: False,
             }
+            if i > 0:
+                feed_dict[self.model.reuse_batch] = True
             _, ld, sm_d = self.sess.run(
-                [self.model.train_dis_op, self.model.loss_discriminator, self.model.sum_op_dis],
+                [
+                    self.model.train_dis_op,
+                    self.model.loss_discriminator,
+                    self.summary_fetch(self.model.sum_op_dis),
+                ],
                 feed_dict=feed_dict,
             )
             ld_t.append(ld)
@@ -187,32 +176,29 @@ class SENCEBGANTrainerFactor(BaseTrainSequential):
         else:
             gen_iters = 3
         for _ in range(gen_iters):
-            image_eval = self.sess.run(image)
-            noise = np.random.normal(loc=0.0, scale=1.0, size=[self.batch_size, self.noise_dim])
+            # Every generator iteration takes a new batch from the iterator
             feed_dict = {
-                self.model.image_input: image_eval,
-                self.model.noise_tensor: noise,
                 self.model.is_training_gen: True,
                 self.model.is_training_dis: True,
                 self.model.is_training_enc_g: False,
                 self.model.is_training_enc_r: False,
             }
             _, lg, sm_g = self.sess.run(
-                [self.model.train_gen_op, self.model.loss_generator, self.model.sum_op_gen],
+                [
+                    self.model.train_gen_op,
+                    self.model.loss_generator,
+                    self.summary_fetch(self.model.sum_op_gen),
+                ],
                 feed_dict=feed_dict,
             )
             lg_t.append(lg)
 
         return np.mean(lg_t), np.mean(ld_t), sm_g, sm_d
 
-    def train_step_enc_gen(self, image, cur_epoch):
-        image_eval = self.sess.run(image)
+    def train_step_enc_gen(self, cur_epoch):
         ld_t, lg_t, sm_g, sm_d = [], [], None, None
-        noise = np.random.normal(loc=0.0, scale=1.0, size=[self.batch_size, self.noise_dim])
         ldxx = 0
         feed_dict = {
-            self.model.image_input: image_eval,
-            self.model.noise_tensor: noise,
             # Modified
             self.model.is_training_gen: False,
             self.model.is_training_dis: False,
@@ -220,28 +206,34 @@ class SENCEBGANTrainerFactor(BaseTrainSequential):
             self.model.is_training_enc_r: False,
         }
         if self.config.trainer.enable_disc_xx:
-            _, le, sm_e, = self.sess.run(
-                [self.model.train_enc_g_op, self.model.loss_encoder_g, self.model.sum_op_enc_g],
+            # The discriminator xx is trained on the batch of the encoder
+            _, le, sm_e = self.sess.run(
+                [
+                    self.model.train_enc_g_op,
+                    self.model.loss_encoder_g,
+                    self.summary_fetch(self.model.sum_op_enc_g),
+                ],
                 feed_dict=feed_dict,
             )
+            feed_dict[self.model.reuse_batch] = True
             _, ldxx = self.sess.run(
                 [self.model.train_dis_op_xx, self.model.dis_loss_xx], feed_dict=feed_dict
             )
         else:
 
             _, le, sm_e = self.sess.run(
-                [self.model.train_enc_g_op, self.model.loss_encoder_g, self.model.sum_op_enc_g],
+                [
+                    self.model.train_enc_g_op,
+                    self.model.loss_encoder_g,
+                    self.summary_fetch(self.model.sum_op_enc_g),
+                ],
                 feed_dict=feed_dict,
             )
 
         return le, sm_e, ldxx
 
-    def train_step_enc_rec(self, image, cur_epoch):
-        image_eval = self.sess.run(image)
-        noise = np.random.normal(loc=0.0, scale=1.0, size=[self.batch_size, self.noise_dim])
+    def train_step_enc_rec(self, cur_epoch):
         feed_dict = {
-            self.model.image_input: image_eval,
-            self.model.noise_tensor: noise,
             self.model.is_training_gen: False,
             self.model.is_training_dis: False,
             self.model.is_training_enc_g: False,
@@ -249,16 +241,26 @@ class SENCEBGANTrainerFactor(BaseTrainSequential):
         }
         ldzz = 0
         if self.config.trainer.enable_disc_zz:
+            # The discriminator zz is trained on the batch of the encoder
             _, le, sm_e = self.sess.run(
-                [self.model.train_enc_r_op, self.model.loss_encoder_r, self.model.sum_op_enc_r],
+                [
+                    self.model.train_enc_r_op,
+                    self.model.loss_encoder_r,
+                    self.summary_fetch(self.model.sum_op_enc_r),
+                ],
                 feed_dict=feed_dict,
             )
+            feed_dict[self.model.reuse_batch] = True
             _, ldzz = self.sess.run(
                 [self.model.train_dis_op_zz, self.model.dis_loss_zz], feed_dict=feed_dict
             )
         else:
             _, le, sm_e = self.sess.run(
-                [self.model.train_enc_r_op, self.model.loss_encoder_r, self.model.sum_op_enc_r],
+                [
+                    self.model.train_enc_r_op,
+                    self.model.loss_encoder_r,
+                    self.summary_fetch(self.model.sum_op_enc_r),
+                ],
                 feed_dict=feed_dict,
             )
         return le, sm_e, ldzz
@@ -280,11 +282,11 @@ class SENCEBGANTrainerFactor(BaseTrainSequential):
             scores_final_6 = []
         inference_time = []
         true_labels = []
-        # Create the scores
-        test_loop = tqdm(range(self.config.data_loader.num_iter_per_test))
         cur_epoch = self.model.cur_epoch_tensor.eval(self.sess)
         factor_list = self.config.trainer.feature_match_weight_2
         for f in factor_list:
+            # Create the scores, every factor scores the whole test set once
+            test_loop = self.test_loop()
             scores_im1 = []
             scores_im2 = []
             scores_comb_im = []
@@ -296,17 +298,10 @@ class SENCEBGANTrainerFactor(BaseTrainSequential):
             true_labels = []
             for _ in test_loop:
                 test_batch_begin = time()
-                test_batch, test_labels = self.sess.run([self.data.test_image, self.data.test_label])
-                test_loop.refresh()  # to show immediately the update
-                sleep(0.01)
-                noise = np.random.normal(
-                    loc=0.0, scale=1.0, size=[self.config.data_loader.test_batch, self.noise_dim]
-                )
                 feature_match1 = f
                 feature_match2 = self.config.trainer.feature_match_weight
                 feed_dict = {
-                    self.model.image_input: test_batch,
-                    self.model.noise_tensor: noise,
+                    self.model.input_from_test: True,
                     self.model.is_training_gen: False,
                     self.model.is_training_dis: False,
                     self.model.is_training_enc_g: False,
@@ -314,27 +309,44 @@ class SENCEBGANTrainerFactor(BaseTrainSequential):
                     self.model.feature_match1 : feature_match1,
                     self.model.feature_match2 : feature_match2,
                 }
-                scores_im1 += self.sess.run(self.model.img_score_l1, feed_dict=feed_dict).tolist()
-                scores_im2 += self.sess.run(self.model.img_score_l2, feed_dict=feed_dict).tolist()
-                scores_comb_im += self.sess.run(self.model.score_comb_im, feed_dict=feed_dict).tolist()
-                scores_comb_z += self.sess.run(self.model.score_comb_z, feed_dict=feed_dict).tolist()
-                scores_final_1 += self.sess.run(self.model.final_score_1, feed_dict=feed_dict).tolist()
-                scores_final_2 += self.sess.run(self.model.final_score_2, feed_dict=feed_dict).tolist()
-                scores_final_3 += self.sess.run(self.model.final_score_3, feed_dict=feed_dict).tolist()
-                summaries += self.sess.run([self.model.sum_op_im_test], feed_dict=feed_dict)
+                # All the scores of the batch are computed by a single run
+                fetches = {
+                    "im1": self.model.img_score_l1,
+                    "im2": self.model.img_score_l2,
+                    "comb_im": self.model.score_comb_im,
+                    "comb_z": self.model.score_comb_z,
+                    "final_1": self.model.final_score_1,
+                    "final_2": self.model.final_score_2,
+                    "final_3": self.model.final_score_3,
+                    "summary": self.model.sum_op_im_test,
+                    "labels": self.model.input_label,
+                }
+                if self.config.trainer.enable_disc_xx:
+                    fetches["final_4"] = self.model.final_score_4
+                if self.config.trainer.enable_disc_zz:
+                    # fetches["final_5"] = self.model.final_score_5
+                    fetches["final_6"] = self.model.final_score_6
+                try:
+                    results = self.run_test(fetches, feed_dict)
+                except tf.errors.OutOfRangeError:
+                    break
+                scores_im1 += results["im1"].tolist()
+                scores_im2 += results["im2"].tolist()
+                scores_comb_im += results["comb_im"].tolist()
+                scores_comb_z += results["comb_z"].tolist()
+                scores_final_1 += results["final_1"].tolist()
+                scores_final_2 += results["final_2"].tolist()
+                scores_final_3 += results["final_3"].tolist()
+                summaries.append(results["summary"])
                 if self.config.trainer.enable_disc_xx:
-                    scores_final_4 += self.sess.run(
-                        self.model.final_score_4, feed_dict=feed_dict
-                    ).tolist()
+                    scores_final_4 += results["final_4"].tolist()
                 if self.config.trainer.enable_disc_zz:
-                    # scores_final_5 += self.sess.run(
-                    #     self.model.final_score_5, feed_dict=feed_dict
-                    # ).tolist()
-                    scores_final_6 += self.sess.run(
-                        self.model.final_score_6, feed_dict=feed_dict
-                    ).tolist()
+                    # scores_final_5 += results["final_5"].tolist()
+                    scores_final_6 += results["final_6"].tolist()
+                test_labels = results["labels"]
                 inference_time.append(time() - test_batch_begin)
                 true_labels += test_labels.tolist()
+            test_loop.close()
             self.summarizer.add_tensorboard(step=cur_epoch, summaries=summaries, summarizer="test")
             scores_im1 = np.asarray(scores_im1)
             scores_im2 = np.asarray(scores_im2)
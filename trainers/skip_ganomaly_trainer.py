@@ -1,7 +1,6 @@
 from base.base_train import BaseTrain
-from tqdm import tqdm
+import tensorflow as tf
 import numpy as np
-from time import sleep
 from time import time
 from utils.evaluations import save_results
 
@@ -14,8 +13,6 @@ class SkipGANomalyTrainer(BaseTrain):
         self.img_dims = self.config.trainer.image_dims
         # Inititalize the train Dataset Iterator
         self.sess.run(self.data.iterator.initializer)
-        # Initialize the test Dataset Iterator
-        self.sess.run(self.data.test_iterator.initializer)
         if self.config.data_loader.validation:
             self.sess.run(self.data.valid_iterator.initializer)
             self.best_valid_loss = 0
@@ -23,42 +20,32 @@ class SkipGANomalyTrainer(BaseTrain):
 
     def train_epoch(self):
         begin = time()
-        # Attach the epoch loop to a variable
-        loop = tqdm(range(self.config.data_loader.num_iter_per_epoch))
-        # Define the lists for summaries and losses
-        gen_losses = []
-        disc_losses = []
-        summaries = []
         # Get the current epoch counter
         cur_epoch = self.model.cur_epoch_tensor.eval(self.sess)
-        image = self.data.image
-        for _ in loop:
-            loop.set_description("Epoch:{}".format(cur_epoch + 1))
-            loop.refresh()  # to show immediately the update
-            sleep(0.01)
-            gen, dis, sum_g, sum_d = self.train_step(image, cur_epoch)
-            gen_losses.append(gen)
-            disc_losses.append(dis)
-            summaries.append(sum_g)
-            summaries.append(sum_d)
+
+        def step():
+            gen, dis, sum_g, sum_d = self.train_step(cur_epoch)
+            self.summarizer.write(sum_g)
+            self.summarizer.write(sum_d)
+            return {
+                "gen": gen,
+                "disc": dis,
+            }
+
+        losses = self.run_steps(step, "Epoch:{}".format(cur_epoch + 1))
         self.logger.info("Epoch {} terminated".format(cur_epoch))
-        self.summarizer.add_tensorboard(step=cur_epoch, summaries=summaries)
         # Check for reconstruction
         if cur_epoch % self.config.log.frequency_test == 0:
-            image_eval = self.sess.run(image)
             cur_epoch = self.model.cur_epoch_tensor.eval(self.sess)
-            real_noise, fake_noise = self.generate_noise(False, cur_epoch)
             feed_dict = {
-                self.model.image_input: image_eval,
-                self.model.real_noise: real_noise,
-                self.model.fake_noise: fake_noise,
+                self.model.instance_noise: False,
                 self.model.is_training: False,
             }
             reconstruction = self.sess.run(self.model.sum_op_im, feed_dict=feed_dict)
             self.summarizer.add_tensorboard(step=cur_epoch, summaries=[reconstruction])
         # Get the means of the loss values to display
-        gen_m = np.mean(gen_losses)
-        dis_m = np.mean(disc_losses)
+        gen_m = losses["gen"]
+        dis_m = losses["disc"]
         self.logger.info(
             "Epoch: {} | time = {} s | loss gen= {:4f} | loss dis = {:4f}".format(
                 cur_epoch, time() - begin, gen_m, dis_m
@@ -89,8 +76,8 @@ class SkipGANomalyTrainer(BaseTrain):
                 self.logger.info(
                     "Best model - valid loss = {:.4f} - saving...".format(self.best_valid_loss)
                 )
-                # Save the model state
-                self.model.save(self.sess)
+                # Keep the weights of the best model apart from the periodic checkpoints
+                self.model.save_best(self.sess, self.best_valid_loss)
                 self.nb_without_improvements = 0
             else:
                 self.nb_without_improvements += self.config.trainer.frequency_eval
@@ -110,20 +97,30 @@ class SkipGANomalyTrainer(BaseTrain):
         true_labels = []
         summaries = []
         # Create the scores
-        test_loop = tqdm(range(self.config.data_loader.num_iter_per_test))
+        test_loop = self.test_loop()
         cur_epoch = self.model.cur_epoch_tensor.eval(self.sess)
         for _ in test_loop:
             test_batch_begin = time()
-            test_batch, test_labels = self.sess.run([self.data.test_image, self.data.test_label])
-            test_loop.refresh()  # to show immediately the update
-            sleep(0.01)
 
-            feed_dict = {self.model.image_input: test_batch, self.model.is_training: False}
-            scores_1 += self.sess.run(self.model.anomaly_score_1, feed_dict=feed_dict).tolist()
-            scores_2 += self.sess.run(self.model.anomaly_score_2, feed_dict=feed_dict).tolist()
-            summaries += self.sess.run([self.model.sum_op_im_test], feed_dict=feed_dict)
+            feed_dict = {self.model.input_from_test: True, self.model.is_training: False}
+            try:
+                score_1, score_2, sm, test_labels = self.run_test(
+                    [
+                        self.model.anomaly_score_1,
+                        self.model.anomaly_score_2,
+                        self.model.sum_op_im_test,
+                        self.model.input_label,
+                    ],
+                    feed_dict,
+                )
+            except tf.errors.OutOfRangeError:
+                break
+            scores_1 += score_1.tolist()
+            scores_2 += score_2.tolist()
+            summaries.append(sm)
             inference_time.append(time() - test_batch_begin)
             true_labels += test_labels.tolist()
+        test_loop.close()
         true_labels = np.asarray(true_labels)
         inference_time = np.mean(inference_time)
         self.summarizer.add_tensorboard(step=cur_epoch, summaries=summaries, summarizer="test")
@@ -161,98 +158,37 @@ class SkipGANomalyTrainer(BaseTrain):
             percentile=percentiles,
         )
 
-    def train_step(self, image, cur_epoch):
+    def train_step(self, cur_epoch):
         """
                   implement the logic of the train step
                   - run the tensorflow session
                   - return any metrics you need to summarize
                 """
-        true_labels, generated_labels = self.generate_labels(
-            self.config.trainer.soft_labels, self.config.trainer.flip_labels
-        )
-        real_noise, fake_noise = self.generate_noise(self.config.trainer.include_noise, cur_epoch)
-        # Train the discriminator
-        image_eval = self.sess.run(image)
+        # Train the discriminator on the next batch of the iterator
         feed_dict = {
-            self.model.image_input: image_eval,
-            self.model.generated_labels: generated_labels,
-            self.model.true_labels: true_labels,
-            self.model.real_noise: real_noise,
-            self.model.fake_noise: fake_noise,
             self.model.is_training: True,
         }
         _, ld, sm_d = self.sess.run(
-            [self.model.train_dis_op, self.model.loss_discriminator, self.model.sum_op_dis],
+            [
+                self.model.train_dis_op,
+                self.model.loss_discriminator,
+                self.summary_fetch(self.model.sum_op_dis),
+            ],
             feed_dict=feed_dict,
         )
 
-        # Train Generator
-        true_labels, generated_labels = self.generate_labels(
-            self.config.trainer.soft_labels, self.config.trainer.flip_labels
-        )
-        real_noise, fake_noise = self.generate_noise(self.config.trainer.include_noise, cur_epoch)
+        # Train Generator on the same batch
         feed_dict = {
-            self.model.image_input: image_eval,
-            self.model.generated_labels: generated_labels,
-            self.model.true_labels: true_labels,
-            self.model.real_noise: real_noise,
-            self.model.fake_noise: fake_noise,
+            self.model.reuse_batch: True,
             self.model.is_training: True,
         }
         _, lg, sm_g = self.sess.run(
-            [self.model.train_gen_op, self.model.gen_loss_total, self.model.sum_op_gen],
+            [
+                self.model.train_gen_op,
+                self.model.gen_loss_total,
+                self.summary_fetch(self.model.sum_op_gen),
+            ],
             feed_dict=feed_dict,
         )
 
         return lg, ld, sm_g, sm_d
-
-    def generate_labels(self, soft_labels, flip_labels):
-
-        if not soft_labels:
-            true_labels = np.ones((self.config.data_loader.batch_size, 1))
-            generated_labels = np.zeros((self.config.data_loader.batch_size, 1))
-        else:
-            generated_labels = np.zeros(
-                (self.config.data_loader.batch_size, 1)
-            ) + np.random.uniform(low=0.0, high=0.1, size=[self.config.data_loader.batch_size, 1])
-            # flipped_idx = np.random.choice(
-            #    np.arange(len(generated_labels)),
-            #    size=int(self.config.trainer.noise_probability * len(generated_labels)),
-            # )
-            # generated_labels[flipped_idx] = 1 - generated_labels[flipped_idx]
-            true_labels = np.ones((self.config.data_loader.batch_size, 1)) - np.random.uniform(
-                low=0.0, high=0.1, size=[self.config.data_loader.batch_size, 1]
-            )
-            # flipped_idx = np.random.choice(
-            #     np.arange(len(true_labels)),
-            #     size=int(self.config.trainer.noise_probability * len(true_labels)),
-            # )
-            # true_labels[flipped_idx] = 1 - true_labels[flipped_idx]
-        if flip_labels:
-            return generated_labels, true_labels
-        else:
-            return true_labels, generated_labels
-
-    def generate_noise(self, include_noise, cur_epoch, mode=1):
-        sigma = max(1.25 * (10.0 - cur_epoch) / (10), 1)
-        real_noise = np.zeros(
-            ([self.config.data_loader.batch_size] + self.config.trainer.image_dims)
-        )
-        if include_noise:
-            # If we want to add this is will add the noises
-            fake_noise = np.random.normal(
-                scale=sigma,
-                size=[self.config.data_loader.batch_size] + self.config.trainer.image_dims,
-            )
-            if mode == 2:
-                real_noise = np.random.normal(
-                    scale=sigma,
-                    size=[self.config.data_loader.batch_size] + self.config.trainer.image_dims,
-                )
-
-        else:
-            # Otherwise we are just going to add zeros which will not break anything
-            fake_noise = np.zeros(
-                ([self.config.data_loader.batch_size] + self.config.trainer.image_dims)
-            )
-        return real_noise, fake_noise
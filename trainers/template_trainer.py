@@ -1,5 +1,4 @@
 from base.base_train import BaseTrain
-from tqdm import tqdm
 import numpy as np
 
 
@@ -10,7 +9,8 @@ class TemplateTrainer(BaseTrain):
     def train_epoch(self):
         """
        implement the logic of epoch:
-       -loop on the number of iterations in the config and call the train step
+       -loop on the number of iterations in the config with self.run_steps and a step
+        callback calling the train step
        -add any summaries you want using the summary
         """
         pass
@@ -1,15 +1,25 @@
+import hashlib
+import json
 import os
 import numpy as np
-from skimage import io
 import tensorflow as tf
 import matplotlib.pyplot as plt
-from PIL import Image
 from tqdm import tqdm
 
-from utils.utils import working_directory
 from utils.download_data import download_data_material
 from utils.dirs import listdir_nohidden
 from utils.logger import Logger
+from utils.patches import extract_patches, random_crops, pyramid_crops
+from utils.export import export_patches
+from utils.labels import label_threshold, cached_grid_labels
+from utils.patch_store import PatchStore, PatchStoreWriter
+from utils.tfrecords import RecordShards, RecordShardWriter
+from utils.image_cache import load_images
+from utils.ingest import ingest_archive, archive_sources
+from utils.splits import split_mask, cached_kfold_assignments
+from utils.shared_data import publish_arrays, attach_arrays, share_directory
+from utils.manifest import cached_file_digests, count_files, write_manifest, manifest_state
+from utils.manifest import FRESH, PARTIAL, STALE
 from shutil import rmtree
 from natsort import natsorted
 
@@ -47,15 +57,35 @@ class DataLoader:
         self.tag_location = os.path.join(self.data_dir, self.test, "labels/")
         self.tag_location_vis = os.path.join(self.data_dir, self.test_vis, "labels/")
         self.tag_location_vis_big = os.path.join(self.data_dir, self.test_vis_big, "labels/")
-        if not os.path.exists(self.data_dir):
-            self.logger.info("Dataset is not present. Download is started.")
-            download_data_material(self.data_dir)
+        # With the store format every split is kept as .npy shards under data_dir/store
+        self.use_store = self.config.data_loader.format == "store"
+        self.store_dir = os.path.join(self.data_dir, "store")
+        # With the tfrecord format every split is kept as TFRecord shards under data_dir/tfrecord
+        self.use_tfrecord = self.config.data_loader.format == "tfrecord"
+        self.record_dir = os.path.join(self.data_dir, "tfrecord")
+        # Both formats write the patches in shards instead of single jpeg files
+        self.use_shards = self.use_store or self.use_tfrecord
+        # Patch labels are derived once from the full masks and cached under data_dir/labels
+        self.label_dir = os.path.join(self.data_dir, "labels")
+        self.label_threshold = label_threshold(self.config)
+        # Aligned crops of every size of pyramid_sizes are cut once under data_dir/pyramid and
+        # shared by the runs of all these image sizes
+        self.pyramid_sizes = sorted(self.config.data_loader.pyramid_sizes or [])
+        self.pyramid_dir = os.path.join(self.data_dir, "pyramid")
+        if self.pyramid_sizes and self.image_size not in self.pyramid_sizes:
+            raise ValueError(
+                "image_size {} is not in pyramid_sizes {}".format(
+                    self.image_size, self.pyramid_sizes
+                )
+            )
+        # Decoded source images and file digests are cached under data_dir/cache
+        self.cache_dir = os.path.join(self.data_dir, "cache")
+        # With shared_memory (e.g. /dev/shm/material) the decoded images and the patch stores
+        # are published once there and every process maps the same pages
+        self.shared_dir = self.config.data_loader.shared_memory or None
         self.data_dir_normal = self.config.dirs.data_normal
         self.data_dir_anomalous = self.config.dirs.data_anomalous
-        # Up until this part only the raw dataset existence is checked and downloaded if not
         self.dataset_name = None
-        # this is to list all the folders
-        self.dir_names = listdir_nohidden(self.data_dir)
         self.test_size_per_img = (
             None
         )  # This will be the number of patches that will be extracted from each test image
@@ -64,17 +94,50 @@ class DataLoader:
         # Anormal images and the tag infor regarding the anomaly for test set
         anorm_imgs = self.data_dir_anomalous + "/images/"
         anorm_tag_imgs = self.data_dir_anomalous + "/gt/"
-        norm_img_names = [normal_imgs + x for x in listdir_nohidden(normal_imgs)]
-        anorm_img_names = [anorm_imgs + x for x in listdir_nohidden(anorm_imgs)]
-        anorm_tag_names = [anorm_tag_imgs + x for x in listdir_nohidden(anorm_tag_imgs)]
-        self.norm_img_array = self.create_image_array(norm_img_names, save=False)
-        self.anorm_img_array = self.create_image_array(anorm_img_names, save=False)
-        self.anorm_tag_array = self.create_image_array(anorm_tag_names, save=False)
+        if self.config.dirs.archive:
+            groups = self.archive_groups(normal_imgs, anorm_imgs, anorm_tag_imgs)
+            # The digests of the members are enough to attach the published images, the
+            # archive is only decoded when they are not published yet
+            if self.shared_dir:
+                self.set_archive_sources(
+                    archive_sources(
+                        self.config.dirs.archive,
+                        self.cache_dir,
+                        groups,
+                        checksum=self.config.dirs.archive_sha256 or None,
+                    )
+                )
+            if not self.attach_images():
+                # The images are decoded straight out of a local copy of the dataset zip
+                self.load_archive(groups)
+                self.publish_images()
+        else:
+            if not os.path.exists(self.data_dir):
+                self.logger.info("Dataset is not present. Download is started.")
+                download_data_material(self.data_dir)
+            # Up until this part only the raw dataset existence is checked and downloaded if not
+            norm_img_names = [normal_imgs + x for x in listdir_nohidden(normal_imgs)]
+            anorm_img_names = [anorm_imgs + x for x in listdir_nohidden(anorm_imgs)]
+            anorm_tag_names = [anorm_tag_imgs + x for x in listdir_nohidden(anorm_tag_imgs)]
+            # Digests of the source files, every derived split records the ones it comes from
+            self.norm_sources = self.source_digests(norm_img_names)
+            self.anorm_sources = self.source_digests(anorm_img_names + anorm_tag_names)
+            if not self.attach_images():
+                self.norm_img_array = self.create_image_array(norm_img_names, "normal")
+                self.anorm_img_array = self.create_image_array(anorm_img_names, "anomalous")
+                self.anorm_tag_array = self.create_image_array(anorm_tag_names, "ground_truth")
+                self.publish_images()
         self.image_tag_list = list(zip(self.anorm_img_array, self.anorm_tag_array))
+        # Random crops are sampled during training, the train split is not populated
+        with_train = self.config.data_loader.train_source != "random_crop"
         if not self.config.data_loader.validation:
-            self.populate_train_material()
+            if with_train:
+                self.populate_train_material()
         else:
-            self.populate_train_valid_material()
+            self.populate_train_valid_material(with_train)
+        # Dense test windows are cut inside the tf.data graph, nothing to populate
+        if self.config.data_loader.test_source == "dense":
+            return
         if self.config.data_loader.mode == "anomaly":
             self.populate_test_material()
         if self.config.data_loader.mode == "visualization":
@@ -90,238 +153,535 @@ class DataLoader:
 
     def populate_train_material(self):
         # Check if we have the data already
-        if self.train in self.dir_names:
+        if self.is_populated(self.train):
             self.logger.info("Train Dataset is already populated.")
         else:
             self.logger.info("Train Dataset will be populated")
-            size = self.config.data_loader.image_size
-            num_images = 10240
-            imgs = []
-            for ind, img in enumerate(self.norm_img_array):
-                h, w = img.shape[:2]
-                new_h, new_w = size, size
-                for idx in range(num_images):
-                    top = np.random.randint(0, h - new_h)
-                    left = np.random.randint(0, w - new_w)
-                    image = img[top : top + new_h, left : left + new_w]
-                    imgs.append(image)
-                self.logger.debug("{} images generated".format(num_images * (ind + 1)))
-            # Check if the folder is there
-            if not os.path.exists(self.train_dataset):
-                os.mkdir(self.train_dataset)
-            with working_directory(self.train_dataset):
-                for idx, img in enumerate(imgs):
-                    im = Image.fromarray(img)
-                    im.save("img_{}.jpg".format(str(idx)))
-
-    def populate_train_valid_material(self):
-        if self.train in self.dir_names and self.valid in self.dir_names:
+            resume = self.begin_split(self.train)
+            imgs, coords = self.train_crops()
+            self.logger.debug("{} images generated".format(len(imgs)))
+            if self.use_shards:
+                self.write_shards(self.train, imgs, coords=coords)
+            else:
+                self.export(imgs, self.train_dataset, "img_{idx}.jpg", skip_existing=resume)
+            self.end_split(self.train)
+
+    def populate_train_valid_material(self, with_train=True):
+        """
+        Args:
+            with_train: False to only populate the validation split, e.g. when the train
+                crops are sampled during training
+        """
+        splits = [self.train, self.valid] if with_train else [self.valid]
+        if all(self.is_populated(split) for split in splits):
             self.logger.info("Train and Validation datasets are already populated")
         else:
-            # Remove train dataset from the previous run
-            if os.path.exists(self.train_dataset):
-                rmtree(self.train_dataset)
             self.logger.info("Train and Validations Datasets will be populated")
-            size = self.config.data_loader.image_size
-            num_images = 10240
-            imgs = []
-            for ind, img in enumerate(self.norm_img_array):
-                h, w = img.shape[:2]
-                new_h, new_w = size, size
-                for idx in range(num_images):
-                    top = np.random.randint(0, h - new_h)
-                    left = np.random.randint(0, w - new_w)
-                    image = img[top : top + new_h, left : left + new_w]
-                    imgs.append(image)
-                self.logger.debug("{} images generated".format(num_images * (ind + 1)))
+            resume_train = with_train and self.begin_split(self.train)
+            resume_valid = self.begin_split(self.valid)
+            imgs, coords = self.train_crops()
+            self.logger.debug("{} images generated".format(len(imgs)))
             # Creation of validation dataset
-            np.random.seed(self.config.data_loader.random_seed)
-            validation_list = np.random.choice(51200, 5120)  # 10% of the training set
-            imgs_train = [x for ind, x in enumerate(imgs) if ind not in validation_list]
-            imgs_valid = [x for ind, x in enumerate(imgs) if ind in validation_list]
-            # Check if the folder is there
-            if not os.path.exists(self.train_dataset):
-                os.mkdir(self.train_dataset)
-            # Check if the folder is there
-            if not os.path.exists(self.valid_dataset):
-                os.mkdir(self.valid_dataset)
-            with working_directory(self.train_dataset):
-                for idx, img in enumerate(imgs_train):
-                    im = Image.fromarray(img)
-                    im.save("img_{}.jpg".format(str(idx)))
-            with working_directory(self.valid_dataset):
-                for idx, img in enumerate(imgs_valid):
-                    im = Image.fromarray(img)
-                    im.save("img_{}.jpg".format(str(idx)))
+            in_valid = self.validation_mask(coords)
+            if self.use_shards:
+                if with_train:
+                    self.write_shards(self.train, imgs[~in_valid], coords=coords[~in_valid])
+                self.write_shards(self.valid, imgs[in_valid], coords=coords[in_valid])
+            else:
+                if with_train:
+                    self.export(
+                        imgs[~in_valid],
+                        self.train_dataset,
+                        "img_{idx}.jpg",
+                        skip_existing=resume_train,
+                    )
+                self.export(
+                    imgs[in_valid], self.valid_dataset, "img_{idx}.jpg", skip_existing=resume_valid
+                )
+            for split in splits:
+                self.end_split(split)
 
     def populate_test_material(self):
-        if self.test in self.dir_names:
+        if self.is_populated(self.test):
             self.logger.info("Test Dataset is already populated")
         else:
             self.logger.info("Test Dataset will be populated")
+            resume = self.begin_split(self.test)
             size = self.config.data_loader.image_size
-            folder_name = self.test
-            first_level = os.path.join(self.data_dir, folder_name)
-            if not os.path.exists(first_level):
-                os.mkdir(first_level)
-            img_files = []
-            tag_files = []
-            for img_, tag_ in self.image_tag_list:
-                h, w = img_.shape[:2]
-                self.w_turns = (w // size) * 2 - 1
-                self.h_turns = (h // size) * 2 - 1
-                slide = int(size / 2)
-                for adv_h in range(self.h_turns):
-                    for adv_w in range(self.w_turns):
-                        image = img_[
-                            adv_h * slide : size + ((adv_h) * slide),
-                            adv_w * slide : ((adv_w) * slide) + size,
-                        ]
-                        tag = tag_[
-                            adv_h * slide : size + ((adv_h) * slide),
-                            adv_w * slide : ((adv_w) * slide) + size,
-                        ]
-                        img_files.append(image)
-                        tag_files.append(tag)
+            _, slide, turns = self.test_layout(self.test)
+            img_files, tag_files, coords = extract_patches(
+                self.anorm_img_array, self.anorm_tag_array, size, slide, turns
+            )
+            h, w = self.anorm_img_array[-1].shape[:2]
+            self.h_turns, self.w_turns = turns(h, w)
             self.test_size_per_img = self.w_turns * self.h_turns
-            if not os.path.exists(self.img_location):
-                os.mkdir(self.img_location)
-            with working_directory(self.img_location):
-                for idx, img in enumerate(img_files):
-                    im = Image.fromarray(img)
-                    im.save(
-                        "img_{}_{}.jpg".format(
-                            idx // self.test_size_per_img, idx % self.test_size_per_img
-                        )
-                    )
-            if not os.path.exists(self.tag_location):
-                os.mkdir(self.tag_location)
-            with working_directory(self.tag_location):
-                for idx, tag in enumerate(tag_files):
-                    im = Image.fromarray(tag)
-                    im.save(
-                        "label_{}_{}.jpg".format(
-                            idx // self.test_size_per_img, idx % self.test_size_per_img
-                        )
-                    )
+            if self.use_shards:
+                labels = self.test_labels(self.test)
+                self.write_shards(self.test, img_files, tag_files, coords, labels)
+            else:
+                self.export(
+                    img_files,
+                    self.img_location,
+                    "img_{img}_{pos}.jpg",
+                    self.test_size_per_img,
+                    skip_existing=resume,
+                )
+                self.export(
+                    tag_files,
+                    self.tag_location,
+                    "label_{img}_{pos}.jpg",
+                    self.test_size_per_img,
+                    skip_existing=resume,
+                )
+            self.end_split(self.test)
 
     def populate_test_material_vis(self):
-        if self.test_vis in self.dir_names:
+        if self.is_populated(self.test_vis):
             self.logger.info("Test Dataset is already populated")
         else:
             self.logger.info("Test Dataset will be populated")
+            resume = self.begin_split(self.test_vis)
             size = self.config.data_loader.image_size
-            folder_name = self.test_vis
-            first_level = os.path.join(self.data_dir, folder_name)
-            if not os.path.exists(first_level):
-                os.mkdir(first_level)
-            img_files = []
-            tag_files = []
-            for img_, tag_ in self.image_tag_list:
-                h, w = img_.shape[:2]
-                self.w_turns = (w // size)
-                self.h_turns = (h // size)
-                slide = int(size)
-                for adv_h in range(self.h_turns):
-                    for adv_w in range(self.w_turns):
-                        image = img_[
-                            adv_h * slide : size + ((adv_h) * slide),
-                            adv_w * slide : ((adv_w) * slide) + size,
-                        ]
-                        tag = tag_[
-                            adv_h * slide : size + ((adv_h) * slide),
-                            adv_w * slide : ((adv_w) * slide) + size,
-                        ]
-                        img_files.append(image)
-                        tag_files.append(tag)
+            _, slide, _ = self.test_layout(self.test_vis)
+            img_files, tag_files, coords = extract_patches(
+                self.anorm_img_array, self.anorm_tag_array, size, slide
+            )
+            h, w = self.anorm_img_array[-1].shape[:2]
+            self.w_turns = w // size
+            self.h_turns = h // size
             self.test_size_per_img = self.w_turns * self.h_turns
-            if not os.path.exists(self.img_location_vis):
-                os.mkdir(self.img_location_vis)
-            with working_directory(self.img_location_vis):
-                for idx, img in enumerate(img_files):
-                    im = Image.fromarray(img)
-                    im.save(
-                        "{}.jpg".format(
-                            idx
-                        )
-                    )
-            if not os.path.exists(self.tag_location_vis):
-                os.mkdir(self.tag_location_vis)
-            with working_directory(self.tag_location_vis):
-                for idx, tag in enumerate(tag_files):
-                    im = Image.fromarray(tag)
-                    im.save(
-                        "{}.jpg".format(
-                            idx
-                        )
-                    )
-                    
+            if self.use_shards:
+                labels = self.test_labels(self.test_vis)
+                self.write_shards(self.test_vis, img_files, tag_files, coords, labels)
+            else:
+                self.export(img_files, self.img_location_vis, "{idx}.jpg", skip_existing=resume)
+                self.export(tag_files, self.tag_location_vis, "{idx}.jpg", skip_existing=resume)
+            self.end_split(self.test_vis)
+
     def populate_test_material_vis_big(self):
-        if self.test_vis_big in self.dir_names:
+        if self.is_populated(self.test_vis_big):
             self.logger.info("Test Dataset is already populated")
         else:
             self.logger.info("Test Dataset will be populated")
+            resume = self.begin_split(self.test_vis_big)
             size = self.config.data_loader.image_size
-            folder_name = self.test_vis_big
-            first_level = os.path.join(self.data_dir, folder_name)
-            if not os.path.exists(first_level):
-                os.mkdir(first_level)
-            img_files = []
-            tag_files = []
-            #index_list = [0,6,7,8,9,10,11,15]
-            index_list = [0,6,7,8,9,10,11,15]
-            image_tags = [self.image_tag_list[i] for i in index_list]
-            for img_, tag_ in image_tags:
-                h, w = img_.shape[:2]
-                self.w_turns = w - size + 1
-                self.h_turns = h - size + 1
-                slide = 1
-                for adv_h in range(self.h_turns):
-                    for adv_w in range(self.w_turns):
-                        image = img_[
-                            adv_h * slide : size + ((adv_h) * slide),
-                            adv_w * slide : ((adv_w) * slide) + size,
-                        ]
-                        tag = tag_[
-                            adv_h * slide : size + ((adv_h) * slide),
-                            adv_w * slide : ((adv_w) * slide) + size,
-                        ]
-                        img_files.append(image)
-                        tag_files.append(tag)
+            index_list, slide, _ = self.test_layout(self.test_vis_big)
+            h, w = self.anorm_img_array[index_list[-1]].shape[:2]
+            self.w_turns = w - size + 1
+            self.h_turns = h - size + 1
             self.test_size_per_img = self.w_turns * self.h_turns
-            if not os.path.exists(self.img_location_vis_big):
-                os.mkdir(self.img_location_vis_big)
-            with working_directory(self.img_location_vis_big):
-                for idx, img in enumerate(img_files):
-                    im = Image.fromarray(img)
-                    im.save(
-                        "{}.jpg".format(
-                            idx
-                        )
+            labels = self.test_labels(self.test_vis_big)
+            writer = self.shard_writer(self.test_vis_big) if self.use_shards else None
+            # One image at a time, the stride 1 grid of all images does not fit in memory
+            offset = 0
+            for i in index_list:
+                img_files, tag_files, coords = extract_patches(
+                    [self.anorm_img_array[i]], [self.anorm_tag_array[i]], size, slide
+                )
+                end = offset + len(img_files)
+                if self.use_shards:
+                    coords[:, 0] = i
+                    writer.append(img_files, tag_files, labels[offset:end], coords)
+                else:
+                    # The file names keep counting across images
+                    self.export(
+                        img_files,
+                        self.img_location_vis_big,
+                        "{idx}.jpg",
+                        offset=offset,
+                        skip_existing=resume,
                     )
-            if not os.path.exists(self.tag_location_vis_big):
-                os.mkdir(self.tag_location_vis_big)
-            with working_directory(self.tag_location_vis_big):
-                for idx, tag in enumerate(tag_files):
-                    im = Image.fromarray(tag)
-                    im.save(
-                        "{}.jpg".format(
-                            idx
-                        )
+                    self.export(
+                        tag_files,
+                        self.tag_location_vis_big,
+                        "{idx}.jpg",
+                        offset=offset,
+                        skip_existing=resume,
                     )
+                offset = end
+            if self.use_shards:
+                writer.close()
+            self.end_split(self.test_vis_big)
+
+    def train_crops(self):
+        """
+        Random crops of the normal images the train and validation splits are made of. With
+        pyramid_sizes they are read from the level of image_size of the shared pyramid.
+        Returns:
+            crops: uint8 array of shape (N, image_size, image_size)
+            coords: (image, top, left) of every crop
+        """
+        if not self.pyramid_sizes:
+            return random_crops(self.norm_img_array, self.image_size, 10240, self.crop_rng())
+        self.populate_pyramid()
+        level = self.get_pyramid()[self.image_size]
+        return np.concatenate(level.images), level.coords
+
+    def pyramid_inputs(self):
+        """
+        Returns:
+            sources and params of the pyramid, image_size is not part of them
+        """
+        params = {
+            "sizes": self.pyramid_sizes,
+            "scale": bool(self.config.data_loader.pyramid_scale),
+            "random_seed": self.config.data_loader.random_seed,
+            "crops_per_image": 10240,
+        }
+        return self.norm_sources, params
+
+    def populate_pyramid(self):
+        """
+        Cuts the aligned crops of all the pyramid sizes from a single pass over the decoded
+        normal images, every level is written as a patch store.
+        """
+        sources, params = self.pyramid_inputs()
+        if manifest_state(self.pyramid_dir, sources, params) == FRESH:
+            self.logger.info("Patch pyramid is already populated")
+            return
+        if os.path.exists(self.pyramid_dir):
+            rmtree(self.pyramid_dir)
+        write_manifest(self.pyramid_dir, "partial", sources, params)
+        crops, coords = pyramid_crops(
+            self.norm_img_array, self.pyramid_sizes, 10240, self.crop_rng(), params["scale"]
+        )
+        for size in self.pyramid_sizes:
+            writer = PatchStoreWriter(os.path.join(self.pyramid_dir, "level_{}".format(size)))
+            writer.append(crops[size], coords=coords[size])
+            writer.close()
+        write_manifest(
+            self.pyramid_dir, "complete", sources, params, count_files(self.pyramid_dir)
+        )
+        self.logger.info(
+            "Patch pyramid of sizes {} is populated with {} crops per level".format(
+                self.pyramid_sizes, len(coords[self.pyramid_sizes[0]])
+            )
+        )
+
+    def get_pyramid(self):
+        """
+        :return: dict size -> PatchStore of the aligned crops of that size, the crops with
+            the same index in the levels share their center
+        """
+        return {
+            size: PatchStore(os.path.join(self.pyramid_dir, "level_{}".format(size)))
+            for size in self.pyramid_sizes
+        }
+
+    def validation_mask(self, coords):
+        """
+        Selects the validation crops. With validation_folds set, the crops are assigned to
+        k folds that are cached in data_dir/splits and validation_fold is held out, otherwise
+        exactly validation_percent of the crops are held out. validation_group_by_image keeps
+        all the crops of a source image on the same side.
+        Args:
+            coords: (image, top, left) of every crop
+        Returns:
+            boolean mask, True for the validation crops
+        """
+        seed = self.config.data_loader.random_seed
+        groups = coords[:, 0] if self.config.data_loader.validation_group_by_image else None
+        if self.config.data_loader.validation_folds:
+            folds = cached_kfold_assignments(
+                os.path.join(self.data_dir, "splits"),
+                len(coords),
+                self.config.data_loader.validation_folds,
+                seed,
+                groups,
+            )
+            in_valid = folds == (self.config.data_loader.validation_fold or 0)
+        else:
+            fraction = self.config.data_loader.validation_percent / 100
+            in_valid = split_mask(len(coords), fraction, seed, groups)
+        self.logger.info(
+            "{} crops for training, {} for validation".format(
+                len(in_valid) - in_valid.sum(), in_valid.sum()
+            )
+        )
+        return in_valid
+
+    def archive_groups(self, normal_imgs, anorm_imgs, anorm_tag_imgs):
+        """
+        The folders of the config are looked up inside dirs.archive relative to dirs.data
+        """
+        return {
+            "normal": os.path.relpath(normal_imgs, self.data_dir),
+            "anomalous": os.path.relpath(anorm_imgs, self.data_dir),
+            "ground_truth": os.path.relpath(anorm_tag_imgs, self.data_dir),
+        }
+
+    def set_archive_sources(self, sources):
+        """
+        Args:
+            sources: dict group name -> digests of its members
+        """
+        self.norm_sources = sources["normal"]
+        self.anorm_sources = dict(sources["anomalous"], **sources["ground_truth"])
 
-    def create_image_array(self, img_names, save=True, file_name="Dataset"):
+    def load_archive(self, groups):
         """
+        Fills the image arrays and the source digests from dirs.archive
         Args:
-            img_names:
-        """
-        self.dataset_name = os.path.join(self.data_dir, file_name)
-        img_array = []
-        for img in img_names:
-            im2arr = io.imread(img)
-            img_array.append(im2arr)
-        if save:
-            np.save(self.dataset_name, img_array)
+            groups: folders of the groups inside the archive, see archive_groups
+        """
+        ingested = ingest_archive(
+            self.config.dirs.archive,
+            self.cache_dir,
+            groups,
+            self.logger,
+            checksum=self.config.dirs.archive_sha256 or None,
+        )
+        self.set_archive_sources({group: ingested[group][1] for group in ingested})
+        self.norm_img_array = np.array(ingested["normal"][0])
+        self.anorm_img_array = np.array(ingested["anomalous"][0])
+        self.anorm_tag_array = np.array(ingested["ground_truth"][0])
+
+    def shared_key(self):
+        inputs = json.dumps([self.norm_sources, self.anorm_sources], sort_keys=True)
+        return hashlib.sha1(inputs.encode()).hexdigest()[:16]
+
+    def attach_images(self):
+        """
+        Attaches the decoded images published in shared_memory, read only and without copy
+        Returns:
+            True if the images of the current sources were published
+        """
+        if not self.shared_dir:
+            return False
+        arrays = attach_arrays(os.path.join(self.shared_dir, "images"), self.shared_key())
+        if arrays is None:
+            return False
+        self.norm_img_array = arrays["normal"]
+        self.anorm_img_array = arrays["anomalous"]
+        self.anorm_tag_array = arrays["ground_truth"]
+        self.logger.info("Decoded images are attached from {}".format(self.shared_dir))
+        return True
+
+    def publish_images(self):
+        """
+        Publishes the decoded images in shared_memory, the process then uses the shared views
+        like the ones that attach later
+        """
+        if not self.shared_dir:
+            return
+        arrays = {
+            "normal": self.norm_img_array,
+            "anomalous": self.anorm_img_array,
+            "ground_truth": self.anorm_tag_array,
+        }
+        publish_arrays(os.path.join(self.shared_dir, "images"), self.shared_key(), arrays)
+        self.logger.info("Decoded images are published in {}".format(self.shared_dir))
+        self.attach_images()
+
+    def source_digests(self, file_names):
+        digests = cached_file_digests(file_names, os.path.join(self.cache_dir, "digests.json"))
+        return {os.path.relpath(x, self.data_dir): h for x, h in zip(file_names, digests)}
+
+    def crop_rng(self):
+        # Seeded so that an interrupted population resumes with the same crops
+        return np.random.RandomState(self.config.data_loader.random_seed)
+
+    def split_dir(self, split):
+        if self.use_tfrecord:
+            return os.path.join(self.record_dir, split)
+        return os.path.join(self.store_dir if self.use_store else self.data_dir, split)
+
+    def split_inputs(self, split):
+        """
+        Returns:
+            sources: digests of the source files the split is derived from
+            params: every parameter that changes the content of the split
+        """
+        params = {
+            "split": split,
+            "format": self.config.data_loader.format if self.use_shards else "jpeg",
+            "image_size": self.image_size,
+        }
+        if self.use_tfrecord:
+            params["standardized"] = self.standardize_records(split)
+        if split in (self.train, self.valid):
+            params.update(
+                {
+                    "random_seed": self.config.data_loader.random_seed,
+                    "crops_per_image": 10240,
+                    "validation": bool(self.config.data_loader.validation),
+                    "validation_percent": self.config.data_loader.validation_percent,
+                    "validation_group_by_image": bool(
+                        self.config.data_loader.validation_group_by_image
+                    ),
+                    "validation_folds": self.config.data_loader.validation_folds or 0,
+                    "validation_fold": self.config.data_loader.validation_fold or 0,
+                }
+            )
+            if self.pyramid_sizes:
+                params["pyramid"] = self.pyramid_inputs()[1]
+            return self.norm_sources, params
+        index_list, stride, _ = self.test_layout(split)
+        params.update(
+            {"index_list": index_list, "stride": stride, "label_threshold": self.label_threshold}
+        )
+        return self.anorm_sources, params
+
+    def is_populated(self, split):
+        sources, params = self.split_inputs(split)
+        return manifest_state(self.split_dir(split), sources, params) == FRESH
+
+    def begin_split(self, split):
+        """
+        Marks the split as partial before anything is written. Stale outputs are removed.
+        Returns:
+            True if an interrupted split with the same inputs is resumed
+        """
+        directory = self.split_dir(split)
+        sources, params = self.split_inputs(split)
+        state = manifest_state(directory, sources, params)
+        if state == STALE and os.path.exists(directory):
+            self.logger.info("{} is stale and will be regenerated".format(split))
+            rmtree(directory)
+        elif state == PARTIAL:
+            self.logger.info("{} was not completed, population is resumed".format(split))
+        write_manifest(directory, "partial", sources, params)
+        return state == PARTIAL
+
+    def end_split(self, split):
+        directory = self.split_dir(split)
+        sources, params = self.split_inputs(split)
+        write_manifest(directory, "complete", sources, params, count_files(directory))
+
+    def cache_key(self, split, contents=None):
+        """
+        Short hash of the inputs of the split, a cache of its patches is only valid for them
+        Args:
+            split: name of the split
+            contents: optional description of what the cache holds, e.g. the dtypes and the
+                normalization of the cached elements, a cache is only valid for it too
+        """
+        sources, params = self.split_inputs(split)
+        inputs = json.dumps([sources, params, contents], sort_keys=True)
+        return hashlib.sha1(inputs.encode()).hexdigest()[:16]
+
+    def split_size(self, split):
+        """
+        :param split: name of the split
+        :return: number of patches of the split
+        """
+        if self.use_store:
+            return len(PatchStore(self.split_dir(split)))
+        if self.use_tfrecord:
+            return len(RecordShards(self.split_dir(split)))
+        folders = {
+            self.train: self.train_dataset,
+            self.valid: self.valid_dataset,
+            self.test: self.img_location,
+            self.test_vis: self.img_location_vis,
+            self.test_vis_big: self.img_location_vis_big,
+        }
+        return len(listdir_nohidden(folders[split]))
+
+    def test_layout(self, split):
+        """
+        Describes how the anomalous images are cut for a test split
+        Args:
+            split: self.test, self.test_vis or self.test_vis_big
+        Returns:
+            index_list: indices of the anomalous images in the split
+            stride: step between two consecutive patches
+            turns: function (h, w) -> (h_turns, w_turns) or None for every full window
+        """
+        size = self.image_size
+        if split == self.test:
+            return (
+                list(range(len(self.anorm_img_array))),
+                int(size / 2),
+                lambda h, w: ((h // size) * 2 - 1, (w // size) * 2 - 1),
+            )
+        if split == self.test_vis:
+            return list(range(len(self.anorm_img_array))), int(size), None
+        #index_list = [0,6,7,8,9,10,11,15]
+        return [0, 6, 7, 8, 9, 10, 11, 15], 1, None
+
+    def test_labels(self, split):
+        """
+        Labels of the patches of a test split in extraction order. They are computed from
+        the full ground truth masks and cached, keyed by the masks fingerprint and threshold.
+        """
+        index_list, stride, turns = self.test_layout(split)
+        return cached_grid_labels(
+            self.label_dir,
+            split,
+            [self.anorm_tag_array[i] for i in index_list],
+            self.image_size,
+            stride,
+            self.label_threshold,
+            turns,
+            key=tuple(index_list),
+        )
+
+    def export(self, patches, directory, name_format, per_img=1, offset=0, skip_existing=False):
+        """
+        Writes the patches as jpeg files with a pool of export_workers processes
+        """
+        export_patches(
+            patches,
+            directory,
+            name_format,
+            self.logger,
+            per_img=per_img,
+            offset=offset,
+            skip_existing=skip_existing,
+            num_workers=self.config.data_loader.export_workers or None,
+        )
+
+    def standardize_records(self, split):
+        """
+        Records of the train, validation and test splits can hold standardized patches, the
+        visualization splits are normalized differently and always keep the raw ones.
+        """
+        standardized = self.config.data_loader.tfrecord_standardized
+        return bool(standardized) and split in (self.train, self.valid, self.test)
+
+    def shard_writer(self, split):
+        """
+        Returns:
+            RecordShardWriter with the tfrecord format, PatchStoreWriter otherwise
+        """
+        if self.use_tfrecord:
+            return RecordShardWriter(
+                os.path.join(self.record_dir, split), standardize=self.standardize_records(split)
+            )
+        return PatchStoreWriter(os.path.join(self.store_dir, split))
+
+    def write_shards(self, split, imgs, tags=None, coords=None, labels=None):
+        """
+        Args:
+            split: name of the split, e.g. self.train
+            imgs: uint8 patches
+            tags: ground truth patches
+            coords: (image, row, col) of every patch
+            labels: 0/1 label of every patch
+        """
+        writer = self.shard_writer(split)
+        writer.append(imgs, tags, labels, coords)
+        writer.close()
+        self.logger.info(
+            "{} patches of {} are written as {} shards".format(
+                len(imgs), split, self.config.data_loader.format
+            )
+        )
+
+    def create_image_array(self, img_names, file_name="Dataset"):
+        """
+        Args:
+            img_names: paths of the source images
+            file_name: name of the .npz cache of the decoded images in data_dir/cache
+        """
+        self.dataset_name = os.path.join(self.cache_dir, "{}.npz".format(file_name))
+        img_array = load_images(
+            img_names,
+            self.dataset_name,
+            num_workers=self.config.data_loader.decode_workers or None,
+            logger=self.logger,
+        )
         return np.array(img_array)
 
     def get_train_dataset(self):
@@ -340,7 +700,7 @@ class DataLoader:
         :return: numpy array of images and corresponding labels
         """
         img_list = listdir_nohidden(self.valid_dataset)
-        img_names = tf.constant([os.path.join(self.train_dataset, x) for x in img_list])
+        img_names = tf.constant([os.path.join(self.valid_dataset, x) for x in img_list])
         self.logger.info("Validation Dataset is Loaded")
         return img_names
 
@@ -351,13 +711,13 @@ class DataLoader:
         """
         img_list = listdir_nohidden(self.img_location)
         img_names = tf.constant([os.path.join(self.img_location, x) for x in img_list])
-        tag_list = listdir_nohidden(self.tag_location)
-        tag_list_merged = [os.path.join(self.tag_location, x) for x in tag_list]
-        labels = []
-        for label in tag_list_merged:
-            im2arr = io.imread(label)
-            labels.append(1) if np.sum(im2arr) > 5100 else labels.append(0)
-        labels_f = tf.constant(labels)
+        # Files are named img_{image}_{position}, map them back to the extraction order
+        _, _, turns = self.test_layout(self.test)
+        h_turns, w_turns = turns(*self.anorm_img_array[-1].shape[:2])
+        grid_labels = self.test_labels(self.test)
+        positions = [x[len("img_") : -len(".jpg")].split("_") for x in img_list]
+        order = [int(i) * h_turns * w_turns + int(j) for i, j in positions]
+        labels_f = tf.constant(grid_labels[order])
         self.logger.info("Test Dataset is Loaded")
         return [img_names, labels_f]
 
@@ -372,11 +732,8 @@ class DataLoader:
         tag_list = listdir_nohidden(self.tag_location_vis)
         tag_list = natsorted(tag_list)
         tag_list_merged = [os.path.join(self.tag_location_vis, x) for x in tag_list]
-        labels = []
-        for label in tag_list_merged:
-            im2arr = io.imread(label)
-            labels.append(1) if np.sum(im2arr) > 5100 else labels.append(0)
-        labels_f = tf.constant(labels)
+        # Files are named after their index in the extraction order
+        labels_f = tf.constant(self.test_labels(self.test_vis))
         self.logger.info("Test Dataset is Loaded")
         return [img_names, labels_f, tag_list_merged]
     
@@ -393,10 +750,34 @@ class DataLoader:
         tag_list = natsorted(tag_list)
         #tag_list = tag_list[660345:660345* 2]
         tag_list_merged = [os.path.join(self.tag_location_vis_big, x) for x in tag_list]
-        labels = []
-        for label in tag_list_merged:
-            im2arr = io.imread(label)
-            labels.append(1) if np.sum(im2arr) > 5100 else labels.append(0)
-        labels_f = tf.constant(labels)
+        labels_f = tf.constant(self.test_labels(self.test_vis_big))
         self.logger.info("Test Dataset is Loaded")
         return [img_names, labels_f, tag_list_merged]
+
+    def get_store(self, split):
+        """
+        :param split: name of the split
+        :return: PatchStore with the memory mapped patches of the split
+        """
+        directory = os.path.join(self.store_dir, split)
+        if self.shared_dir:
+            # The shards are copied once, the processes map the shared copy
+            directory = share_directory(
+                directory, os.path.join(self.shared_dir, "store", split), self.cache_key(split)
+            )
+        store = PatchStore(directory)
+        self.logger.info("{} Store is Loaded with {} patches".format(split, len(store)))
+        return store
+
+    def get_records(self, split):
+        """
+        :param split: name of the split
+        :return: RecordShards with the TFRecord files of the split
+        """
+        records = RecordShards(os.path.join(self.record_dir, split))
+        self.logger.info(
+            "{} TFRecords are Loaded with {} patches in {} shards".format(
+                split, len(records), len(records.files)
+            )
+        )
+        return records
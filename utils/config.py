@@ -2,6 +2,45 @@ import json
 from dotmap import DotMap
 import os
 
+# Keys the configs may leave out, a missing key takes the value given here
+DEFAULTS = {
+    "data_loader": {
+        "anomaly_fraction": None,
+        "augment_rot90": False,
+        "cache": None,
+        "decode_workers": 0,
+        "dense_band_windows": 16384,
+        "export_workers": 0,
+        "format": "jpeg",
+        "pipeline_tuning": False,
+        "prefetch_memory_mb": 128,
+        "pyramid_scale": False,
+        "pyramid_sizes": None,
+        "shared_memory": None,
+        "shuffle_memory_mb": 256,
+        "store_block_size": 1024,
+        "test_source": "populated",
+        "test_stride": None,
+        "tfrecord_standardized": False,
+        "train_source": "populated",
+        "uint8_pipeline": False,
+        "validation_fold": 0,
+        "validation_folds": 0,
+        "validation_group_by_image": False,
+    },
+    "dirs": {"archive": None, "archive_sha256": None},
+    "log": {"restore_phase": None, "save_epochs": 1, "save_minutes": None, "summary_steps": 100},
+    "trainer": {
+        "benchmark_steps": 50,
+        "fused_steps": None,
+        "inter_op_threads": None,
+        "intra_op_threads": None,
+        "progress_interval": 10,
+        "replicas": 1,
+        "scale_batch": True,
+    },
+}
+
 
 def get_config_from_json(json_file):
     """
@@ -36,6 +75,20 @@ def create_parameter_file(config: object) -> None:
 
 
 def process_config(config) -> object:
+    # Keys set in the json, even to null, are kept
+    for section, defaults in DEFAULTS.items():
+        for key, value in defaults.items():
+            if key not in config[section].keys():
+                config[section][key] = value
+
+    # The replicas of the data parallel training share a batch, it grows with them. An epoch
+    # takes fewer steps so that it still covers the same number of images
+    replicas = config.trainer.replicas or 1
+    if replicas > 1 and config.trainer.scale_batch:
+        config.data_loader.batch_size *= replicas
+        config.data_loader.num_iter_per_epoch = max(
+            config.data_loader.num_iter_per_epoch // replicas, 1
+        )
 
     config.log.summary_dir = os.path.join(config.log.output_folder, config.exp.name, "summary/")
     config.log.checkpoint_dir = os.path.join(
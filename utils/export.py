@@ -0,0 +1,90 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from time import time
+
+from PIL import Image
+
+
+def _save_chunk(patches, directory, name_format, start, per_img, skip_existing):
+    """
+    Encodes and writes a chunk of patches, runs inside a worker process. Every file is
+    written under a hidden name and renamed, so an interrupted export never leaves a
+    truncated file under the final name.
+    """
+    for offset, patch in enumerate(patches):
+        idx = start + offset
+        name = name_format.format(idx=idx, img=idx // per_img, pos=idx % per_img)
+        path = os.path.join(directory, name)
+        if skip_existing and os.path.exists(path):
+            continue
+        partial = os.path.join(os.path.dirname(path), "." + os.path.basename(path))
+        Image.fromarray(patch).save(partial)
+        os.replace(partial, path)
+    return len(patches)
+
+
+def export_patches(
+    patches,
+    directory,
+    name_format,
+    logger,
+    per_img=1,
+    offset=0,
+    skip_existing=False,
+    num_workers=None,
+    chunk_size=2048,
+    log_interval=10,
+):
+    """
+    Writes every patch as an image file using all the cores.
+    Args:
+        patches: uint8 array of patches
+        directory: destination folder, it is created if missing
+        name_format: file name with {idx}, {img} and {pos} fields, e.g. "img_{img}_{pos}.jpg"
+        logger: logger used for the progress report
+        per_img: number of patches per source image, used by {img} and {pos}
+        offset: index of the first patch, to export a split in several calls
+        skip_existing: do not rewrite the files already present, to resume an interrupted export
+        num_workers: number of processes, all the cores by default
+        chunk_size: number of patches encoded by a worker in one task
+        log_interval: seconds between two progress reports
+    """
+    directory = os.path.abspath(directory)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    num_workers = num_workers or os.cpu_count()
+    total = len(patches)
+    done = 0
+    begin = last_log = time()
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        pending = set()
+        for start in range(0, total, chunk_size):
+            # Keep a bounded number of chunks in flight so the patches are not all pickled at once
+            if len(pending) >= 2 * num_workers:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                done += sum(f.result() for f in finished)
+            pending.add(
+                pool.submit(
+                    _save_chunk,
+                    patches[start : start + chunk_size],
+                    directory,
+                    name_format,
+                    offset + start,
+                    per_img,
+                    skip_existing,
+                )
+            )
+            if time() - last_log > log_interval:
+                last_log = time()
+                logger.info(
+                    "{}/{} patches exported to {} ({:.0f} patches/s)".format(
+                        done, total, directory, done / (last_log - begin)
+                    )
+                )
+        done += sum(f.result() for f in wait(pending).done)
+    elapsed = time() - begin
+    logger.info(
+        "{} patches exported to {} in {:.1f} s ({:.0f} patches/s)".format(
+            done, directory, elapsed, done / max(elapsed, 1e-6)
+        )
+    )
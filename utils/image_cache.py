@@ -0,0 +1,48 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from skimage import io
+
+from utils.manifest import file_key
+
+
+def decode_images(img_names, num_workers=None):
+    """
+    Decodes the images with a pool of threads, the decoders release the GIL.
+    """
+    with ThreadPoolExecutor(max_workers=num_workers or os.cpu_count()) as pool:
+        return list(pool.map(io.imread, img_names))
+
+
+def load_images(img_names, cache_file, num_workers=None, logger=None):
+    """
+    Decoded images, read from a single .npz cache when none of the source files changed.
+    Args:
+        img_names: paths of the source images
+        cache_file: path of the .npz cache
+        num_workers: decoding threads, all the cores by default
+        logger: optional logger
+    Returns:
+        list of decoded images in the order of img_names
+    """
+    key = json.dumps([file_key(x) for x in img_names])
+    if os.path.exists(cache_file):
+        with np.load(cache_file) as cache:
+            if str(cache["key"]) == key:
+                if logger:
+                    logger.info("Decoded images are loaded from {}".format(cache_file))
+                return [cache["img_{}".format(i)] for i in range(len(img_names))]
+    images = decode_images(img_names, num_workers)
+    cache_dir = os.path.dirname(cache_file)
+    if cache_dir and not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    arrays = {"img_{}".format(i): img for i, img in enumerate(images)}
+    # Write then rename so that an interrupted run never leaves a truncated cache
+    tmp_file = cache_file + ".tmp.npz"
+    np.savez(tmp_file, key=np.array(key), **arrays)
+    os.replace(tmp_file, cache_file)
+    if logger:
+        logger.info("{} images decoded and cached in {}".format(len(images), cache_file))
+    return images
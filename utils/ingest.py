@@ -0,0 +1,151 @@
+import hashlib
+import io
+import json
+import os
+from zipfile import ZipFile
+
+import numpy as np
+from PIL import Image
+
+STATE_FILE = "ingest_state.json"
+
+
+def archive_digest(path, block_size=2 ** 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _archive_stat(path):
+    """
+    Size and modification time of the archive, a copy whose stat is unchanged is not hashed
+    again
+    """
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _group_members(zip_file, folder):
+    """
+    Members of the archive that are directly inside folder, possibly below a top level
+    folder of the archive, sorted like listdir_nohidden.
+    """
+    members = []
+    for info in zip_file.infolist():
+        name = info.filename
+        if info.is_dir() or "__MACOSX" in name:
+            continue
+        base = os.path.basename(name)
+        directory = os.path.dirname(name).rstrip("/")
+        if base.startswith(".") or not (directory == folder or directory.endswith("/" + folder)):
+            continue
+        members.append(info)
+    return sorted(members, key=lambda x: os.path.basename(x.filename).lower())
+
+
+def _read_state(cache_dir):
+    path = os.path.join(cache_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _write_state(cache_dir, state):
+    path = os.path.join(cache_dir, STATE_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def _checked_state(archive, cache_dir, checksum):
+    """
+    State of the ingestion of the archive, reset when the archive changed. Raises a
+    ValueError when the sha256 of the archive is not checksum.
+    """
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    stat = _archive_stat(archive)
+    state = _read_state(cache_dir)
+    if state is not None and state.get("archive_stat") == stat:
+        digest = state["archive"]
+    else:
+        digest = archive_digest(archive)
+    if checksum and digest != checksum:
+        raise ValueError("Checksum of {} is {}, expected {}".format(archive, digest, checksum))
+    if state is None or state["archive"] != digest:
+        state = {"archive": digest, "groups": {}}
+    if state.get("archive_stat") != stat:
+        state["archive_stat"] = stat
+        _write_state(cache_dir, state)
+    return state
+
+
+def archive_sources(archive, cache_dir, groups, checksum=None):
+    """
+    Digests of the members of every group without decoding any image. They are read from
+    the ingestion state, the members of the groups that are not ingested yet are hashed.
+    Args:
+        same as ingest_archive
+    Returns:
+        dict group name -> dict member name -> sha1 of its bytes
+    """
+    state = _checked_state(archive, cache_dir, checksum)
+    result = {group: state["groups"][group] for group in groups if group in state["groups"]}
+    if len(result) < len(groups):
+        with ZipFile(archive, "r") as zip_file:
+            for group, folder in groups.items():
+                if group in result:
+                    continue
+                sources = {}
+                for info in _group_members(zip_file, folder):
+                    with zip_file.open(info) as member:
+                        sources[info.filename] = hashlib.sha1(member.read()).hexdigest()
+                result[group] = sources
+    return result
+
+
+def ingest_archive(archive, cache_dir, groups, logger, checksum=None):
+    """
+    Streams the images out of the dataset zip, decodes them in memory and writes one
+    full-image shard per group, no file is extracted. Completed groups are recorded in
+    cache_dir/ingest_state.json so that an interrupted ingestion resumes where it stopped.
+    The state also holds the sha256 of the archive with its size and modification time,
+    the archive is only hashed again when they change.
+    Args:
+        archive: path of the local copy of the dataset zip
+        cache_dir: folder of the full-image shards
+        groups: dict group name -> folder of the group inside the archive, e.g.
+            {"normal": "Normal", "anomalous": "Anomalous/images"}
+        logger: logger of the caller
+        checksum: expected sha256 of the archive, not checked when None
+    Returns:
+        dict group name -> (list of decoded images, dict member name -> sha1 of its bytes)
+    """
+    state = _checked_state(archive, cache_dir, checksum)
+    result = {}
+    with ZipFile(archive, "r") as zip_file:
+        for group, folder in groups.items():
+            shard = os.path.join(cache_dir, "archive_{}.npz".format(group))
+            if group in state["groups"] and os.path.exists(shard):
+                with np.load(shard) as data:
+                    images = [data["img_{}".format(i)] for i in range(len(data.files))]
+                result[group] = (images, state["groups"][group])
+                logger.info("{} images of {} are already ingested".format(len(images), group))
+                continue
+            images, sources = [], {}
+            for info in _group_members(zip_file, folder):
+                with zip_file.open(info) as member:
+                    raw = member.read()
+                sources[info.filename] = hashlib.sha1(raw).hexdigest()
+                images.append(np.array(Image.open(io.BytesIO(raw))))
+            arrays = {"img_{}".format(i): img for i, img in enumerate(images)}
+            np.savez(shard + ".tmp.npz", **arrays)
+            os.replace(shard + ".tmp.npz", shard)
+            state["groups"][group] = sources
+            _write_state(cache_dir, state)
+            result[group] = (images, sources)
+            logger.info("{} images of {} are ingested from {}".format(len(images), group, archive))
+    return result
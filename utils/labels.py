@@ -0,0 +1,85 @@
+import hashlib
+import os
+import numpy as np
+
+from utils.patches import window_coords
+
+# Historical threshold on the sum of the ground truth pixels of a patch (20 white pixels)
+DEFAULT_THRESHOLD = 5100
+
+
+def label_threshold(config):
+    """
+    Threshold on the sum of the ground truth pixels of a patch. If anomaly_fraction is set
+    in the data_loader config, a patch is anomalous when more than that fraction of its
+    pixels is white, otherwise the historical 5100 is used.
+    """
+    fraction = config.data_loader.anomaly_fraction
+    if fraction:
+        size = config.data_loader.image_size
+        return int(fraction * size * size * 255)
+    return DEFAULT_THRESHOLD
+
+
+def _integral_image(mask):
+    h, w = mask.shape[:2]
+    sat = np.zeros((h + 1, w + 1), dtype=np.int64)
+    sat[1:, 1:] = mask.reshape(h, w, -1).sum(axis=2, dtype=np.int64).cumsum(0).cumsum(1)
+    return sat
+
+
+def window_sums(mask, rows, cols, size):
+    """
+    Sum of the pixels of every window with a summed area table, no patch is materialized.
+    """
+    sat = _integral_image(mask)
+    return sat[rows + size, cols + size] - sat[rows, cols + size] - sat[rows + size, cols] + sat[rows, cols]
+
+
+def grid_labels(masks, size, stride, threshold, turns=None):
+    """
+    Args:
+        masks: full ground truth masks
+        size: side of the patch
+        stride: step between two consecutive patches
+        threshold: a patch is anomalous when the sum of its pixels is above it
+        turns: optional function (h, w) -> (h_turns, w_turns), as in extract_patches
+    Returns:
+        int32 labels of the patches in the same order as extract_patches
+    """
+    labels = []
+    for mask in masks:
+        h, w = mask.shape[:2]
+        rows, cols = window_coords(h, w, size, stride, turns(h, w) if turns else None)
+        labels.append((window_sums(mask, rows, cols, size) > threshold).astype(np.int32))
+    return np.concatenate(labels)
+
+
+def fingerprint(masks, *params):
+    """
+    Hash of the ground truth masks and of the parameters used to cut them
+    """
+    digest = hashlib.sha1()
+    for mask in masks:
+        digest.update(str(mask.shape).encode())
+        digest.update(np.ascontiguousarray(mask).tobytes())
+    digest.update(repr(params).encode())
+    return digest.hexdigest()[:16]
+
+
+def cached_grid_labels(cache_dir, split, masks, size, stride, threshold, turns=None, key=()):
+    """
+    Same as grid_labels but the labels are stored once in cache_dir, in a file keyed by
+    the fingerprint of the masks and by the threshold.
+    Args:
+        key: extra parameters that change the grid, they are part of the fingerprint
+    """
+    name = "{}_{}_{}.npy".format(split, fingerprint(masks, size, stride, key), threshold)
+    path = os.path.join(cache_dir, name)
+    if os.path.exists(path):
+        return np.load(path)
+    labels = grid_labels(masks, size, stride, threshold, turns)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    np.save(path, labels)
+    return labels
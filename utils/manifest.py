@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+
+MANIFEST_FILE = "manifest.json"
+
+FRESH = "fresh"
+PARTIAL = "partial"
+STALE = "stale"
+
+
+def file_digest(path, block_size=2 ** 20):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_key(path):
+    """
+    Cheap identity of a file, it changes when the file is rewritten
+    """
+    stat = os.stat(path)
+    return [os.path.basename(path), int(stat.st_mtime), stat.st_size]
+
+
+def cached_file_digests(file_names, cache_file):
+    """
+    Same as file_digest for every file, but a digest is only recomputed when the
+    mtime or the size of the file changed since it was stored in cache_file.
+    Returns:
+        list of digests in the order of file_names
+    """
+    cache = {}
+    if os.path.exists(cache_file):
+        with open(cache_file, "r") as f:
+            cache = json.load(f)
+    digests = []
+    for name in file_names:
+        key = json.dumps(file_key(name))
+        entry = cache.get(os.path.abspath(name))
+        if entry is None or entry["key"] != key:
+            entry = {"key": key, "digest": file_digest(name)}
+            cache[os.path.abspath(name)] = entry
+        digests.append(entry["digest"])
+    cache_dir = os.path.dirname(cache_file)
+    if cache_dir and not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    with open(cache_file + ".tmp", "w") as f:
+        json.dump(cache, f)
+    os.replace(cache_file + ".tmp", cache_file)
+    return digests
+
+
+def count_files(directory):
+    """
+    Number of files below directory, the manifest itself excluded
+    """
+    count = 0
+    for root, _, files in os.walk(directory):
+        count += len(files)
+    if os.path.exists(os.path.join(directory, MANIFEST_FILE)):
+        count -= 1
+    return count
+
+
+def read_manifest(directory):
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def write_manifest(directory, status, sources, params, files=None):
+    """
+    Args:
+        directory: folder of the derived split
+        status: "partial" while the split is written, "complete" once it is done
+        sources: dict name -> digest of the source files the split is derived from
+        params: generation parameters of the split
+        files: number of files of the complete split
+    """
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    manifest = {"status": status, "sources": sources, "params": params, "files": files}
+    path = os.path.join(directory, MANIFEST_FILE)
+    # Write then rename so that a crash never leaves a truncated manifest
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def manifest_state(directory, sources, params):
+    """
+    Returns:
+        "fresh" if the split is complete and derived from the same sources and parameters,
+        "partial" if it was interrupted (or lost files) with the same inputs and can be resumed,
+        "stale" otherwise, including splits written before manifests existed
+    """
+    manifest = read_manifest(directory)
+    if manifest is None:
+        return STALE
+    # Round trip through json so that tuples and lists compare equal
+    params = json.loads(json.dumps(params))
+    if manifest["sources"] != sources or manifest["params"] != params:
+        return STALE
+    if manifest["status"] != "complete" or count_files(directory) != manifest["files"]:
+        return PARTIAL
+    return FRESH
@@ -0,0 +1,159 @@
+import os
+import numpy as np
+
+INDEX_FILE = "index.npz"
+IMG_SHARD = "img_{:05d}.npy"
+MASK_SHARD = "mask_{:05d}.npy"
+
+
+class PatchStoreWriter:
+    def __init__(self, directory, shard_size=65536):
+        """
+        Writes a split as fixed-shape uint8 .npy shards and an index file.
+        Args:
+            directory: folder of the split, it is created if missing
+            shard_size: maximum number of patches in one shard
+        """
+        self.directory = directory
+        self.shard_size = shard_size
+        self.shard_sizes = []
+        self.labels = []
+        self.coords = []
+        self.has_masks = None
+        self._img_buffer = []
+        self._mask_buffer = []
+        self._buffered = 0
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def append(self, patches, masks=None, labels=None, coords=None):
+        """
+        Args:
+            patches: uint8 array of shape (N, size, size)
+            masks: optional uint8 array with the ground truth patches aligned with patches
+            labels: optional int array of shape (N,), -1 is stored when missing
+            coords: optional int array of shape (N, 3) with (image, row, col)
+        """
+        if self.has_masks is None:
+            self.has_masks = masks is not None
+        n = len(patches)
+        self.labels.append(
+            np.full(n, -1, dtype=np.int32) if labels is None else np.asarray(labels, np.int32)
+        )
+        self.coords.append(
+            np.full((n, 3), -1, dtype=np.int32) if coords is None else np.asarray(coords, np.int32)
+        )
+        start = 0
+        while start < n:
+            take = min(n - start, self.shard_size - self._buffered)
+            self._img_buffer.append(patches[start : start + take])
+            if self.has_masks:
+                self._mask_buffer.append(masks[start : start + take])
+            self._buffered += take
+            start += take
+            if self._buffered == self.shard_size:
+                self._flush()
+
+    def _flush(self):
+        if self._buffered == 0:
+            return
+        shard = len(self.shard_sizes)
+        np.save(
+            os.path.join(self.directory, IMG_SHARD.format(shard)),
+            np.concatenate(self._img_buffer).astype(np.uint8, copy=False),
+        )
+        if self.has_masks:
+            np.save(
+                os.path.join(self.directory, MASK_SHARD.format(shard)),
+                np.concatenate(self._mask_buffer).astype(np.uint8, copy=False),
+            )
+        self.shard_sizes.append(self._buffered)
+        self._img_buffer = []
+        self._mask_buffer = []
+        self._buffered = 0
+
+    def close(self):
+        """
+        Flushes the last shard and writes the index. A split without index is incomplete.
+        """
+        self._flush()
+        np.savez(
+            os.path.join(self.directory, INDEX_FILE),
+            labels=np.concatenate(self.labels) if self.labels else np.zeros(0, np.int32),
+            coords=np.concatenate(self.coords) if self.coords else np.zeros((0, 3), np.int32),
+            shard_sizes=np.asarray(self.shard_sizes, dtype=np.int64),
+            has_masks=bool(self.has_masks),
+        )
+
+
+class PatchStore:
+    def __init__(self, directory):
+        """
+        Read side of a split written by PatchStoreWriter, shards are opened with np.memmap.
+        Args:
+            directory: folder of the split
+        """
+        self.directory = directory
+        with np.load(os.path.join(self.directory, INDEX_FILE)) as index:
+            self.labels = index["labels"]
+            self.coords = index["coords"]
+            self.shard_sizes = index["shard_sizes"]
+            self.has_masks = bool(index["has_masks"])
+        self.offsets = np.concatenate([[0], np.cumsum(self.shard_sizes)])
+        self.images = [
+            np.load(os.path.join(self.directory, IMG_SHARD.format(i)), mmap_mode="r")
+            for i in range(len(self.shard_sizes))
+        ]
+        self.masks = (
+            [
+                np.load(os.path.join(self.directory, MASK_SHARD.format(i)), mmap_mode="r")
+                for i in range(len(self.shard_sizes))
+            ]
+            if self.has_masks
+            else None
+        )
+
+    @staticmethod
+    def exists(directory):
+        return os.path.exists(os.path.join(directory, INDEX_FILE))
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    @property
+    def patch_shape(self):
+        return self.images[0].shape[1:]
+
+    def blocks(self, block_size, shuffle=False, seed=None):
+        """
+        Yields consecutive blocks of patches as views on the memory mapped shards.
+        Blocks never cross a shard boundary, so no block is copied on the NumPy side.
+        Args:
+            block_size: maximum number of patches in a block
+            shuffle: visit the blocks in a random order
+            seed: seed of the block order
+        Returns:
+            generator of (shard, start, end) tuples
+        """
+        spans = [
+            (shard, start, min(start + block_size, size))
+            for shard, size in enumerate(self.shard_sizes)
+            for start in range(0, int(size), block_size)
+        ]
+        if shuffle:
+            np.random.RandomState(seed).shuffle(spans)
+        for span in spans:
+            yield span
+
+    def block(self, shard, start, end):
+        """
+        Returns:
+            images, masks (or None), labels and coords of the patches in the block
+        """
+        offset = self.offsets[shard]
+        return (
+            self.images[shard][start:end],
+            self.masks[shard][start:end] if self.has_masks else None,
+            self.labels[offset + start : offset + end],
+            self.coords[offset + start : offset + end],
+        )
@@ -0,0 +1,164 @@
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from PIL import Image
+
+
+def num_windows(dim, size, stride):
+    """
+    Number of full windows of the given size that fit along one axis.
+    """
+    return (dim - size) // stride + 1
+
+
+def window_coords(h, w, size, stride, turns=None):
+    """
+    Top-left corners of the windows of a grid, in row major order.
+    Args:
+        h, w: size of the image
+        size: side of the square window
+        stride: step between two consecutive windows
+        turns: optional (h_turns, w_turns) to restrict the grid
+    Returns:
+        rows, cols: int32 arrays of length h_turns * w_turns
+    """
+    if turns is None:
+        turns = (num_windows(h, size, stride), num_windows(w, size, stride))
+    rows, cols = np.meshgrid(
+        np.arange(turns[0]) * stride, np.arange(turns[1]) * stride, indexing="ij"
+    )
+    return rows.ravel().astype(np.int32), cols.ravel().astype(np.int32)
+
+
+def sliding_windows(image, size, stride, turns=None):
+    """
+    Read-only strided view over all the windows of an image, nothing is copied.
+    Args:
+        image: 2D (or 3D with channels last) array
+        size: side of the square window
+        stride: step between two consecutive windows in both directions
+        turns: optional (h_turns, w_turns) to restrict the grid to its first windows
+    Returns:
+        view of shape (h_turns, w_turns, size, size) + channels
+    """
+    h, w = image.shape[:2]
+    if turns is None:
+        turns = (num_windows(h, size, stride), num_windows(w, size, stride))
+    h_turns, w_turns = turns
+    s_h, s_w = image.strides[:2]
+    shape = (h_turns, w_turns, size, size) + image.shape[2:]
+    strides = (s_h * stride, s_w * stride) + image.strides
+    return as_strided(image, shape=shape, strides=strides, writeable=False)
+
+
+def extract_patches(images, tags, size, stride, turns=None):
+    """
+    Cut every image and its ground truth mask into windows in a single pass.
+    Args:
+        images: list of full images
+        tags: list of ground truth masks aligned with images, or None
+        size: side of the square patch
+        stride: step between two consecutive patches
+        turns: optional function (h, w) -> (h_turns, w_turns) that fixes the grid per image
+    Returns:
+        img_patches: contiguous array of shape (N, size, size) + channels
+        tag_patches: contiguous array with the same layout as img_patches, or None
+        coords: int32 array of shape (N, 3) with (image index, row, col) of every patch
+    """
+    img_views, tag_views, coords = [], [], []
+    for ind, img in enumerate(images):
+        h, w = img.shape[:2]
+        grid = turns(h, w) if turns is not None else None
+        view = sliding_windows(img, size, stride, grid)
+        h_turns, w_turns = view.shape[:2]
+        img_views.append(view.reshape((-1,) + view.shape[2:]))
+        if tags is not None:
+            tag_view = sliding_windows(tags[ind], size, stride, (h_turns, w_turns))
+            tag_views.append(tag_view.reshape((-1,) + tag_view.shape[2:]))
+        rows, cols = window_coords(h, w, size, stride, (h_turns, w_turns))
+        coord = np.empty((h_turns * w_turns, 3), dtype=np.int32)
+        coord[:, 0] = ind
+        coord[:, 1] = rows
+        coord[:, 2] = cols
+        coords.append(coord)
+    img_patches = np.ascontiguousarray(np.concatenate(img_views))
+    tag_patches = np.ascontiguousarray(np.concatenate(tag_views)) if tags is not None else None
+    return img_patches, tag_patches, np.concatenate(coords)
+
+
+def random_crops(images, size, num_per_image, rng=np.random):
+    """
+    Sample random square crops from every image with vectorized indexing on the windows view.
+    Args:
+        images: list of full images
+        size: side of the square crop
+        num_per_image: number of crops taken from each image
+        rng: object exposing randint, either np.random or a np.random.RandomState
+    Returns:
+        crops: contiguous array of shape (len(images) * num_per_image, size, size) + channels
+        coords: int32 array of shape (N, 3) with (image index, top, left) of every crop
+    """
+    crops, coords = [], []
+    for ind, img in enumerate(images):
+        h, w = img.shape[:2]
+        top = rng.randint(0, h - size, size=num_per_image)
+        left = rng.randint(0, w - size, size=num_per_image)
+        view = sliding_windows(img, size, 1)
+        crops.append(view[top, left])
+        coord = np.empty((num_per_image, 3), dtype=np.int32)
+        coord[:, 0] = ind
+        coord[:, 1] = top
+        coord[:, 2] = left
+        coords.append(coord)
+    return np.concatenate(crops), np.concatenate(coords)
+
+
+def pyramid_crops(images, sizes, num_per_image, rng=np.random, scale=False):
+    """
+    Aligned random crops of several sizes cut from the same decode of every image. The
+    positions are drawn once for the largest size and every level shares their centers.
+    With scale, every level covers the field of view of the largest size instead, it is cut
+    from a copy of the full image resized by size / max(sizes).
+    Args:
+        images: list of full images
+        sizes: sides of the square crops of the levels
+        num_per_image: number of crops taken from each image
+        rng: object exposing randint, either np.random or a np.random.RandomState
+        scale: downsample the largest crops instead of cutting smaller ones
+    Returns:
+        crops: dict size -> contiguous array of shape (len(images) * num_per_image, size, size)
+        coords: dict size -> int32 array of shape (N, 3) with (image index, top, left) of every
+            crop in the image its level is cut from
+    """
+    largest = max(sizes)
+    crops = {size: [] for size in sizes}
+    coords = {size: [] for size in sizes}
+    for ind, img in enumerate(images):
+        h, w = img.shape[:2]
+        top = rng.randint(0, h - largest, size=num_per_image)
+        left = rng.randint(0, w - largest, size=num_per_image)
+        for size in sizes:
+            if scale and size != largest:
+                factor = size / largest
+                source = np.asarray(
+                    Image.fromarray(img).resize(
+                        (int(round(w * factor)), int(round(h * factor))), Image.BILINEAR
+                    )
+                )
+                level_top = np.minimum(np.round(top * factor).astype(int), source.shape[0] - size)
+                level_left = np.minimum(
+                    np.round(left * factor).astype(int), source.shape[1] - size
+                )
+            else:
+                source = img
+                level_top = top + (largest - size) // 2
+                level_left = left + (largest - size) // 2
+            view = sliding_windows(source, size, 1)
+            crops[size].append(view[level_top, level_left])
+            coord = np.empty((num_per_image, 3), dtype=np.int32)
+            coord[:, 0] = ind
+            coord[:, 1] = level_top
+            coord[:, 2] = level_left
+            coords[size].append(coord)
+    crops = {size: np.concatenate(x) for size, x in crops.items()}
+    coords = {size: np.concatenate(x) for size, x in coords.items()}
+    return crops, coords
@@ -0,0 +1,70 @@
+import tensorflow as tf
+
+
+def latent_noise(batch_size, noise_dim, seed=None):
+    """
+    Standard normal noise of the latent space
+    Args:
+        batch_size: scalar tensor, number of noise vectors
+        noise_dim: size of the latent space
+        seed: op seed
+    """
+    return tf.random.normal([batch_size, noise_dim], seed=seed)
+
+
+def _flip_some(labels, noise_probability, seed=None):
+    # Same as flipping labels[np.random.choice(n, int(p * n))], indices can be drawn twice
+    n = tf.shape(labels)[0]
+    count = tf.cast(tf.floor(noise_probability * tf.cast(n, tf.float32)), tf.int32)
+    flipped_idx = tf.random.uniform([count], 0, n, dtype=tf.int32, seed=seed)
+    flipped = tf.reduce_any(tf.equal(flipped_idx[:, None], tf.range(n)[None, :]), axis=0)
+    return tf.where(flipped, 1 - labels, labels)
+
+
+def discriminator_labels(
+    batch_size, soft_labels=False, flip_labels=False, noise_probability=0.0, seed=None
+):
+    """
+    Targets of the discriminator for the real and the generated images. Soft labels are
+    drawn in [0.9, 1] and [0, 0.1] and a noise_probability fraction of them is flipped.
+    Args:
+        batch_size: scalar tensor, number of labels
+        soft_labels: use noisy soft labels instead of ones and zeros
+        flip_labels: swap the real and the generated targets
+        noise_probability: fraction of the soft labels that are flipped
+        seed: op seed, the other ops use the next seeds
+    Returns:
+        true_labels, generated_labels of shape [batch_size, 1]
+    """
+    if not soft_labels:
+        true_labels = tf.ones([batch_size, 1])
+        generated_labels = tf.zeros([batch_size, 1])
+    else:
+        seeds = [None] * 4 if seed is None else [seed + i for i in range(4)]
+        generated_labels = tf.random.uniform([batch_size, 1], 0.0, 0.1, seed=seeds[0])
+        generated_labels = _flip_some(generated_labels, noise_probability, seeds[1])
+        true_labels = 1 - tf.random.uniform([batch_size, 1], 0.0, 0.1, seed=seeds[2])
+        true_labels = _flip_some(true_labels, noise_probability, seeds[3])
+    if flip_labels:
+        return generated_labels, true_labels
+    return true_labels, generated_labels
+
+
+def instance_noise(
+    shape, epoch, include_noise=False, sigma_start=0.75, sigma_min=0.05, seed=None
+):
+    """
+    Instance noise added to the inputs of the discriminator, its standard deviation is
+    annealed linearly from sigma_start at epoch 0 and never goes below sigma_min.
+    Args:
+        shape: shape of the noise, batch dimension included
+        epoch: epoch counter of the model
+        include_noise: zeros are returned when False
+        sigma_start: standard deviation at the first epoch, it reaches 0 at epoch 10
+        sigma_min: lower bound of the standard deviation
+        seed: op seed
+    """
+    if not include_noise:
+        return tf.zeros(shape)
+    sigma = tf.maximum(sigma_start * (10.0 - tf.cast(epoch, tf.float32)) / 10, sigma_min)
+    return sigma * tf.random.normal(shape, seed=seed)
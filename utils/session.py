@@ -0,0 +1,23 @@
+import os
+
+import tensorflow as tf
+
+
+def session_config(config):
+    """
+    Threading of the session. The replicas of the data parallel training run concurrently
+    on the inter op threads, each op of a replica then gets its share of the cores.
+    Args:
+        config: config of the experiment, intra_op_threads and inter_op_threads of its
+            trainer section override the defaults when they are set and above 0
+    Returns:
+        tf.ConfigProto
+    """
+    replicas = config.trainer.replicas or 1
+    # Without replicas, 0 lets TensorFlow pick
+    default_intra_op_threads = max(os.cpu_count() // replicas, 1) if replicas > 1 else 0
+    intra_op_threads = config.trainer.intra_op_threads or default_intra_op_threads
+    return tf.ConfigProto(
+        intra_op_parallelism_threads=intra_op_threads,
+        inter_op_parallelism_threads=config.trainer.inter_op_threads or 0,
+    )
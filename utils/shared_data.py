@@ -0,0 +1,168 @@
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from shutil import copytree, rmtree
+
+import numpy as np
+
+SHARED_INDEX = "shared.json"
+
+
+def _read_index(directory):
+    path = os.path.join(directory, SHARED_INDEX)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _lock_file(directory, exclusive):
+    """
+    Opens and locks directory.lock, the publishers of a folder take it exclusive and its
+    readers shared
+    Returns:
+        the open lock file, closing it releases the lock
+    """
+    parent = os.path.dirname(directory)
+    if parent and not os.path.exists(parent):
+        os.makedirs(parent, exist_ok=True)
+    f = open(directory + ".lock", "a")
+    fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+    return f
+
+
+@contextmanager
+def _locked(directory, exclusive):
+    f = _lock_file(directory, exclusive)
+    try:
+        yield
+    finally:
+        f.close()
+
+
+def _publish_directory(directory, key, write):
+    """
+    Fills a temporary folder with write(folder) and renames it to directory, so that the
+    attaching processes never see a half written copy. The publishers of a folder take its
+    lock file in turn: the first one writes it and the next ones find it published.
+    Processes that still map the files of a replaced copy keep valid views, the files are
+    only freed once they are all unmapped.
+    Args:
+        directory: published folder, usually under /dev/shm
+        key: identity of the content, a folder with another key is replaced
+        write: function filling the folder, it returns the extra fields of the index
+    """
+    index = _read_index(directory)
+    if index is not None and index["key"] == key:
+        return
+    with _locked(directory, exclusive=True):
+        # Another process may have published the folder while this one waited for the lock
+        index = _read_index(directory)
+        if index is not None and index["key"] == key:
+            return
+        tmp = "{}.tmp.{}".format(directory, os.getpid())
+        if os.path.exists(tmp):
+            rmtree(tmp)
+        fields = write(tmp) or {}
+        with open(os.path.join(tmp, SHARED_INDEX), "w") as f:
+            json.dump(dict(fields, key=key), f)
+        old = None
+        if os.path.exists(directory):
+            old = "{}.old.{}".format(directory, os.getpid())
+            os.rename(directory, old)
+        os.rename(tmp, directory)
+        if old is not None:
+            rmtree(old)
+
+
+def publish_arrays(directory, key, arrays):
+    """
+    Writes the arrays as .npy files in directory. Lists of images with different shapes are
+    written one file per image.
+    Args:
+        directory: published folder, usually under /dev/shm
+        key: identity of the content
+        arrays: dict name -> array or list of arrays
+    """
+
+    def write(folder):
+        os.makedirs(folder)
+        counts = {}
+        for name, value in arrays.items():
+            if isinstance(value, np.ndarray) and value.dtype != object:
+                np.save(os.path.join(folder, "{}.npy".format(name)), value)
+                counts[name] = None
+            else:
+                for i, x in enumerate(value):
+                    np.save(os.path.join(folder, "{}_{:05d}.npy".format(name, i)), x)
+                counts[name] = len(value)
+        return {"counts": counts}
+
+    _publish_directory(directory, key, write)
+
+
+def attach_arrays(directory, key):
+    """
+    Read only memory mapped views on the arrays of publish_arrays, nothing is copied and
+    every process attached to the same folder shares the same pages.
+    Returns:
+        dict name -> array or list of arrays, None if nothing with this key is published
+    """
+    if _read_index(directory) is None:
+        return None
+    # The folder is not replaced while its files are mapped
+    with _locked(directory, exclusive=False):
+        index = _read_index(directory)
+        if index is None or index["key"] != key:
+            return None
+        arrays = {}
+        for name, count in index["counts"].items():
+            if count is None:
+                arrays[name] = np.load(
+                    os.path.join(directory, "{}.npy".format(name)), mmap_mode="r"
+                )
+            else:
+                arrays[name] = [
+                    np.load(
+                        os.path.join(directory, "{}_{:05d}.npy".format(name, i)), mmap_mode="r"
+                    )
+                    for i in range(count)
+                ]
+    return arrays
+
+
+def share_directory(source, directory, key):
+    """
+    Copies a prepared split, e.g. the shards of a patch store, to directory once
+    Returns:
+        directory
+    """
+
+    def write(folder):
+        copytree(source, folder)
+
+    _publish_directory(directory, key, write)
+    return directory
+
+
+def hold(directory):
+    """
+    Keeps a published folder from being replaced or removed by the other processes until
+    the returned file is closed
+    Returns:
+        the open lock file of the folder
+    """
+    return _lock_file(directory, exclusive=False)
+
+
+def unpublish(directory):
+    """
+    Removes a published folder once no process holds it, the processes that still map its
+    files keep valid views
+    """
+    with _locked(directory, exclusive=True):
+        if os.path.exists(directory):
+            old = "{}.old.{}".format(directory, os.getpid())
+            os.rename(directory, old)
+            rmtree(old)
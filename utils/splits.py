@@ -0,0 +1,75 @@
+import hashlib
+import os
+import numpy as np
+
+
+def split_mask(n, fraction, seed, groups=None):
+    """
+    Seeded train/validation split without replacement.
+    Args:
+        n: number of samples
+        fraction: fraction of the samples that goes to validation
+        seed: seed of the permutation
+        groups: optional array of length n, samples of the same group (e.g. the source image)
+            always end up on the same side. Whole groups are taken until the fraction is reached
+    Returns:
+        boolean mask of length n, True for the validation samples
+    """
+    rng = np.random.RandomState(seed)
+    mask = np.zeros(n, dtype=bool)
+    if fraction <= 0:
+        return mask
+    if groups is None:
+        mask[rng.permutation(n)[: int(round(n * fraction))]] = True
+        return mask
+    groups = np.asarray(groups)
+    unique, inverse, counts = np.unique(groups, return_inverse=True, return_counts=True)
+    order = rng.permutation(len(unique))
+    # Smallest prefix of the shuffled groups that covers the requested fraction
+    taken = np.searchsorted(np.cumsum(counts[order]), n * fraction) + 1
+    chosen = np.zeros(len(unique), dtype=bool)
+    chosen[order[: min(taken, len(unique) - 1)]] = True
+    return chosen[inverse]
+
+
+def kfold_assignments(n, k, seed, groups=None):
+    """
+    Args:
+        n: number of samples
+        k: number of folds
+        seed: seed of the permutation
+        groups: optional array of length n, a group is never spread across folds
+    Returns:
+        int array of length n with the fold of every sample
+    """
+    rng = np.random.RandomState(seed)
+    if groups is None:
+        folds = np.empty(n, dtype=np.int32)
+        folds[rng.permutation(n)] = np.arange(n) % k
+        return folds
+    unique, inverse = np.unique(np.asarray(groups), return_inverse=True)
+    group_folds = np.empty(len(unique), dtype=np.int32)
+    group_folds[rng.permutation(len(unique))] = np.arange(len(unique)) % k
+    return group_folds[inverse]
+
+
+def cached_kfold_assignments(cache_dir, n, k, seed, groups=None):
+    """
+    Same as kfold_assignments but the folds are derived once and stored in cache_dir. The
+    name of the cache holds a digest of the groups, other groupings get their own folds.
+    """
+    if groups is None:
+        grouping = "flat"
+    else:
+        groups = np.ascontiguousarray(groups)
+        digest = hashlib.sha1(str(groups.dtype).encode() + groups.tobytes()).hexdigest()
+        grouping = "grouped_{}".format(digest[:16])
+    name = "folds_n{}_k{}_s{}_{}.npy".format(n, k, seed, grouping)
+    path = os.path.join(cache_dir, name)
+    if os.path.exists(path):
+        return np.load(path)
+    folds = kfold_assignments(n, k, seed, groups)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    np.save(path, folds)
+    return folds
@@ -20,6 +20,53 @@ class Summarizer:
         self.test_summary_writer = tf.summary.FileWriter(
             os.path.join(self.config.log.summary_dir, "test"), self.sess.graph
         )
+        # Train summaries are evaluated every summary_steps global steps
+        self.summary_steps = self.config.log.summary_steps or 100
+        self.no_summary = tf.constant("", name="no_summary")
+        self.global_step = 0
+        self.last_steps = {}
+
+    def _writer(self, summarizer):
+        if summarizer == "train":
+            return self.train_summary_writer
+        elif summarizer == "valid":
+            return self.valid_summary_writer
+        elif summarizer == "valid_2":
+            return self.valid_summary_writer_2
+        elif summarizer == "test":
+            return self.test_summary_writer
+
+    def scheduled(self, summary_op, global_step):
+        """
+        Fetch for the next train run of summary_op and the global step. The summary op is
+        only evaluated once summary_steps global steps went by since it was last written,
+        an empty summary is fetched instead otherwise.
+        Args:
+            summary_op: merged summary op, None when the model has no summaries
+            global_step: global step tensor of the model
+        Returns:
+            fetch whose result is passed to write
+        """
+        due = False
+        if summary_op is not None:
+            last = self.last_steps.get(summary_op)
+            due = last is None or self.global_step - last >= self.summary_steps
+            if due:
+                self.last_steps[summary_op] = self.global_step
+        return summary_op if due else self.no_summary, global_step
+
+    def write(self, result, summarizer="train"):
+        """
+        Writes a summary fetched with scheduled right away, at its global step
+        Args:
+            result: (serialized summary, global step), or None for a run without summary
+            summarizer: name of the summary writer
+        """
+        if result is None:
+            return
+        summary, self.global_step = result
+        if summary:
+            self._writer(summarizer).add_summary(summary, self.global_step)
 
     # it can summarize scalars and images.
     def add_tensorboard(self, step, summarizer="train", scope="", summaries=None):
@@ -30,15 +77,10 @@ class Summarizer:
         :param summaries_dict: the dict of the summaries values (tag,value)
         :return:
         """
-        if summarizer == "train":
-            summary_writer = self.train_summary_writer
-        elif summarizer == "valid":
-            summary_writer = self.valid_summary_writer
-        elif summarizer == "valid_2":
-            summary_writer = self.valid_summary_writer_2
-        elif summarizer == "test":
-            summary_writer = self.test_summary_writer
+        summary_writer = self._writer(summarizer)
         with tf.variable_scope(scope):
             for summary in summaries:
-                summary_writer.add_summary(summary, step)
+                # Steps without summaries, e.g. the fused train steps, give None
+                if summary is not None:
+                    summary_writer.add_summary(summary, step)
             summary_writer.flush()
@@ -0,0 +1,141 @@
+import json
+import os
+import numpy as np
+import tensorflow as tf
+
+INDEX_FILE = "index.json"
+RECORD_SHARD = "shard_{:05d}.tfrecord"
+
+
+def standardize(patches):
+    """
+    NumPy version of tf.image.per_image_standardization applied to every patch
+    Returns:
+        float32 array with the shape of patches
+    """
+    flat = patches.reshape(len(patches), -1).astype(np.float32)
+    mean = flat.mean(axis=1, keepdims=True)
+    adjusted_std = np.maximum(flat.std(axis=1, keepdims=True), 1.0 / np.sqrt(flat.shape[1]))
+    return ((flat - mean) / adjusted_std).reshape(patches.shape)
+
+
+def record_features(masks=False):
+    """
+    Parsing spec of the records written by RecordShardWriter
+    """
+    features = {
+        "image": tf.FixedLenFeature([], tf.string),
+        "label": tf.FixedLenFeature([], tf.int64),
+        "coords": tf.FixedLenFeature([3], tf.int64),
+    }
+    if masks:
+        features["mask"] = tf.FixedLenFeature([], tf.string)
+    return features
+
+
+def _bytes_feature(value):
+    return tf.train.Feature(bytes_list=tf.train.BytesList(value=[value]))
+
+
+def _int64_feature(values):
+    return tf.train.Feature(int64_list=tf.train.Int64List(value=values))
+
+
+class RecordShardWriter:
+    def __init__(self, directory, shard_size=16384, standardize=False):
+        """
+        Writes a split as TFRecord shards, one tf.train.Example per patch with the raw
+        patch bytes, its label and its (image, row, col) coordinates.
+        Args:
+            directory: folder of the split, it is created if missing
+            shard_size: maximum number of patches in one shard
+            standardize: store float32 standardized patches instead of the uint8 ones
+        """
+        self.directory = directory
+        self.shard_size = shard_size
+        self.standardize = standardize
+        self.shard_sizes = []
+        self.patch_shape = None
+        self.has_masks = None
+        self._writer = None
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def append(self, patches, masks=None, labels=None, coords=None):
+        """
+        Args:
+            patches: uint8 array of shape (N, size, size)
+            masks: optional uint8 array with the ground truth patches aligned with patches
+            labels: optional int array of shape (N,), -1 is stored when missing
+            coords: optional int array of shape (N, 3) with (image, row, col)
+        """
+        if self.has_masks is None:
+            self.has_masks = masks is not None
+            self.patch_shape = list(patches.shape[1:])
+        n = len(patches)
+        labels = np.full(n, -1) if labels is None else np.asarray(labels)
+        coords = np.full((n, 3), -1) if coords is None else np.asarray(coords)
+        images = standardize(patches) if self.standardize else patches.astype(np.uint8, copy=False)
+        for i in range(n):
+            if self._writer is None or self.shard_sizes[-1] == self.shard_size:
+                self._next_shard()
+            feature = {
+                "image": _bytes_feature(images[i].tobytes()),
+                "label": _int64_feature([int(labels[i])]),
+                "coords": _int64_feature([int(x) for x in coords[i]]),
+            }
+            if self.has_masks:
+                feature["mask"] = _bytes_feature(masks[i].astype(np.uint8, copy=False).tobytes())
+            example = tf.train.Example(features=tf.train.Features(feature=feature))
+            self._writer.write(example.SerializeToString())
+            self.shard_sizes[-1] += 1
+
+    def _next_shard(self):
+        if self._writer is not None:
+            self._writer.close()
+        path = os.path.join(self.directory, RECORD_SHARD.format(len(self.shard_sizes)))
+        self._writer = tf.python_io.TFRecordWriter(path)
+        self.shard_sizes.append(0)
+
+    def close(self):
+        """
+        Closes the last shard and writes the index. A split without index is incomplete.
+        """
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        index = {
+            "shard_sizes": self.shard_sizes,
+            "patch_shape": self.patch_shape,
+            "has_masks": bool(self.has_masks),
+            "standardized": bool(self.standardize),
+        }
+        with open(os.path.join(self.directory, INDEX_FILE), "w") as f:
+            json.dump(index, f, indent=2)
+
+
+class RecordShards:
+    def __init__(self, directory):
+        """
+        Read side of a split written by RecordShardWriter
+        Args:
+            directory: folder of the split
+        """
+        self.directory = directory
+        with open(os.path.join(self.directory, INDEX_FILE), "r") as f:
+            index = json.load(f)
+        self.shard_sizes = index["shard_sizes"]
+        self.patch_shape = index["patch_shape"]
+        self.has_masks = index["has_masks"]
+        self.standardized = index["standardized"]
+        self.files = [
+            os.path.join(self.directory, RECORD_SHARD.format(i))
+            for i in range(len(self.shard_sizes))
+        ]
+
+    @staticmethod
+    def exists(directory):
+        return os.path.exists(os.path.join(directory, INDEX_FILE))
+
+    def __len__(self):
+        return int(sum(self.shard_sizes))